@@ -157,6 +157,9 @@ install_dependencies() {
             exit 1
         fi
 
+        # Optional faster JSON parser; the app falls back to stdlib json without it
+        sudo -u "$REAL_USER" -H "${VENV_DIR}/bin/python3" -m pip install --only-binary=:all: orjson >> "$output_file" 2>&1 || true
+
         chown -R "$REAL_USER:$REAL_USER" "$VENV_DIR"
         
         echo "100"
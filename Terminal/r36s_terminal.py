@@ -1,22 +1,35 @@
 #!/usr/bin/env python3
 import sys
+import bisect
 import ctypes
+import codecs
+import fcntl
+import functools
+import getpass
+import math
+import pty
+import pwd
+import queue
+import signal
+import socket
 import sdl2
 import sdl2.ext
 import threading
 import time
+import itertools
 import json
 import os
 import subprocess
-import signal
 import re
-import math
-import getpass
-import socket
+import selectors
 import shlex
 import shutil
-from datetime import datetime
-from collections import deque
+from collections import OrderedDict, deque
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # -----------------------------
 # Config File Management
@@ -28,6 +41,7 @@ DEFAULT_CONFIG = {
     "screen_height": 480,
     "max_input_length": 2500,
     "max_history": 100,
+    "max_output_lines": 500,
     "history_file": "command_history.json",
     "shell": "/bin/bash",
     "theme_settings": {
@@ -64,12 +78,29 @@ DEFAULT_CONFIG = {
     }
 }
 
+def json_loads(data):
+    """Parse JSON bytes, preferring orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(payload):
+    """Serialize payload to indented JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+    return json.dumps(payload, indent=2).encode("utf-8")
+
+last_saved_config = None  # Bytes last read from or written to CONFIG_FILE
+
 def load_config():
     """Load configuration from file or create default"""
+    global last_saved_config
     if os.path.exists(CONFIG_FILE):
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
+            with open(CONFIG_FILE, 'rb') as f:
+                data = f.read()
+                config = json_loads(data)
+                last_saved_config = data
                 print(f"[Config] Loaded from {CONFIG_FILE}")
                 config = merge_config(config)
                 return config
@@ -82,10 +113,18 @@ def load_config():
     return DEFAULT_CONFIG
 
 def save_config(config):
-    """Save configuration to file"""
+    """Save configuration to file (atomically, and only when it changed)"""
+    global last_saved_config
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4)
+        # Stdlib formatting (4-space indent, ASCII escapes) keeps existing config files byte-compatible
+        data = json.dumps(config, indent=4).encode("utf-8")
+        if data == last_saved_config:
+            return True
+        temp_path = CONFIG_FILE + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, CONFIG_FILE)
+        last_saved_config = data
         return True
     except Exception as e:
         print(f"[Config] Error saving config: {e}")
@@ -106,6 +145,11 @@ config = load_config()
 SCREEN_WIDTH = config.get("screen_width", DEFAULT_CONFIG["screen_width"])
 SCREEN_HEIGHT = config.get("screen_height", DEFAULT_CONFIG["screen_height"])
 MAX_INPUT_LENGTH = config.get("max_input_length", DEFAULT_CONFIG["max_input_length"])
+try:
+    # Like max_history, 0 or null keeps every line
+    MAX_OUTPUT_LINES = max(0, int(config.get("max_output_lines", DEFAULT_CONFIG["max_output_lines"]) or 0)) or None
+except (TypeError, ValueError):
+    MAX_OUTPUT_LINES = DEFAULT_CONFIG["max_output_lines"]
 SHELL_PATH = config.get("shell", DEFAULT_CONFIG["shell"])
 theme_settings = config.get("theme_settings", DEFAULT_CONFIG["theme_settings"])
 char_width = 8
@@ -114,13 +158,36 @@ UI_FONT_SIZE = 14
 ui_font_manager = None
 ui_char_width = 8
 ui_char_height = 16
+FONT_BUCKET_LIMIT = 4  # (font_path, font_size) combinations kept loaded, with their glyph textures
+font_buckets = OrderedDict()  # (font_path, font_size) -> (font, large, ui, char size, ui char size)
 
 def update_font_managers(font_path, font_size=None):
+    """Switch to font_path/font_size, reusing recently used fonts and their cached glyphs"""
     global font_manager, font_manager_large, char_width, char_height
     global ui_font_manager, ui_char_width, ui_char_height
     if font_size is None:
-        font_size = theme_settings.get("font_size", 14)
+        font_size = theme_settings["font_size"]
     font_size = max(10, min(20, int(font_size)))
+    key = (font_path, font_size)
+    bucket = font_buckets.get(key)
+    if bucket is None:
+        load_font_managers(font_path, font_size)
+        bucket = font_buckets[key] = (
+            font_manager, font_manager_large, ui_font_manager,
+            (char_width, char_height), (ui_char_width, ui_char_height),
+        )
+        if len(font_buckets) > FONT_BUCKET_LIMIT:
+            _, evicted = font_buckets.popitem(last=False)
+            drop_font_textures(evicted[:3])
+        return
+    font_buckets.move_to_end(key)
+    font_manager, font_manager_large, ui_font_manager = bucket[:3]
+    char_width, char_height = bucket[3]
+    ui_char_width, ui_char_height = bucket[4]
+
+def load_font_managers(font_path, font_size):
+    global font_manager, font_manager_large, char_width, char_height
+    global ui_font_manager, ui_char_width, ui_char_height
     large_size = font_size + 2
     if font_path:
         try:
@@ -261,15 +328,17 @@ DEFAULT_THEME_PRESETS = {
     }
 }
 
+HEX_BYTE_LUT = {f"{i:02x}": i for i in range(256)}
+
 def hex_to_rgb(value):
     if not isinstance(value, str):
         return None
-    value = value.strip().lstrip("#")
+    value = value.strip().lstrip("#").lower()
     if len(value) != 6:
         return None
     try:
-        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
-    except ValueError:
+        return (HEX_BYTE_LUT[value[0:2]], HEX_BYTE_LUT[value[2:4]], HEX_BYTE_LUT[value[4:6]])
+    except KeyError:
         return None
 
 def build_theme_from_palette(palette, fallback):
@@ -306,13 +375,15 @@ def load_theme_presets():
     themes_dir = os.path.join(APP_ROOT, "Themes")
     if not os.path.isdir(themes_dir):
         return presets
-    for filename in sorted(os.listdir(themes_dir)):
-        if not filename.lower().endswith(".json"):
-            continue
+    filenames = sorted(
+        filename for filename in os.listdir(themes_dir)
+        if filename.lower().endswith(".json")
+    )
+    for filename in filenames:
         path = os.path.join(themes_dir, filename)
         try:
-            with open(path, "r") as handle:
-                palette = json.load(handle)
+            with open(path, "rb") as handle:
+                palette = json_loads(handle.read())
         except Exception:
             continue
         base_name = palette.get("name") or os.path.splitext(filename)[0]
@@ -323,6 +394,7 @@ def load_theme_presets():
     return presets
 
 THEME_PRESETS = load_theme_presets()
+THEME_PRESET_NAMES = tuple(THEME_PRESETS)
 
 def apply_theme_setting(key, value):
     theme_settings[key] = value
@@ -330,13 +402,29 @@ def apply_theme_setting(key, value):
     save_config(config)
 
 def get_active_theme():
-    selected = theme_settings.get("selected_theme", "Classic")
+    selected = theme_settings["selected_theme"]
     if selected not in THEME_PRESETS:
         selected = "Classic"
     return THEME_PRESETS[selected]
 
+color_cache = {}
+
 def make_color(rgb, alpha=255):
-    return sdl2.ext.Color(rgb[0], rgb[1], rgb[2], alpha)
+    """Return a shared sdl2.ext.Color for rgb/alpha (treat it as read-only)"""
+    key = (rgb[0], rgb[1], rgb[2], alpha)
+    color = color_cache.get(key)
+    if color is None:
+        color = color_cache[key] = sdl2.ext.Color(*key)
+    return color
+
+theme_color_cache = {}  # id(theme) -> (theme, {name: opaque color})
+
+def get_theme_colors(theme):
+    """Opaque make_color() of every theme entry, built once per theme"""
+    entry = theme_color_cache.get(id(theme))
+    if entry is None or entry[0] is not theme:
+        entry = theme_color_cache[id(theme)] = (theme, {name: make_color(rgb) for name, rgb in theme.items()})
+    return entry[1]
 
 # Load button mapping
 button_map = config.get("button_mapping", DEFAULT_CONFIG["button_mapping"])
@@ -355,6 +443,15 @@ BTN_DPAD_RIGHT = button_map.get("DPAD_RIGHT", 11)
 BTN_START = button_map.get("START", 12)
 BTN_SELECT = button_map.get("SELECT", 13)
 BTN_GUIDE = button_map.get("GUIDE", 16)
+DPAD_BUTTONS = frozenset((BTN_DPAD_UP, BTN_DPAD_DOWN, BTN_DPAD_LEFT, BTN_DPAD_RIGHT))
+# Held buttons live in one int (bit n = button n), so combos are a single AND
+BIT_L1 = 1 << BTN_L1
+BIT_R1 = 1 << BTN_R1
+BIT_L2 = 1 << BTN_L2
+BIT_R2 = 1 << BTN_R2
+BIT_START = 1 << BTN_START
+BIT_SELECT = 1 << BTN_SELECT
+EXIT_COMBO_BITS = BIT_START | BIT_SELECT
 
 print(f"[Config] Button mapping loaded:")
 print(f"  Exit combo: Start({BTN_START}) + Select({BTN_SELECT})")
@@ -367,33 +464,280 @@ output_scroll = 0
 # -----------------------------
 # PTY Terminal Emulator
 # -----------------------------
+# OSC and other string sequences come first so their payload is removed along with the introducer
+ANSI_ESCAPE_PATTERN = re.compile(
+    r'\x1B\][^\x07]*\x07'
+    r'|\x1B[P\]X^_][^\x1B\\]*(?:\x1B\\)?'
+    r'|\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])'
+)
+# Drop control characters except tab and newline (covers carriage returns and bell)
+CONTROL_CHAR_TRANSLATION = dict.fromkeys(
+    [code for code in range(32) if chr(code) not in '\t\n'] + [127]
+)
+
+# One token per escape sequence, line control character or run of plain text
+PTY_TOKEN_PATTERN = re.compile(
+    r'\x1b\[[0-?]*[ -/]*[@-~]'
+    r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'
+    r'|\x1bO.'
+    r'|\x1b[ -/]+[0-~]'
+    r'|\x1b[0-NP-Z\\^-~]?'
+    r'|[\n\r\b\x7f]'
+    r'|[^\x1b\n\r\b\x7f]+'
+)
+# An escape sequence cut off by the end of a read
+PTY_ESCAPE_PREFIX_PATTERN = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*|O|[ -/]+)?')
+# Cursor moves and erase-to-end-of-line: CSI [n] C/D/K or SS3 C/D
+PTY_CURSOR_SEQUENCE_PATTERN = re.compile(r'\x1b(?:\[([0-?]*)[ -/]*([CDK])|O([CD]))')
+PTY_READ_SIZE = 65536  # Drain a whole output burst per read; the incremental decoder carries split UTF-8
+PROCESS_READ_SIZE = 65536  # Block size for draining foreground command pipes
+# Line breaks as text-mode pipes see them (universal newlines)
+PROCESS_NEWLINE_PATTERN = re.compile(r'\r\n|\r|\n')
+
+COMMAND_ALIASES = {
+    "py": "python3",
+    "python": "python3",
+    "ipy": "ipython3",
+    "ipython": "ipython3",
+}
+# Commands that need a PTY because they drive the terminal themselves
+INTERACTIVE_COMMANDS = frozenset({
+    "nano", "vim", "vi", "emacs", "top", "htop", "less", "more", "man",
+    "python", "python3", "ipython", "ipython3", "bash", "sh", "zsh", "fish",
+    "sudo", "su", "doas", "ssh", "sftp",
+})
+# Ctrl+key -> (control code, label); a letter maps to its alphabet position (A=1, B=2, ...)
+CTRL_KEY_CODES = {
+    letter: (chr(ord(letter.lower()) - ord("a") + 1), letter.upper())
+    for letter in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+}
+CTRL_KEY_CODES.update({
+    " ": ("\x00", "Space"),
+    "\\": ("\x1c", "\\"),
+    "]": ("\x1d", "]"),
+    "_": ("\x1f", "_"),
+})
+# Shorthands Tab expands in place when typed as the command word
+COMPLETION_ALIASES = {
+    "py": "python3",
+    "python": "python3",
+    "ipy": "ipython3",
+    "v": "vim",
+    "n": "nano",
+    "ll": "ls -lah",
+    "la": "ls -a",
+    "cls": "clear",
+    "h": "history",
+}
+HISTORY_COMPACT_INTERVAL = 50  # Log appends between full history snapshots
+HISTORY_SAVE_DELAY = 0.25  # Seconds the history writer waits to batch rapid submissions
+COMMAND_INDEX_TTL = 5.0  # Seconds before Tab completion rescans PATH for new executables
+
+@functools.lru_cache(maxsize=32)
+def get_user_home(user_name):
+    """Home directory from the passwd database, cached per user (None if unknown)"""
+    try:
+        return pwd.getpwnam(user_name).pw_dir
+    except KeyError:
+        return None
+
+class LineStore:
+    """Ring buffer of output lines with their wrapped rows and highlight runs.
+
+    Each raw line is wrapped and tokenized once, when it is appended, into
+    rows of (text, theme color key) runs, so drawing never re-wraps or
+    re-highlights. Layout is redone only when the glyph width changes.
+    """
+
+    def __init__(self, maxlen=500):
+        # maxlen None keeps every line
+        self.raw = deque(maxlen=maxlen)
+        self.rows = deque(maxlen=maxlen)
+        self.row_total = 0
+        self.layout_char_width = None
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def append(self, line):
+        if len(self.raw) == self.raw.maxlen:
+            self.row_total -= len(self.rows[0])
+        rows = self.layout(line)
+        self.raw.append(line)
+        self.rows.append(rows)
+        self.row_total += len(rows)
+
+    def extend(self, lines):
+        lines = list(lines)
+        maxlen = self.raw.maxlen
+        if maxlen is not None:
+            lines = lines[-maxlen:]
+            overflow = len(self.raw) + len(lines) - maxlen
+            for index in range(max(0, overflow)):
+                self.row_total -= len(self.rows[index])
+        laid_out = [self.layout(line) for line in lines]
+        self.raw.extend(lines)
+        self.rows.extend(laid_out)
+        self.row_total += sum(len(rows) for rows in laid_out)
+
+    def clear(self):
+        self.raw.clear()
+        self.rows.clear()
+        self.row_total = 0
+
+    def layout(self, line):
+        if self.layout_char_width is None:
+            return ()
+        return tuple(
+            get_shell_line_runs(row)
+            for row in wrap_text(line, SCREEN_WIDTH - 20, self.layout_char_width)
+        )
+
+    def relayout(self, width):
+        self.layout_char_width = width
+        self.rows = deque((self.layout(line) for line in self.raw), maxlen=self.raw.maxlen)
+        self.row_total = sum(len(rows) for rows in self.rows)
+
+    def visible_rows(self, count, scroll, extra_rows=()):
+        """Rows for a count-tall window scrolled up by scroll, with extra_rows appended virtually"""
+        total = self.row_total + len(extra_rows)
+        start = max(0, total - count - scroll)
+        end = min(total, start + count)
+        visible = list(extra_rows[max(0, start - self.row_total):max(0, end - self.row_total)])
+        index = self.row_total
+        for rows in reversed(self.rows):
+            if index <= start:
+                break
+            first = index - len(rows)
+            if first < end:
+                visible[:0] = rows[max(start, first) - first:min(end, index) - first]
+            index = first
+        return visible
+
+class ProcessOutput:
+    """Output state of one foreground process while process_reaper drains its pipes."""
+
+    def __init__(self, process):
+        self.process = process
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.tail = ""  # Partial stdout line carried to the next block
+        self.stderr = bytearray()  # Reported once the process exits
+        self.open_streams = 2
+
+    def feed(self, block):
+        """Complete stdout lines gained from block"""
+        text = self.tail + self.decoder.decode(block)
+        # A trailing \r may be the first half of a \r\n split across blocks
+        cut = len(text) - 1 if text.endswith("\r") else len(text)
+        lines = PROCESS_NEWLINE_PATTERN.split(text[:cut])
+        self.tail = lines.pop() + text[cut:]
+        return [line.rstrip() for line in lines]
+
+    def flush(self):
+        """Whatever stdout text is left once the pipe closes"""
+        lines = PROCESS_NEWLINE_PATTERN.split(self.tail + self.decoder.decode(b"", final=True))
+        self.tail = ""
+        if not lines[-1]:
+            lines.pop()
+        return [line.rstrip() for line in lines]
+
 class ShellExecutor:
     def __init__(self):
-        self.output_lines = deque(maxlen=500)
+        self.output_lines = LineStore(maxlen=MAX_OUTPUT_LINES)
         self.lock = threading.Lock()
         self.cwd = os.getcwd()
         self.shell_path = SHELL_PATH
-        self.command_history = []
+        self.max_history = int(config.get("max_history", DEFAULT_CONFIG["max_history"]) or 0)
+        self.command_history = self.new_history_buffer()
+        self.history_by_index = {}
         self.history_index = -1
         self.history_next_index = 1
         self.history_file = config.get("history_file", DEFAULT_CONFIG["history_file"])
+        self.history_log_file = None  # Append-only journal next to history_file
+        self.history_log_count = 0  # Entries appended to the log since the last snapshot
+        self.history_pending = []  # Entries not yet written, drained by save_history
+        self.history_lock = threading.Lock()  # Guards command_history/history_pending against the writer
+        self.history_save_lock = threading.Lock()  # One save_history at a time
+        self.history_save_queue = queue.Queue()
         self.running_processes = []
         self.foreground_process = None
-        self.output_updated = False  # Flag for rendering optimization
+        self.reaper_queue = queue.Queue()  # Foreground processes waiting to be watched by process_reaper
+        self.reaper_wakeup = os.pipe()  # (read_fd, write_fd) that tells process_reaper to check the queue
+        self.output_dirty_since = 0.0  # monotonic time of the first unrendered output change (0 = clean)
+        self.output_version = 0  # Bumped on every output change so renders can reuse layout
         self.editor = None
         self.in_editor_mode = False
+        self.timestamp_cache = (None, "")  # (epoch second, "%H:%M:%S" text) shared by output threads
+        self.builtin_commands = {
+            "help": self.builtin_help,
+            "clear": self.builtin_clear,
+            "pwd": self.builtin_pwd,
+            "jobs": self.builtin_jobs,
+            "quit": self.builtin_quit,
+            "root": self.builtin_root,
+            "deactivate": self.builtin_deactivate,
+        }
+        # Checked in order against the lowercased command when no exact name matches;
+        # the flag marks handlers that read argv and so cannot run on unparseable input
+        self.builtin_prefixes = (
+            ("history", self.builtin_history, True),
+            ("cd ", self.builtin_cd, False),
+            ("user", self.builtin_user, True),
+            ("venv ", self.builtin_venv, True),
+            ("conda ", self.builtin_conda, True),
+            ("launch", self.builtin_launch, False),
+            ("edit", self.builtin_edit, True),
+        )
+        # Checked next, case-sensitively against the stripped command; these use the raw text only
+        self.builtin_raw_prefixes = (
+            ("source ", self.builtin_source),
+            (". ", self.builtin_source),
+            ("export ", self.builtin_export),
+        )
         
         # PTY support for interactive commands
         self.pty_process = None
         self.pty_master = None
         self.pty_slave = None
         self.pty_thread = None
+        self.pty_wakeup = None  # (read_fd, write_fd) pipe that interrupts the reader's blocking select
         self.in_pty_mode = False
-        self.pty_input_buffer = ""  # Track what user is typing in PTY mode
+        self.pty_input_buffer = []  # Characters the user is typing in PTY mode
         self.pty_input_cursor = 0
-        self.pty_input_history = []
+        self.pty_input_text = ""  # Joined copy of pty_input_buffer, None when stale
+        self.pty_input_history = self.new_history_buffer()
         self.pty_history_index = 0
-        self.pty_partial_line = ""
+        # How each control sequence sent to the PTY changes the echoed input line
+        self.pty_key_handlers = {
+            '\r\n': self.pty_key_commit,
+            '\n': self.pty_key_commit,
+            '\r': self.pty_key_commit,
+            '\x7f': self.pty_key_backspace,
+            '\b': self.pty_key_backspace,
+            '\x15': self.pty_key_clear_line,  # Ctrl+U
+            '\x01': self.pty_key_home,  # Ctrl+A
+            '\x05': self.pty_key_end,  # Ctrl+E
+            '\x1b[D': self.pty_key_left,
+            '\x1b[C': self.pty_key_right,
+            '\x03': self.pty_key_abort,  # Ctrl+C
+            '\x04': self.pty_key_abort,  # Ctrl+D
+            '\x18': self.pty_key_abort,  # Ctrl+X
+            '\x1a': self.pty_key_abort,  # Ctrl+Z
+        }
+        self.pty_partial_line = ""  # Cleaned copy of pty_line_chars, refreshed by get_partial_line
+        self.pty_line_chars = []
+        self.pty_line_version = 0
+        self.pty_partial_version = 0
+        self.which_cache = {}
+        self.which_cache_path = None
+        self.command_index = []  # Sorted executable and built-in names for Tab completion
+        self.command_index_path = None  # PATH the index was built from
+        self.command_index_time = 0.0  # monotonic time of the last PATH scan
+        self.shell_words = None  # bash builtins, keywords, aliases and functions; asked for once
+        self.command_completion_cache = (None, [])  # Last (prefix, matches) query
         self.real_user = getpass.getuser()
         self.active_user = self.real_user
         self.hostname = socket.gethostname()
@@ -405,7 +749,14 @@ class ShellExecutor:
         self.ensure_base_paths()
         self.refresh_env_state()
 
+        if self.history_file:
+            # Resolve against the starting directory so the snapshot and log stay together after cd
+            self.history_file = os.path.abspath(self.history_file)
+            self.history_log_file = self.history_file + ".log"
         self.load_history()
+        if self.history_file:
+            threading.Thread(target=self.history_writer, daemon=True).start()
+        threading.Thread(target=self.process_reaper, daemon=True).start()
         
         # Add welcome message
         self.add_output("[System] Interactive Linux Shell Started")
@@ -427,22 +778,27 @@ class ShellExecutor:
         conda_prefix = os.environ.get("CONDA_PREFIX")
         path_parts = os.environ.get("PATH", "").split(os.pathsep)
 
-        def remove_path_entry(target):
-            if not target:
-                return
-            target_abs = os.path.abspath(target)
-            nonlocal path_parts
-            path_parts = [p for p in path_parts if os.path.abspath(p) != target_abs]
-
-        if venv_path:
-            remove_path_entry(os.path.join(venv_path, "bin"))
-            remove_path_entry(os.path.join(venv_path, "Scripts"))
-
-        if conda_prefix:
-            remove_path_entry(os.path.join(conda_prefix, "bin"))
-            remove_path_entry(os.path.join(conda_prefix, "Scripts"))
+        targets = set()
+        for prefix in (venv_path, conda_prefix):
+            if prefix:
+                targets.add(os.path.abspath(os.path.join(prefix, "bin")))
+                targets.add(os.path.abspath(os.path.join(prefix, "Scripts")))
+
+        if targets:
+            abs_cache = {}
+            kept = []
+            for p in path_parts:
+                if not p:
+                    continue
+                if p not in abs_cache:
+                    abs_cache[p] = os.path.abspath(p)
+                if abs_cache[p] not in targets:
+                    kept.append(p)
+            path_parts = kept
 
-        os.environ["PATH"] = os.pathsep.join(p for p in path_parts if p)
+        new_path = os.pathsep.join(p for p in path_parts if p)
+        if new_path != os.environ.get("PATH"):
+            os.environ["PATH"] = new_path
 
         for key in (
             "VIRTUAL_ENV",
@@ -455,8 +811,7 @@ class ShellExecutor:
 
     def ensure_base_paths(self):
         """Ensure common system paths are present for standard tools."""
-        path_parts = [p for p in os.environ.get("PATH", "").split(os.pathsep) if p]
-        existing = {os.path.abspath(p) for p in path_parts}
+        seen = dict.fromkeys(p for p in os.environ.get("PATH", "").split(os.pathsep) if p)
         default_paths = [
             "/usr/local/sbin",
             "/usr/local/bin",
@@ -466,13 +821,14 @@ class ShellExecutor:
             "/bin",
         ]
         for path in default_paths:
-            if not os.path.isdir(path):
+            if path in seen or path + "/" in seen:
                 continue
-            if os.path.abspath(path) in existing:
+            if not os.path.isdir(path):
                 continue
-            path_parts.append(path)
-            existing.add(os.path.abspath(path))
-        os.environ["PATH"] = os.pathsep.join(path_parts)
+            seen[path] = None
+        new_path = os.pathsep.join(seen)
+        if new_path != os.environ.get("PATH"):
+            os.environ["PATH"] = new_path
 
     def refresh_env_state(self):
         conda_env = os.environ.get("CONDA_DEFAULT_ENV")
@@ -575,21 +931,18 @@ class ShellExecutor:
                 except Exception as e:
                     self.add_output(f"[Error] Could not chdir to '{self.cwd}': {e}")
 
-        new_env = {}
-        for item in env_blob.split(b"\x00"):
-            if not item:
-                continue
-            try:
-                k, v = item.split(b"=", 1)
-                new_env[k.decode("utf-8", errors="replace")] = v.decode("utf-8", errors="replace")
-            except Exception:
-                continue
+        env_text = env_blob.decode("utf-8", errors="replace")
+        new_env = dict(
+            entry.partition("=")[::2]
+            for entry in env_text.split("\x00")
+            if "=" in entry
+        )
 
-        for key in list(os.environ.keys()):
-            if key not in new_env:
-                os.environ.pop(key, None)
+        for key in os.environ.keys() - new_env.keys():
+            os.environ.pop(key, None)
         for key, value in new_env.items():
             os.environ[key] = value
+        self.which_cache.clear()
 
         self.refresh_env_state()
         return True
@@ -620,6 +973,75 @@ class ShellExecutor:
 
         return f"{' && '.join(export_parts)} && {command}"
 
+    def which(self, name):
+        """shutil.which with hits cached until PATH changes; misses are re-probed so new installs show up"""
+        path = os.environ.get("PATH")
+        if path != self.which_cache_path:
+            self.which_cache.clear()
+            self.which_cache_path = path
+        result = self.which_cache.get(name)
+        if result is None:
+            result = shutil.which(name)
+            if result:
+                self.which_cache[name] = result
+        return result
+
+    def get_shell_words(self):
+        """Names bash completes besides PATH executables (what compgen -c adds on top)"""
+        if self.shell_words is None:
+            self.shell_words = ()
+            bash_path = self.which("bash")
+            if bash_path:
+                try:
+                    result = subprocess.run(
+                        [bash_path, "-c", "compgen -b -k -A alias -A function"],
+                        capture_output=True,
+                        text=True,
+                        timeout=1
+                    )
+                    self.shell_words = tuple(word for word in result.stdout.split("\n") if word.strip())
+                except Exception:
+                    pass
+        return self.shell_words
+
+    def refresh_command_index(self):
+        """Rebuild the sorted list of command names from PATH, bash's own words and the built-ins"""
+        path = os.environ.get("PATH", "")
+        names = set(self.builtin_commands)
+        names.update(self.get_shell_words())
+        names.update(entry[0].strip() for entry in self.builtin_prefixes + self.builtin_raw_prefixes)
+        names.discard(".")
+        for directory in path.split(os.pathsep):
+            try:
+                with os.scandir(directory or ".") as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_file() and os.access(entry.path, os.X_OK):
+                                names.add(entry.name)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        self.command_index = sorted(names)
+        self.command_index_path = path
+        self.command_index_time = time.monotonic()
+        self.command_completion_cache = (None, [])
+
+    def complete_command(self, prefix):
+        """Command names starting with prefix, from an index rescanned every COMMAND_INDEX_TTL seconds"""
+        if (os.environ.get("PATH", "") != self.command_index_path
+                or time.monotonic() - self.command_index_time > COMMAND_INDEX_TTL):
+            self.refresh_command_index()
+        cached_prefix, matches = self.command_completion_cache
+        if cached_prefix == prefix:
+            return matches
+        index = self.command_index
+        start = bisect.bisect_left(index, prefix)
+        end = bisect.bisect_left(index, prefix + "\U0010ffff", start)
+        matches = index[start:end]
+        self.command_completion_cache = (prefix, matches)
+        return matches
+
     def build_shell_command(self, command):
         shell_path = self.shell_path or "/bin/sh"
         shell_name = os.path.basename(shell_path)
@@ -629,7 +1051,7 @@ class ShellExecutor:
         else:
             base = [shell_path, "-c", wrapped_command]
         if self.active_user != self.real_user:
-            sudo = shutil.which("sudo")
+            sudo = self.which("sudo")
             if not sudo:
                 return base
             if self.active_user == "root":
@@ -640,7 +1062,7 @@ class ShellExecutor:
     def build_shell_command_string(self, command):
         if self.active_user == self.real_user:
             return command
-        sudo = shutil.which("sudo")
+        sudo = self.which("sudo")
         if not sudo:
             return command
         if self.active_user == "root":
@@ -653,26 +1075,14 @@ class ShellExecutor:
             return command, None
         if stripped[0] in ("'", '"'):
             return command, None
-        try:
-            parts = shlex.split(stripped, posix=True)
-        except ValueError:
-            return command, None
-        if not parts:
-            return command, None
-
-        first = parts[0]
-        alias_map = {
-            "py": "python3",
-            "python": "python3",
-            "ipy": "ipython3",
-            "ipython": "ipython3",
-        }
-        if first not in alias_map:
+        # Alias keys are plain words, so a whitespace split finds them exactly as shlex would
+        first = stripped.split(None, 1)[0]
+        if first not in COMMAND_ALIASES:
             return command, None
-        if shutil.which(first):
+        if self.which(first):
             return command, None
-        target = alias_map[first]
-        if not shutil.which(target):
+        target = COMMAND_ALIASES[first]
+        if not self.which(target):
             return command, None
         leading_ws = command[:len(command) - len(stripped)]
         replaced = f"{leading_ws}{target}{stripped[len(first):]}"
@@ -693,7 +1103,7 @@ class ShellExecutor:
         if os.geteuid() == 0 and target == "root":
             self.active_user = "root"
             self.add_output("[System] Switched to root user")
-            home_dir = os.path.expanduser("~root")
+            home_dir = get_user_home("root")
             if home_dir and os.path.isdir(home_dir):
                 if os.access(home_dir, os.X_OK):
                     try:
@@ -705,7 +1115,7 @@ class ShellExecutor:
                 else:
                     self.add_output(f"[Warning] No permission to access '{home_dir}'. Staying in: {self.cwd}")
             return True
-        sudo = shutil.which("sudo")
+        sudo = self.which("sudo")
         if not sudo:
             self.add_output("[Error] sudo not available to switch users.")
             return False
@@ -725,7 +1135,7 @@ class ShellExecutor:
             return False
         self.active_user = target
         self.add_output(f"[System] User switched to {self.active_user}")
-        home_dir = os.path.expanduser(f"~{target}")
+        home_dir = get_user_home(target)
         if home_dir and os.path.isdir(home_dir):
             if os.access(home_dir, os.X_OK):
                 try:
@@ -744,104 +1154,189 @@ class ShellExecutor:
             if isinstance(text, str):
                 self.output_lines.append(text)
             else:
-                for line in text:
-                    self.output_lines.append(line)
-            self.output_updated = True  # Mark that output changed
+                self.output_lines.extend(text)
+            self.output_version += 1
+            if not self.output_dirty_since:
+                self.output_dirty_since = time.monotonic()
+                wake_main_loop()
             global output_scroll
             output_scroll = 0
 
     def clear_output(self):
         with self.lock:
             self.output_lines.clear()
-            self.output_updated = True
+            self.output_version += 1
+            if not self.output_dirty_since:
+                self.output_dirty_since = time.monotonic()
+                wake_main_loop()
         self.add_output(f"[System] Working Directory: {self.cwd}")
     
+    def timestamp(self):
+        """Current time as HH:MM:SS, formatted at most once per second"""
+        now = int(time.time())
+        second, text = self.timestamp_cache
+        if now != second:
+            text = time.strftime("%H:%M:%S", time.localtime(now))
+            self.timestamp_cache = (now, text)
+        return text
+
     def strip_ansi_codes(self, text):
         """Remove ANSI escape codes and control characters from text"""
-        # Remove ANSI escape sequences (colors, cursor positioning, etc.)
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        text = ansi_escape.sub('', text)
-        
-        # Remove other common control sequences
-        text = re.sub(r'\x1B\][^\x07]*\x07', '', text)  # OSC sequences
-        text = re.sub(r'\x1B[P\]X^_][^\x1B\\]*(?:\x1B\\)?', '', text)  # Other sequences
-        
-        # Remove carriage returns but keep newlines
-        text = text.replace('\r', '')
-        
-        # Remove bell character
-        text = text.replace('\x07', '')
-        
-        # Remove other control characters except tab and newline
-        text = ''.join(char for char in text if char >= ' ' or char in '\t\n')
-        
-        return text
+        if '\x1b' in text:
+            text = ANSI_ESCAPE_PATTERN.sub('', text)
+        return text.translate(CONTROL_CHAR_TRANSLATION)
+
+    def new_history_buffer(self, entries=()):
+        """Bounded history container; a max_history of 0 means unlimited."""
+        return deque(entries, maxlen=self.max_history or None)
 
     def load_history(self):
         if not self.history_file:
             return
-        if not os.path.exists(self.history_file):
-            return
-        try:
-            with open(self.history_file, "r", encoding="utf-8") as handle:
-                payload = json.load(handle)
-        except Exception:
-            return
-        entries = payload.get("entries", [])
-        if not isinstance(entries, list):
-            return
-        cleaned = []
-        for entry in entries:
+        history = self.new_history_buffer()
+        next_index = 0
+
+        def add_entry(entry):
+            nonlocal next_index
             if not isinstance(entry, dict):
-                continue
+                return
             command = entry.get("command")
             index = entry.get("index")
             if not isinstance(command, str) or not isinstance(index, int):
-                continue
-            cleaned.append({"index": index, "command": command})
-        max_history = config.get("max_history", DEFAULT_CONFIG["max_history"])
-        if max_history and len(cleaned) > max_history:
-            cleaned = cleaned[-max_history:]
-        self.command_history = cleaned
+                return
+            history.append({"index": index, "command": command})
+            next_index = max(next_index, index + 1)
+
+        snapshot_next_index = 0
+        if os.path.exists(self.history_file):
+            try:
+                with open(self.history_file, "rb") as handle:
+                    payload = json_loads(handle.read())
+                if isinstance(payload.get("next_index"), int):
+                    snapshot_next_index = payload["next_index"]
+                snapshot = payload.get("entries", [])
+                if isinstance(snapshot, list):
+                    for entry in snapshot:
+                        add_entry(entry)
+            except Exception:
+                pass
+        next_index = max(next_index, snapshot_next_index)
+        self.history_log_count = 0
+        try:
+            with open(self.history_log_file, "rb") as handle:
+                for line in handle:
+                    try:
+                        entry = json_loads(line)
+                    except Exception:
+                        continue  # Torn write from an interrupted append
+                    # Entries already folded into the snapshot by an interrupted compaction
+                    if isinstance(entry, dict) and isinstance(entry.get("index"), int) and entry["index"] < snapshot_next_index:
+                        continue
+                    add_entry(entry)
+                    self.history_log_count += 1
+        except OSError:
+            pass
+        self.command_history = history
+        self.history_by_index = {entry["index"]: entry for entry in self.command_history}
         self.history_index = len(self.command_history)
-        next_index = payload.get("next_index")
-        if isinstance(next_index, int) and next_index > 0:
+        if next_index > 0:
             self.history_next_index = next_index
-        elif cleaned:
-            self.history_next_index = max(entry["index"] for entry in cleaned) + 1
 
-    def save_history(self):
+    def save_history(self, full=False):
+        """Append pending entries to the history log, or snapshot everything.
+
+        A full save rewrites the JSON snapshot atomically and empties the log.
+        It happens on exit, on clear, and every HISTORY_COMPACT_INTERVAL entries.
+        """
         if not self.history_file:
             return
-        payload = {
-            "next_index": self.history_next_index,
-            "entries": self.command_history
-        }
-        try:
-            with open(self.history_file, "w", encoding="utf-8") as handle:
-                json.dump(payload, handle, indent=2)
-        except Exception:
-            return
+        with self.history_save_lock:
+            with self.history_lock:
+                pending, self.history_pending = self.history_pending, []
+                if full or self.history_log_count + len(pending) > HISTORY_COMPACT_INTERVAL:
+                    payload = {
+                        "next_index": self.history_next_index,
+                        "entries": list(self.command_history)
+                    }
+                else:
+                    payload = None
+            if payload is None:
+                if not pending:
+                    return
+                data = b"".join(json.dumps(entry).encode("utf-8") + b"\n" for entry in pending)
+                try:
+                    with open(self.history_log_file, "ab") as handle:
+                        fcntl.flock(handle, fcntl.LOCK_EX)
+                        handle.write(data)
+                    self.history_log_count += len(pending)
+                    return
+                except Exception:
+                    # Fall back to a full snapshot
+                    with self.history_lock:
+                        payload = {
+                            "next_index": self.history_next_index,
+                            "entries": list(self.command_history)
+                        }
+            temp_path = self.history_file + ".tmp"
+            try:
+                with open(temp_path, "wb") as handle:
+                    handle.write(json_dumps(payload))
+                os.replace(temp_path, self.history_file)
+                with open(self.history_log_file, "ab") as handle:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                    handle.truncate(0)
+                self.history_log_count = 0
+            except Exception:
+                return
+
+    def history_writer(self):
+        """Background thread that persists history so submitting a command never waits on disk"""
+        while True:
+            self.history_save_queue.get()
+            time.sleep(HISTORY_SAVE_DELAY)
+            # Commands submitted while waiting are written by the same save
+            while True:
+                try:
+                    self.history_save_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.save_history()
+
+    def flush_history(self):
+        """Write any unsaved history as a full snapshot; used on exit"""
+        if self.history_log_count or self.history_pending:
+            self.save_history(full=True)
 
     def add_history_entry(self, command):
         entry = {"index": self.history_next_index, "command": command}
         self.history_next_index += 1
-        self.command_history.append(entry)
-        max_history = config.get("max_history", DEFAULT_CONFIG["max_history"])
-        if max_history and len(self.command_history) > max_history:
-            self.command_history = self.command_history[-max_history:]
+        if len(self.command_history) == self.command_history.maxlen:
+            self.history_by_index.pop(self.command_history[0]["index"], None)
+        with self.history_lock:
+            self.command_history.append(entry)
+            self.history_pending.append(entry)
+        self.history_by_index[entry["index"]] = entry
         self.history_index = len(self.command_history)
-        self.save_history()
+        self.history_save_queue.put(None)
 
     def clear_history(self):
-        self.command_history = []
+        with self.history_lock:
+            self.command_history.clear()
+            self.history_pending = []
+            self.history_next_index = 1
+        self.history_by_index = {}
         self.history_index = -1
-        self.history_next_index = 1
-        self.save_history()
+        self.save_history(full=True)
 
     def reset_pty_input_buffer(self):
-        self.pty_input_buffer = ""
+        self.pty_input_buffer.clear()
         self.pty_input_cursor = 0
+        self.pty_input_text = ""
+
+    def get_pty_input_text(self):
+        if self.pty_input_text is None:
+            self.pty_input_text = "".join(self.pty_input_buffer)
+        return self.pty_input_text
 
     def add_pty_history_entry(self, command):
         clean = command.strip()
@@ -872,14 +1367,12 @@ class ShellExecutor:
         return ""
 
     def set_pty_input_buffer(self, text):
-        self.pty_input_buffer = text
+        self.pty_input_buffer[:] = text
         self.pty_input_cursor = len(text)
+        self.pty_input_text = text
 
     def get_history_entry(self, index):
-        for entry in self.command_history:
-            if entry["index"] == index:
-                return entry
-        return None
+        return self.history_by_index.get(index)
 
     def format_history_lines(self):
         if not self.command_history:
@@ -900,89 +1393,105 @@ class ShellExecutor:
     
     def read_pty_output(self):
         """Read output from PTY in background thread"""
-        import select
-
-        current_line = list(self.pty_partial_line or "")
+        # Block until the PTY has data or cleanup_pty pokes the wakeup pipe
+        selector = selectors.DefaultSelector()
+        selector.register(self.pty_master, selectors.EVENT_READ)
+        wakeup = self.pty_wakeup  # This session's pipe; a later session installs its own
+        wakeup_fd = wakeup[0]
+        selector.register(wakeup_fd, selectors.EVENT_READ)
+
+        current_line = list(self.pty_line_chars)
         cursor_pos = len(current_line)
-        escape_buffer = ""
-        in_escape = False
+        pending_escape = ""
+        # Keeps partial UTF-8 sequences split across reads instead of replacing them
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        committed = []  # Lines finished during the current read, published together
 
         def commit_line():
             clean_line = self.strip_ansi_codes("".join(current_line))
             if clean_line.strip():
-                self.add_output(clean_line)
+                committed.append(clean_line)
+
+        def cursor_left(amount):
+            nonlocal cursor_pos
+            cursor_pos = max(0, cursor_pos - amount)
+
+        def cursor_right(amount):
+            nonlocal cursor_pos
+            cursor_pos = min(len(current_line), cursor_pos + amount)
+
+        def erase_to_line_end(amount):
+            nonlocal current_line
+            current_line = current_line[:cursor_pos]
+
+        escape_handlers = {"D": cursor_left, "C": cursor_right, "K": erase_to_line_end}
 
         def apply_escape_sequence(sequence):
-            nonlocal cursor_pos, current_line
-            if sequence in ("\x1b[D", "\x1bOD"):
-                cursor_pos = max(0, cursor_pos - 1)
-                return
-            if sequence in ("\x1b[C", "\x1bOC"):
-                cursor_pos = min(len(current_line), cursor_pos + 1)
-                return
-            if sequence.startswith("\x1b[") and sequence.endswith(("D", "C", "K")):
-                params = sequence[2:-1]
-                try:
-                    amount = int(params) if params else 1
-                except ValueError:
-                    amount = 1
-                if sequence.endswith("D"):
-                    cursor_pos = max(0, cursor_pos - amount)
-                    return
-                if sequence.endswith("C"):
-                    cursor_pos = min(len(current_line), cursor_pos + amount)
-                    return
-                if sequence.endswith("K"):
-                    current_line = current_line[:cursor_pos]
-                    return
+            match = PTY_CURSOR_SEQUENCE_PATTERN.fullmatch(sequence)
+            if match:
+                params, csi_final, ss3_final = match.groups()
+                amount = int(params) if params and params.isdigit() else 1
+                escape_handlers[csi_final or ss3_final](amount)
 
         while self.in_pty_mode and self.pty_master:
             try:
-                # Use select to check if data is available
-                ready, _, _ = select.select([self.pty_master], [], [], 0.1)
-                if ready:
-                    data = os.read(self.pty_master, 1024)
+                events = selector.select()
+                if any(key.fd == wakeup_fd for key, _ in events):
+                    break
+                if events:
+                    data = os.read(self.pty_master, PTY_READ_SIZE)
                     if data:
-                        text = data.decode('utf-8', errors='replace')
-                        for char in text:
-                            if in_escape:
-                                escape_buffer += char
-                                if char.isalpha() or char in ("~", "m"):
-                                    apply_escape_sequence(escape_buffer)
-                                    escape_buffer = ""
-                                    in_escape = False
-                                continue
-
-                            if char == '\x1b':
-                                in_escape = True
-                                escape_buffer = char
-                                continue
-
-                            if char == '\n':
+                        # Plain ASCII needs no UTF-8 decoding unless a split sequence is pending
+                        if data.isascii() and not decoder.getstate()[0]:
+                            text = pending_escape + data.decode("ascii")
+                        else:
+                            text = pending_escape + decoder.decode(data)
+                        pending_escape = ""
+                        for match in PTY_TOKEN_PATTERN.finditer(text):
+                            token = match.group(0)
+                            first = token[0]
+                            if first == '\x1b':
+                                if len(token) > 1:
+                                    apply_escape_sequence(token)
+                                elif PTY_ESCAPE_PREFIX_PATTERN.fullmatch(text, match.start()):
+                                    # Sequence continues in the next read
+                                    pending_escape = text[match.start():]
+                                    break
+                            elif first == '\n':
                                 commit_line()
                                 current_line = []
                                 cursor_pos = 0
-                            elif char == '\r':
+                            elif first == '\r':
                                 cursor_pos = 0
-                            elif char in ('\b', '\x7f'):
+                            elif first in ('\b', '\x7f'):
                                 cursor_pos = max(0, cursor_pos - 1)
                             else:
-                                if cursor_pos < len(current_line):
-                                    current_line[cursor_pos] = char
-                                else:
-                                    current_line.append(char)
-                                cursor_pos += 1
-                        self.pty_partial_line = self.strip_ansi_codes("".join(current_line))
+                                # Printable run: overwrite from the cursor, extending the line as needed
+                                end = cursor_pos + len(token)
+                                current_line[cursor_pos:end] = token
+                                cursor_pos = end
+                        if committed:
+                            self.add_output(committed)
+                            committed = []
+                        self.set_pty_line(current_line)
                     else:
                         break
             except OSError:
                 break
 
+        selector.close()
+        with self.lock:
+            if self.pty_wakeup is wakeup:
+                self.pty_wakeup = None
+        for fd in wakeup:
+            os.close(fd)
+
+        current_line.extend(decoder.decode(b"", final=True))
         if current_line:
             clean_line = self.strip_ansi_codes("".join(current_line))
             if clean_line.strip():
                 self.add_output(clean_line)
-        self.pty_partial_line = ""
+        self.set_pty_line([])
 
         self.cleanup_pty()
     
@@ -993,54 +1502,79 @@ class ShellExecutor:
                 os.write(self.pty_master, text.encode('utf-8'))
                 
                 # Update input buffer for display (don't track newlines)
-                if text in ('\r\n', '\n', '\r'):
-                    self.add_pty_history_entry(self.pty_input_buffer)
-                    self.reset_pty_input_buffer()
-                elif text in ('\x7f', '\b'):  # Backspace
-                    if self.pty_input_cursor > 0:
-                        self.pty_input_buffer = (
-                            self.pty_input_buffer[:self.pty_input_cursor - 1]
-                            + self.pty_input_buffer[self.pty_input_cursor:]
-                        )
-                        self.pty_input_cursor -= 1
-                        if update_history_index:
-                            self.pty_history_index = len(self.pty_input_history)
-                elif text == '\x15':  # Ctrl+U clears line
-                    self.reset_pty_input_buffer()
-                    if update_history_index:
-                        self.pty_history_index = len(self.pty_input_history)
-                elif text == '\x01':  # Ctrl+A
-                    self.pty_input_cursor = 0
-                elif text == '\x05':  # Ctrl+E
-                    self.pty_input_cursor = len(self.pty_input_buffer)
-                elif text == '\x1b[D':  # Left arrow
-                    self.pty_input_cursor = max(0, self.pty_input_cursor - 1)
-                elif text == '\x1b[C':  # Right arrow
-                    self.pty_input_cursor = min(len(self.pty_input_buffer), self.pty_input_cursor + 1)
+                handler = self.pty_key_handlers.get(text)
+                if handler is not None:
+                    handler(update_history_index)
                 elif len(text) == 1 and ord(text) >= 32:  # Printable character
-                    self.pty_input_buffer = (
-                        self.pty_input_buffer[:self.pty_input_cursor]
-                        + text
-                        + self.pty_input_buffer[self.pty_input_cursor:]
-                    )
+                    self.pty_input_buffer.insert(self.pty_input_cursor, text)
                     self.pty_input_cursor += 1
+                    self.pty_input_text = None
                     if update_history_index:
                         self.pty_history_index = len(self.pty_input_history)
-                elif text in ['\x03', '\x04', '\x18', '\x1a']:  # Ctrl+C, D, X, Z
-                    self.reset_pty_input_buffer()
                     
                 return True
             except:
                 return False
         return False
     
+    def pty_key_commit(self, update_history_index):
+        self.add_pty_history_entry(self.get_pty_input_text())
+        self.reset_pty_input_buffer()
+
+    def pty_key_backspace(self, update_history_index):
+        if self.pty_input_cursor > 0:
+            self.pty_input_cursor -= 1
+            del self.pty_input_buffer[self.pty_input_cursor]
+            self.pty_input_text = None
+            if update_history_index:
+                self.pty_history_index = len(self.pty_input_history)
+
+    def pty_key_clear_line(self, update_history_index):
+        self.reset_pty_input_buffer()
+        if update_history_index:
+            self.pty_history_index = len(self.pty_input_history)
+
+    def pty_key_home(self, update_history_index):
+        self.pty_input_cursor = 0
+
+    def pty_key_end(self, update_history_index):
+        self.pty_input_cursor = len(self.pty_input_buffer)
+
+    def pty_key_left(self, update_history_index):
+        self.pty_input_cursor = max(0, self.pty_input_cursor - 1)
+
+    def pty_key_right(self, update_history_index):
+        self.pty_input_cursor = min(len(self.pty_input_buffer), self.pty_input_cursor + 1)
+
+    def pty_key_abort(self, update_history_index):
+        self.reset_pty_input_buffer()
+
+    def set_pty_line(self, chars):
+        """Publish the reader's in-progress line; it is cleaned lazily by get_partial_line"""
+        with self.lock:
+            self.pty_line_chars = chars
+            self.pty_line_version += 1
+            if not self.output_dirty_since:
+                self.output_dirty_since = time.monotonic()
+                wake_main_loop()
+
+    def get_partial_line(self):
+        with self.lock:
+            if self.pty_partial_version != self.pty_line_version:
+                self.pty_partial_line = self.strip_ansi_codes("".join(self.pty_line_chars))
+                self.pty_partial_version = self.pty_line_version
+            return self.pty_partial_line
+
     def cleanup_pty(self):
         """Clean up PTY resources"""
         self.in_pty_mode = False
+        with self.lock:
+            if self.pty_wakeup:
+                os.write(self.pty_wakeup[1], b"\0")
         self.reset_pty_input_buffer()
-        self.pty_input_history = []
+        self.pty_input_history.clear()
         self.pty_history_index = 0
-        self.pty_partial_line = ""
+        self.set_pty_line([])
         
         if self.pty_process:
             try:
@@ -1064,8 +1598,6 @@ class ShellExecutor:
     
     def start_pty_command(self, command):
         """Start a command in PTY mode for interactivity"""
-        import pty
-        import select
         
         try:
             # Create PTY
@@ -1104,11 +1636,12 @@ class ShellExecutor:
             os.close(self.pty_slave)
             self.in_pty_mode = True
             self.reset_pty_input_buffer()
-            self.pty_input_history = []
+            self.pty_input_history.clear()
             self.pty_history_index = 0
-            self.pty_partial_line = ""
+            self.set_pty_line([])
             
             # Start reading thread
+            self.pty_wakeup = os.pipe()
             self.pty_thread = threading.Thread(target=self.read_pty_output, daemon=True)
             self.pty_thread.start()
             
@@ -1146,7 +1679,7 @@ class ShellExecutor:
             self.in_editor_mode = True
             editor_nav_mode = "file"
             show_shell_help_overlay = False
-            show_editor_help_overlay = theme_settings.get("show_editor_help_screen", True)
+            show_editor_help_overlay = theme_settings["show_editor_help_screen"]
             self.add_output(f"[System] Editor opened: {file_path}")
             self.add_output("[System] Editor tips: Start toggles file/keyboard nav; Select+DPad selects; L2+A saves, L2+B exits.")
         except Exception as e:
@@ -1162,33 +1695,71 @@ class ShellExecutor:
         self.in_editor_mode = False
         show_editor_help_overlay = False
     
-    def monitor_process(self, process, command):
-        """Monitor a process and capture its output in real-time"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        
+    def process_reaper(self):
+        """Single background thread that streams output from every foreground process"""
+        selector = selectors.DefaultSelector()
+        wakeup_fd = self.reaper_wakeup[0]
+        selector.register(wakeup_fd, selectors.EVENT_READ)
+        lingering = []  # Pipes closed but the process has not exited yet
+
+        while True:
+            # Only poll while some process still has to be waited for
+            events = selector.select(0.1 if lingering else None)
+            for key, _ in events:
+                if key.fd == wakeup_fd:
+                    os.read(wakeup_fd, 4096)
+                    while True:
+                        try:
+                            process = self.reaper_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        state = ProcessOutput(process)
+                        selector.register(process.stdout.fileno(), selectors.EVENT_READ, (state, False))
+                        selector.register(process.stderr.fileno(), selectors.EVENT_READ, (state, True))
+                    continue
+                state, is_stderr = key.data
+                try:
+                    block = os.read(key.fd, PROCESS_READ_SIZE)
+                except OSError:
+                    block = b""
+                if block:
+                    if is_stderr:
+                        state.stderr.extend(block)
+                    else:
+                        lines = state.feed(block)
+                        if lines:
+                            self.add_output(lines)
+                    continue
+                selector.unregister(key.fd)
+                if not is_stderr:
+                    lines = state.flush()
+                    if lines:
+                        self.add_output(lines)
+                state.open_streams -= 1
+                if not state.open_streams:
+                    lingering.append(state)
+            for state in list(lingering):
+                if state.process.poll() is not None:
+                    lingering.remove(state)
+                    self.finish_process(state)
+
+    def finish_process(self, state):
+        """Report stderr and the exit status of a drained foreground process"""
+        process = state.process
         try:
-            # Read stdout
-            if process.stdout:
-                for line in iter(process.stdout.readline, ''):
-                    if not line:
-                        break
-                    self.add_output(line.rstrip())
-            
-            # Wait for process to complete
-            process.wait()
-            
-            # Read any remaining stderr
-            if process.stderr:
-                stderr_output = process.stderr.read()
-                if stderr_output:
-                    for line in stderr_output.rstrip().split('\n'):
-                        if line:
-                            self.add_output(f"[Error] {line}")
+            process.stdout.close()
+            process.stderr.close()
+            # Published together so the summary lands under one lock acquisition
+            lines = []
+            if state.stderr:
+                stderr_output = state.stderr.decode("utf-8", errors="replace").rstrip()
+                lines.extend(f"[Error] {line}" for line in PROCESS_NEWLINE_PATTERN.split(stderr_output) if line)
             
             if process.returncode != 0:
-                self.add_output(f"[Exit Code] {process.returncode}")
+                lines.append(f"[Exit Code] {process.returncode}")
             
-            self.add_output(f"[{datetime.now().strftime('%H:%M:%S')}] Command completed")
+            lines.append(f"[{self.timestamp()}] Command completed")
+            self.add_output(lines)
                 
         except Exception as e:
             self.add_output(f"[Error] Process monitoring failed: {e}")
@@ -1206,8 +1777,6 @@ class ShellExecutor:
         Note: This only persists exported env vars and the resulting working directory.
         Shell functions/aliases and non-exported vars cannot be persisted this way.
         """
-        import shlex
-        
         parts = cmd.strip().split(maxsplit=1)
         if len(parts) < 2:
             self.add_output("[Error] source: missing file operand")
@@ -1230,6 +1799,222 @@ class ShellExecutor:
             self.add_output(f"[System] Sourced: {file_arg}")
             self.add_output("[System] (Persisted: exported env vars + working directory)")
     
+    def builtin_help(self, command):
+        self.add_output([
+            "Built-in commands:",
+            "  clear       - Clear the screen",
+            "  cd <dir>    - Change directory",
+            "  launch <cmd> - Temporarily exit SDL and run an app",
+            "  pwd         - Print working directory",
+            "  quit        - Exit the shell",
+            "  jobs        - List running background processes",
+            "  help        - Show this help",
+            "  edit <file> - Open the built-in text editor",
+            "  history     - Show command history",
+            "  history N   - Show entry at index N",
+            "  history -c  - Clear command history",
+            "  !N          - Execute history entry N",
+            "  user [name|reset] - Switch or reset user context",
+            "  root        - Switch to root context",
+            "  deactivate  - Deactivate active venv/conda env",
+            "  venv <path> - Activate a Python venv",
+            "  venv off    - Deactivate current venv",
+            "  conda activate <env> - Activate conda env",
+            "  conda deactivate - Deactivate conda env",
+            "",
+            "Shell built-ins:",
+            "  source <file> - Source file (persists exported vars & cwd)",
+            "  export VAR=val - Set environment variable (requires bash)",
+            "",
+            "Interactive commands (nano, vim, etc.) run in PTY mode.",
+            "In PTY mode: Press L2+R2 together for Ctrl+C to exit apps.",
+            "Keyboard users: Press Ctrl+C, Ctrl+X, or use app exit keys.",
+            "Use '&' at the end of a command to run it in the background.",
+            "All other commands are passed to the system shell."
+        ])
+
+    def builtin_clear(self, command):
+        self.clear_output()
+
+    def builtin_history(self, command, parts):
+        if len(parts) == 1:
+            self.add_output(self.format_history_lines())
+            return
+        if parts[1] in ("-c", "clear"):
+            self.clear_history()
+            self.add_output("[System] History cleared.")
+            return
+        if parts[1].isdigit():
+            index = int(parts[1])
+            entry = self.get_history_entry(index)
+            if entry:
+                self.add_output(f"{entry['index']:4d}  {entry['command']}")
+            else:
+                self.add_output(f"[Error] history: no entry at index {index}")
+            return
+        self.add_output("[Error] history: invalid usage (history, history N, history -c)")
+
+    def builtin_pwd(self, command):
+        self.add_output(self.cwd)
+
+    def builtin_jobs(self, command):
+        with self.lock:
+            processes = list(self.running_processes)
+        if not processes:
+            self.add_output("[System] No background processes running")
+        else:
+            self.add_output(f"[System] {len(processes)} background process(es) running")
+            for i, proc in enumerate(processes):
+                status = "running" if proc.poll() is None else "finished"
+                self.add_output(f"  [{i+1}] PID {proc.pid} - {status}")
+
+    def builtin_cd(self, command, parts):
+        new_dir = command.strip()[3:].strip()
+        try:
+            if new_dir == "~":
+                new_dir = os.path.expanduser("~")
+            elif not os.path.isabs(new_dir):
+                new_dir = os.path.join(self.cwd, new_dir)
+            
+            new_dir = os.path.abspath(new_dir)
+            os.chdir(new_dir)
+            self.cwd = new_dir
+            self.add_output(f"[System] Changed directory to: {self.cwd}")
+        except Exception as e:
+            self.add_output(f"[Error] cd: {e}")
+
+    def builtin_quit(self, command):
+        global running
+        running = False
+
+    def builtin_root(self, command):
+        self.switch_user("root")
+
+    def builtin_deactivate(self, command):
+        self.deactivate_active_env()
+
+    def builtin_user(self, command, parts):
+        if len(parts) == 1:
+            self.add_output(f"[System] Current user: {self.active_user} (host: {self.hostname})")
+            self.add_output("Usage: user <name> | user reset")
+            return
+        if parts[1] in ("reset", "default"):
+            self.switch_user(self.real_user)
+            return
+        self.switch_user(parts[1])
+
+    def builtin_venv(self, command, parts):
+        if len(parts) < 2:
+            self.add_output("[System] Usage: venv <path> | venv off")
+            return
+        if parts[1] in ("off", "deactivate"):
+            self.deactivate_active_env()
+            return
+        venv_path = os.path.expanduser(parts[1])
+        if not os.path.isabs(venv_path):
+            venv_path = os.path.join(self.cwd, venv_path)
+        activate_path = os.path.abspath(os.path.join(venv_path, "bin", "activate"))
+        if not os.path.exists(activate_path):
+            self.add_output(f"[Error] venv: activate script not found at {activate_path}")
+            return
+        if self.apply_shell_environment(
+            f"source {shlex.quote(activate_path)} >/dev/null 2>&1",
+            "venv activate"
+        ):
+            self.active_env_source = activate_path
+            self.active_env_type = "venv"
+            self.add_output(f"[System] Venv activated: {self.active_env or os.path.basename(venv_path)}")
+
+    def builtin_conda(self, command, parts):
+        if len(parts) < 2:
+            self.add_output("[System] Usage: conda activate <env> | conda deactivate")
+            return
+        action = parts[1]
+        conda_hook = 'eval "$(conda shell.bash hook 2>/dev/null)"'
+        if action == "activate":
+            if len(parts) < 3:
+                self.add_output("[System] Usage: conda activate <env>")
+                return
+            env_name = parts[2]
+            if self.apply_shell_environment(
+                f"{conda_hook} && conda activate {shlex.quote(env_name)}",
+                "conda activate"
+            ):
+                self.active_env_source = None
+                self.active_env_type = "conda"
+                self.add_output(f"[System] Conda environment activated: {self.active_env or env_name}")
+            return
+        if action == "deactivate":
+            self.deactivate_active_env()
+            return
+        self.add_output("[System] Usage: conda activate <env> | conda deactivate")
+
+    def builtin_launch(self, command, parts):
+        parts = command.strip().split(maxsplit=1)
+        if len(parts) < 2:
+            self.add_output("[System] Usage: launch <command>")
+            return
+        app_command = parts[1].strip()
+        if not app_command:
+            self.add_output("[System] Usage: launch <command>")
+            return
+        self.run_external_app(app_command)
+
+    def builtin_edit(self, command, parts):
+        if len(parts) < 2:
+            self.add_output("[System] Usage: edit <file>")
+            return
+        file_arg = parts[1]
+        if not os.path.isabs(file_arg):
+            file_arg = os.path.join(self.cwd, file_arg)
+        self.start_editor(os.path.abspath(file_arg))
+
+    def builtin_source(self, command, parts):
+        self.source_file(command.strip())
+
+    def builtin_export(self, command, parts):
+        self.add_output("[System] Environment variables set with 'export' only persist in a bash session.")
+        self.add_output("[System] Starting bash...")
+        # Start bash with +m flag to disable job control
+        self.start_pty_command(self.build_shell_command("bash +m 2>&1"))
+        time.sleep(0.2)
+        self.send_to_pty(command + '\n')
+
+    def get_login_target(self, argv):
+        """User a `sudo -i/-s` or `su -/-l` command opens a login shell for, else None"""
+        if not argv or argv[0] not in ("sudo", "su"):
+            return None
+        args = iter(argv[1:])
+        if argv[0] == "su":
+            is_login = False
+            target_user = None
+            for arg in args:
+                if arg in ("-", "-l", "--login"):
+                    is_login = True
+                elif not arg.startswith("-") and target_user is None:
+                    target_user = arg
+            return (target_user or "root") if is_login else None
+
+        is_login = False
+        target_user = None
+        for arg in args:
+            if arg == "--":
+                break
+            if arg.startswith("--"):
+                name, _, value = arg.partition("=")
+                if name in ("--login", "--shell"):
+                    is_login = True
+                elif name == "--user":
+                    target_user = value or next(args, None)
+            elif arg.startswith("-") and len(arg) > 1:
+                # Clustered short flags; -u takes the rest of the cluster or the next argument
+                flags, u_flag, attached = arg[1:].partition("u")
+                if "i" in flags or "s" in flags:
+                    is_login = True
+                if u_flag:
+                    target_user = attached or next(args, None)
+        return (target_user or "root") if is_login else None
+
     def execute_command(self, command):
         """Execute a shell command"""
         if not command.strip():
@@ -1244,315 +2029,83 @@ class ShellExecutor:
             self.send_to_pty(command + '\n')
             return
 
-        resolved_command = self.resolve_history_reference(command)
-        if resolved_command is None:
-            return
-        command = resolved_command
+        # Only "!N" recalls need resolving
+        if command.lstrip().startswith("!"):
+            resolved_command = self.resolve_history_reference(command)
+            if resolved_command is None:
+                return
+            command = resolved_command
         
         # Add to command history
         self.add_history_entry(command)
         
         # Display the command
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.add_output(f"[{timestamp}] {self.get_prompt_text(trailing_space=False)} {command}")
+        self.add_output(f"[{self.timestamp()}] {self.get_prompt_text(trailing_space=False)} {command}")
         
         cmd_lower = command.strip().lower()
         
-        # Handle built-in commands
-        if cmd_lower == "help":
-            self.add_output([
-                "Built-in commands:",
-                "  clear       - Clear the screen",
-                "  cd <dir>    - Change directory",
-                "  launch <cmd> - Temporarily exit SDL and run an app",
-                "  pwd         - Print working directory",
-                "  quit        - Exit the shell",
-                "  jobs        - List running background processes",
-                "  help        - Show this help",
-                "  edit <file> - Open the built-in text editor",
-                "  history     - Show command history",
-                "  history N   - Show entry at index N",
-                "  history -c  - Clear command history",
-                "  !N          - Execute history entry N",
-                "  user [name|reset] - Switch or reset user context",
-                "  root        - Switch to root context",
-                "  deactivate  - Deactivate active venv/conda env",
-                "  venv <path> - Activate a Python venv",
-                "  venv off    - Deactivate current venv",
-                "  conda activate <env> - Activate conda env",
-                "  conda deactivate - Deactivate conda env",
-                "",
-                "Shell built-ins:",
-                "  source <file> - Source file (persists exported vars & cwd)",
-                "  export VAR=val - Set environment variable (requires bash)",
-                "",
-                "Interactive commands (nano, vim, etc.) run in PTY mode.",
-                "In PTY mode: Press L2+R2 together for Ctrl+C to exit apps.",
-                "Keyboard users: Press Ctrl+C, Ctrl+X, or use app exit keys.",
-                "Use '&' at the end of a command to run it in the background.",
-                "All other commands are passed to the system shell."
-            ])
-            return
-        
-        if cmd_lower == "clear":
-            self.clear_output()
+        # Handle built-in commands: exact names need no tokenising
+        handler = self.builtin_commands.get(cmd_lower)
+        if handler is not None:
+            handler(command)
             return
 
-        if cmd_lower.startswith("history"):
-            try:
-                parts = shlex.split(command)
-            except ValueError as e:
-                self.add_output(f"[Error] history: {e}")
-                return
-            if len(parts) == 1:
-                self.add_output(self.format_history_lines())
-                return
-            if parts[1] in ("-c", "clear"):
-                self.clear_history()
-                self.add_output("[System] History cleared.")
+        # Tokenise once; prefix built-ins and the sudo/su check share the result.
+        # Input shlex cannot split (e.g. cd Bob's Files) is still valid for bash and
+        # the raw-text built-ins, so a parse error only stops the handlers that need argv
+        try:
+            argv = shlex.split(command)
+            parse_error = None
+        except ValueError as e:
+            argv = []
+            parse_error = e
+
+        for prefix, handler, uses_argv in self.builtin_prefixes:
+            if cmd_lower.startswith(prefix):
+                if uses_argv and parse_error is not None:
+                    self.add_output(f"[Error] parse: {parse_error}")
+                    return
+                handler(command, argv)
                 return
-            if parts[1].isdigit():
-                index = int(parts[1])
-                entry = self.get_history_entry(index)
-                if entry:
-                    self.add_output(f"{entry['index']:4d}  {entry['command']}")
-                else:
-                    self.add_output(f"[Error] history: no entry at index {index}")
+        stripped = command.strip()
+        for prefix, handler in self.builtin_raw_prefixes:
+            if stripped.startswith(prefix):
+                handler(command, argv)
                 return
-            self.add_output("[Error] history: invalid usage (history, history N, history -c)")
-            return
         
-        if cmd_lower == "pwd":
-            self.add_output(self.cwd)
+        command, alias_note = self.resolve_command_alias(command)
+        if alias_note:
+            self.add_output(f"[System] Alias applied: {alias_note}")
+            # Aliases only swap the leading plain word
+            if argv:
+                argv[0] = command.split(None, 1)[0]
+
+        # Handle sudo/su login shells without entering PTY mode
+        target_user = self.get_login_target(argv)
+        if target_user:
+            if self.switch_user(target_user):
+                home_dir = get_user_home(target_user)
+                if home_dir and os.path.isdir(home_dir):
+                    try:
+                        os.chdir(home_dir)
+                        self.cwd = home_dir
+                        self.add_output(f"[System] Changed directory to: {self.cwd}")
+                    except Exception as e:
+                        self.add_output(f"[Error] Could not chdir to '{home_dir}': {e}")
             return
+
+        # Check if it's an interactive command that needs PTY
+        first_word = command.strip().split()[0] if command.strip() else ""
         
-        if cmd_lower == "jobs":
-            with self.lock:
-                processes = list(self.running_processes)
-            if not processes:
-                self.add_output("[System] No background processes running")
-            else:
-                self.add_output(f"[System] {len(processes)} background process(es) running")
-                for i, proc in enumerate(processes):
-                    status = "running" if proc.poll() is None else "finished"
-                    self.add_output(f"  [{i+1}] PID {proc.pid} - {status}")
+        if first_word in INTERACTIVE_COMMANDS:
+            # Use PTY for interactive commands
+            self.start_pty_command(self.build_shell_command(command))
             return
         
-        if cmd_lower.startswith("cd "):
-            new_dir = command.strip()[3:].strip()
-            try:
-                if new_dir == "~":
-                    new_dir = os.path.expanduser("~")
-                elif not os.path.isabs(new_dir):
-                    new_dir = os.path.join(self.cwd, new_dir)
-                
-                new_dir = os.path.abspath(new_dir)
-                os.chdir(new_dir)
-                self.cwd = new_dir
-                self.add_output(f"[System] Changed directory to: {self.cwd}")
-            except Exception as e:
-                self.add_output(f"[Error] cd: {e}")
-            return
-        
-        if cmd_lower == "quit":
-            global running
-            running = False
-            return
-
-        if cmd_lower == "root":
-            self.switch_user("root")
-            return
-
-        if cmd_lower == "deactivate":
-            self.deactivate_active_env()
-            return
-
-        if cmd_lower.startswith("user"):
-            try:
-                parts = shlex.split(command)
-            except ValueError as e:
-                self.add_output(f"[Error] user: {e}")
-                return
-            if len(parts) == 1:
-                self.add_output(f"[System] Current user: {self.active_user} (host: {self.hostname})")
-                self.add_output("Usage: user <name> | user reset")
-                return
-            if parts[1] in ("reset", "default"):
-                self.switch_user(self.real_user)
-                return
-            self.switch_user(parts[1])
-            return
-
-        if cmd_lower.startswith("venv "):
-            try:
-                parts = shlex.split(command)
-            except ValueError as e:
-                self.add_output(f"[Error] venv: {e}")
-                return
-            if len(parts) < 2:
-                self.add_output("[System] Usage: venv <path> | venv off")
-                return
-            if parts[1] in ("off", "deactivate"):
-                self.deactivate_active_env()
-                return
-            venv_path = os.path.expanduser(parts[1])
-            if not os.path.isabs(venv_path):
-                venv_path = os.path.join(self.cwd, venv_path)
-            activate_path = os.path.abspath(os.path.join(venv_path, "bin", "activate"))
-            if not os.path.exists(activate_path):
-                self.add_output(f"[Error] venv: activate script not found at {activate_path}")
-                return
-            if self.apply_shell_environment(
-                f"source {shlex.quote(activate_path)} >/dev/null 2>&1",
-                "venv activate"
-            ):
-                self.active_env_source = activate_path
-                self.active_env_type = "venv"
-                self.add_output(f"[System] Venv activated: {self.active_env or os.path.basename(venv_path)}")
-            return
-
-        if cmd_lower.startswith("conda "):
-            try:
-                parts = shlex.split(command)
-            except ValueError as e:
-                self.add_output(f"[Error] conda: {e}")
-                return
-            if len(parts) < 2:
-                self.add_output("[System] Usage: conda activate <env> | conda deactivate")
-                return
-            action = parts[1]
-            conda_hook = 'eval "$(conda shell.bash hook 2>/dev/null)"'
-            if action == "activate":
-                if len(parts) < 3:
-                    self.add_output("[System] Usage: conda activate <env>")
-                    return
-                env_name = parts[2]
-                if self.apply_shell_environment(
-                    f"{conda_hook} && conda activate {shlex.quote(env_name)}",
-                    "conda activate"
-                ):
-                    self.active_env_source = None
-                    self.active_env_type = "conda"
-                    self.add_output(f"[System] Conda environment activated: {self.active_env or env_name}")
-                return
-            if action == "deactivate":
-                self.deactivate_active_env()
-                return
-            self.add_output("[System] Usage: conda activate <env> | conda deactivate")
-            return
-
-        if cmd_lower.startswith("launch"):
-            parts = command.strip().split(maxsplit=1)
-            if len(parts) < 2:
-                self.add_output("[System] Usage: launch <command>")
-                return
-            app_command = parts[1].strip()
-            if not app_command:
-                self.add_output("[System] Usage: launch <command>")
-                return
-            self.run_external_app(app_command)
-            return
-
-        if cmd_lower.startswith("edit"):
-            try:
-                parts = shlex.split(command)
-            except ValueError as e:
-                self.add_output(f"[Error] edit: {e}")
-                return
-            if len(parts) < 2:
-                self.add_output("[System] Usage: edit <file>")
-                return
-            file_arg = parts[1]
-            if not os.path.isabs(file_arg):
-                file_arg = os.path.join(self.cwd, file_arg)
-            self.start_editor(os.path.abspath(file_arg))
-            return
-        
-        # Handle 'source' command specially
-        if command.strip().startswith('source ') or command.strip().startswith('. '):
-            self.source_file(command.strip())
-            return
-        
-        # Handle export command
-        if command.strip().startswith('export '):
-            self.add_output("[System] Environment variables set with 'export' only persist in a bash session.")
-            self.add_output("[System] Starting bash...")
-            # Start bash with +m flag to disable job control
-            self.start_pty_command(self.build_shell_command("bash +m 2>&1"))
-            import time
-            time.sleep(0.2)
-            self.send_to_pty(command + '\n')
-            return
-
-        command, alias_note = self.resolve_command_alias(command)
-        if alias_note:
-            self.add_output(f"[System] Alias applied: {alias_note}")
-
-        # Handle sudo/su login shells without entering PTY mode
-        try:
-            login_parts = shlex.split(command)
-        except ValueError:
-            login_parts = []
-        if login_parts:
-            first = login_parts[0]
-            if first in ("sudo", "su"):
-                target_user = None
-                is_login = False
-                if first == "sudo":
-                    args = login_parts[1:]
-                    idx = 0
-                    while idx < len(args):
-                        arg = args[idx]
-                        if arg == "--":
-                            break
-                        if arg in ("-i", "-s", "--login"):
-                            is_login = True
-                        elif arg in ("-u", "--user"):
-                            if idx + 1 < len(args):
-                                target_user = args[idx + 1]
-                                idx += 1
-                        elif arg.startswith("-") and len(arg) > 1:
-                            flags = arg[1:]
-                            if "i" in flags or "s" in flags:
-                                is_login = True
-                            if "u" in flags and idx + 1 < len(args):
-                                target_user = args[idx + 1]
-                                idx += 1
-                        idx += 1
-                    if is_login and not target_user:
-                        target_user = "root"
-                elif first == "su":
-                    is_login = "-" in login_parts or "-l" in login_parts
-                    if len(login_parts) > 1 and login_parts[1] not in ("-", "-l"):
-                        target_user = login_parts[1]
-                    else:
-                        target_user = "root"
-
-                if is_login and target_user:
-                    if self.switch_user(target_user):
-                        home_dir = os.path.expanduser(f"~{target_user}")
-                        if home_dir and os.path.isdir(home_dir):
-                            try:
-                                os.chdir(home_dir)
-                                self.cwd = home_dir
-                                self.add_output(f"[System] Changed directory to: {self.cwd}")
-                            except Exception as e:
-                                self.add_output(f"[Error] Could not chdir to '{home_dir}': {e}")
-                    return
-
-        # Check if it's an interactive command that needs PTY
-        interactive_commands = ['nano', 'vim', 'vi', 'emacs', 'top', 'htop', 'less', 'more', 'man', 'python', 'python3', 'ipython', 'ipython3', 'bash', 'sh', 'zsh', 'fish', 'sudo', 'su', 'doas', 'ssh', 'sftp']
-        first_word = command.strip().split()[0] if command.strip() else ""
-        
-        if first_word in interactive_commands:
-            # Use PTY for interactive commands
-            self.start_pty_command(self.build_shell_command(command))
-            return
-        
-        # Check if it's a background command (ends with &)
-        is_background = command.strip().endswith('&')
-        if is_background:
-            command = command.strip()[:-1].strip()
+        # Check if it's a background command (ends with &)
+        is_background = command.strip().endswith('&')
+        if is_background:
+            command = command.strip()[:-1].strip()
         
         # Execute external command
         try:
@@ -1577,8 +2130,7 @@ class ShellExecutor:
                     cwd=self.cwd,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
-                    text=True,
-                    bufsize=1,
+                    bufsize=0,
                     start_new_session=True
                 )
                 
@@ -1586,13 +2138,9 @@ class ShellExecutor:
                     self.running_processes.append(process)
                     self.foreground_process = process
                 
-                # Start a thread to monitor the process
-                monitor_thread = threading.Thread(
-                    target=self.monitor_process, 
-                    args=(process, command),
-                    daemon=True
-                )
-                monitor_thread.start()
+                # Hand the pipes to the reaper thread
+                self.reaper_queue.put(process)
+                os.write(self.reaper_wakeup[1], b"\0")
                 
         except Exception as e:
             self.add_output(f"[Error] {e}")
@@ -1671,8 +2219,17 @@ class ShellExecutor:
     def get_output(self, count=20):
         """Get last N lines of output"""
         with self.lock:
-            lines = list(self.output_lines)
-            return lines[-count:] if len(lines) > count else lines
+            # Walk back from the newest entry so only the requested lines are touched
+            lines = list(itertools.islice(reversed(self.output_lines.raw), count))
+        lines.reverse()
+        return lines
+
+    def get_visible_output_rows(self, count, scroll, extra_rows=()):
+        """Pre-laid-out output rows for the visible window"""
+        with self.lock:
+            if self.output_lines.layout_char_width != char_width:
+                self.output_lines.relayout(char_width)
+            return self.output_lines.visible_rows(count, scroll, extra_rows)
     
     def get_history_prev(self):
         """Get previous command from history"""
@@ -1720,24 +2277,11 @@ class ShellExecutor:
             quote_char = current_word[0]
             word_body = current_word[1:]
         
-        # Command aliases for quick completion
-        command_aliases = {
-            'py': 'python3',
-            'python': 'python3',
-            'ipy': 'ipython3',
-            'v': 'vim',
-            'n': 'nano',
-            'll': 'ls -lah',
-            'la': 'ls -a',
-            'cls': 'clear',
-            'h': 'history'
-        }
-        
         # If it's the first word (command), try command completion
         if len(words_before) == 1:
             # Check aliases first
-            if word_body in command_aliases and not quote_char:
-                completed = command_aliases[word_body]
+            if word_body in COMPLETION_ALIASES and not quote_char:
+                completed = COMPLETION_ALIASES[word_body]
                 new_text = text[:word_start_pos] + completed + after_cursor
                 new_cursor_pos = word_start_pos + len(completed)
                 self.add_output(f"[Autocomplete] {word_body} → {completed}")
@@ -1745,15 +2289,7 @@ class ShellExecutor:
             
             # Try to find matching commands in PATH
             try:
-                import subprocess
-                result = subprocess.run(
-                    f"compgen -c {word_body}",
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=1
-                )
-                matches = [m for m in result.stdout.split('\n') if m.strip()]
+                matches = self.complete_command(word_body)
                 
                 if len(matches) == 1:
                     completed = matches[0]
@@ -1771,32 +2307,41 @@ class ShellExecutor:
         
         # Try path completion
         try:
-            import glob
             expanded = os.path.expanduser(word_body)
             is_abs = os.path.isabs(expanded)
             search_base = expanded
             if not is_abs:
                 search_base = os.path.join(self.cwd, expanded)
 
-            matches = glob.glob(search_base + '*')
+            # One directory listing instead of glob; like glob, hidden names need a leading dot
+            parent, leaf = os.path.split(search_base)
+            show_hidden = leaf.startswith('.')
+            matches = []  # Entry names in parent
+            match_is_dir = []
+            with os.scandir(parent) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.startswith(leaf) and (show_hidden or not name.startswith('.')):
+                        matches.append(name)
+                        match_is_dir.append(entry.is_dir())
             if matches:
+                cwd_prefix = self.cwd + os.sep
+                home = os.path.expanduser('~') if word_body.startswith('~') else None
+
                 def to_display_path(path):
                     display = path
                     if not is_abs:
-                        if path.startswith(self.cwd + os.sep):
-                            display = path[len(self.cwd) + 1:]
+                        if path.startswith(cwd_prefix):
+                            display = path[len(cwd_prefix):]
                         elif path.startswith(self.cwd):
                             display = path[len(self.cwd):]
-                    if word_body.startswith('~'):
-                        home = os.path.expanduser('~')
-                        if path.startswith(home):
-                            display = '~' + path[len(home):]
+                    if home is not None and path.startswith(home):
+                        display = '~' + path[len(home):]
                     return display
 
-                display_matches = [to_display_path(m) for m in matches]
-                if len(display_matches) == 1:
-                    completed = display_matches[0]
-                    if os.path.isdir(matches[0]) and not completed.endswith('/'):
+                if len(matches) == 1:
+                    completed = to_display_path(os.path.join(parent, matches[0]))
+                    if match_is_dir[0] and not completed.endswith('/'):
                         completed += '/'
                     completed = f"{quote_char}{completed}" if quote_char else completed
                     new_text = text[:word_start_pos] + completed + after_cursor
@@ -1804,18 +2349,18 @@ class ShellExecutor:
                     self.add_output(f"[Autocomplete] {current_word} → {completed}")
                     return new_text, new_cursor_pos
 
-                common_prefix = os.path.commonprefix(display_matches)
-                if common_prefix and len(common_prefix) > len(word_body):
-                    completed = common_prefix
+                # Every match shares parent, so only the names need comparing
+                common_prefix = os.path.commonprefix(matches)
+                if len(common_prefix) > len(leaf):
+                    completed = to_display_path(os.path.join(parent, common_prefix))
                     completed = f"{quote_char}{completed}" if quote_char else completed
                     new_text = text[:word_start_pos] + completed + after_cursor
                     new_cursor_pos = word_start_pos + len(completed)
                     self.add_output(f"[Autocomplete] {current_word} → {completed}")
                     return new_text, new_cursor_pos
 
-                preview_matches = [os.path.basename(m) or m for m in display_matches[:8]]
-                self.add_output(f"[Autocomplete] {', '.join(preview_matches)}" +
-                              (f" ... ({len(display_matches)} total)" if len(display_matches) > 8 else ""))
+                self.add_output(f"[Autocomplete] {', '.join(matches[:8])}" +
+                              (f" ... ({len(matches)} total)" if len(matches) > 8 else ""))
         except:
             pass
         
@@ -1828,27 +2373,13 @@ class ShellExecutor:
             return False
         
         if ctrl:
-            # Ctrl+key combinations
-            if char.lower() in 'abcdefghijklmnopqrstuvwxyz':
-                # Ctrl+letter = that letter's position in alphabet (A=1, B=2, etc.)
-                ctrl_code = ord(char.lower()) - ord('a') + 1
-                self.add_output(f"[System] Sent Ctrl+{char.upper()}")
-                return self.send_to_pty(chr(ctrl_code))
-            elif char == ' ':
-                self.add_output("[System] Sent Ctrl+Space")
-                return self.send_to_pty('\x00')  # Ctrl+Space
-            elif char == '\\':
-                self.add_output("[System] Sent Ctrl+\\")
-                return self.send_to_pty('\x1c')  # Ctrl+\
-            elif char == ']':
-                self.add_output("[System] Sent Ctrl+]")
-                return self.send_to_pty('\x1d')  # Ctrl+]
-            elif char == '_':
-                self.add_output("[System] Sent Ctrl+_")
-                return self.send_to_pty('\x1f')  # Ctrl+_
-            else:
-                # For non-letter characters, just send the character
+            combo = CTRL_KEY_CODES.get(char)
+            if combo is None:
+                # No control code for this key, just send the character
                 return self.send_to_pty(char)
+            code, label = combo
+            self.add_output(f"[System] Sent Ctrl+{label}")
+            return self.send_to_pty(code)
         
         if alt:
             # Alt+key sends ESC followed by key
@@ -1873,10 +2404,11 @@ class TextEditor:
 
     def load_file(self):
         if os.path.exists(self.file_path):
-            with open(self.file_path, "r", encoding="utf-8", errors="replace") as handle:
-                content = handle.read()
+            # One binary read and one decode; splitlines already handles \r\n, so skip newline translation
+            with open(self.file_path, "rb") as handle:
+                content = handle.read().decode("utf-8", errors="replace")
             self.lines = content.splitlines()
-            if content.endswith("\n"):
+            if content.endswith(("\n", "\r")):
                 self.lines.append("")
             if not self.lines:
                 self.lines = [""]
@@ -1890,9 +2422,10 @@ class TextEditor:
         self.dirty = False
 
     def save_file(self):
-        content = "\n".join(self.lines)
-        with open(self.file_path, "w", encoding="utf-8") as handle:
-            handle.write(content)
+        # Stream line by line so a large file is never joined into one string
+        with open(self.file_path, "w", encoding="utf-8", buffering=65536) as handle:
+            handle.writelines(line + "\n" for line in itertools.islice(self.lines, len(self.lines) - 1))
+            handle.write(self.lines[-1])
         self.dirty = False
 
     def _clamp_cursor(self):
@@ -1947,7 +2480,12 @@ class TextEditor:
             self.delete_selection()
         if "\n" not in text:
             line = self.lines[self.cursor_line]
-            self.lines[self.cursor_line] = line[:self.cursor_col] + text + line[self.cursor_col:]
+            col = self.cursor_col
+            if col >= len(line):
+                self.lines[self.cursor_line] = line + text  # Typing at the end of the line needs no slicing
+            else:
+                # Still slices both halves; the f-string only saves the temporary from a chained +
+                self.lines[self.cursor_line] = f"{line[:col]}{text}{line[col:]}"
             self.cursor_col += len(text)
         else:
             parts = text.split("\n")
@@ -2046,11 +2584,13 @@ class TextEditor:
         (start_line, start_col), (end_line, end_col) = selection
         if start_line == end_line:
             return self.lines[start_line][start_col:end_col]
-        pieces = [self.lines[start_line][start_col:]]
-        for line in self.lines[start_line + 1:end_line]:
-            pieces.append(line)
-        pieces.append(self.lines[end_line][:end_col])
-        return "\n".join(pieces)
+        if start_line == 0 and start_col == 0 and end_line == len(self.lines) - 1 and end_col == len(self.lines[-1]):
+            return "\n".join(self.lines)  # Select-all
+        return "\n".join(itertools.chain(
+            (self.lines[start_line][start_col:],),
+            itertools.islice(self.lines, start_line + 1, end_line),
+            (self.lines[end_line][:end_col],)
+        ))
 
     def copy_selection(self):
         if self.has_selection():
@@ -2080,6 +2620,16 @@ class TextEditor:
         elif self.cursor_col >= self.scroll_col + cols_per_page:
             self.scroll_col = self.cursor_col - cols_per_page + 1
 
+SHELL_OUTPUT_EVENT = sdl2.SDL_RegisterEvents(1)  # Private event type for "shell output changed"
+if SHELL_OUTPUT_EVENT == 0xFFFFFFFF:
+    SHELL_OUTPUT_EVENT = sdl2.SDL_USEREVENT
+shell_output_event = sdl2.SDL_Event()  # SDL_PushEvent copies it, so one instance serves every thread
+shell_output_event.type = SHELL_OUTPUT_EVENT
+
+def wake_main_loop():
+    """Push SHELL_OUTPUT_EVENT so an idle main loop wakes up; SDL_PushEvent is thread-safe"""
+    sdl2.SDL_PushEvent(ctypes.byref(shell_output_event))
+
 # Initialize shell executor
 shell = ShellExecutor()
 
@@ -2088,7 +2638,7 @@ shell = ShellExecutor()
 # -----------------------------
 joystick = None
 num_buttons = 0
-button_states = []
+button_mask = 0
 window = None
 renderer = None
 factory = None
@@ -2097,7 +2647,7 @@ font_manager_large = None
 ui_font_manager = None
 
 def setup_sdl():
-    global joystick, num_buttons, button_states
+    global joystick, num_buttons, button_mask
     global window, renderer, factory, font_manager, font_manager_large
 
     if sdl2.SDL_Init(sdl2.SDL_INIT_VIDEO | sdl2.SDL_INIT_JOYSTICK) != 0:
@@ -2106,38 +2656,48 @@ def setup_sdl():
 
     joystick = None
     num_buttons = 0
-    button_states = []
+    button_mask = 0
 
     if sdl2.SDL_NumJoysticks() >= 1:
         joystick = sdl2.SDL_JoystickOpen(0)
         if joystick:
             num_buttons = sdl2.SDL_JoystickNumButtons(joystick)
-            button_states = [False] * num_buttons
             print(f"Joystick connected: {sdl2.SDL_JoystickName(joystick).decode()}")
     else:
         print("Warning: No joystick detected - keyboard controls only")
 
     window = sdl2.ext.Window("Interactive Linux Shell", size=(SCREEN_WIDTH, SCREEN_HEIGHT))
     window.show()
-    renderer = sdl2.ext.Renderer(window)
+    # Let SDL merge consecutive same-state draws; it stays off by default when a driver is forced via SDL_RENDER_DRIVER
+    sdl2.SDL_SetHint(sdl2.SDL_HINT_RENDER_BATCHING, b"1")
+    # Presents wait for vblank, so frames land on the refresh; MIN_FRAME_TIME stays as the upper rate cap
+    renderer = sdl2.ext.Renderer(window, flags=sdl2.SDL_RENDERER_ACCELERATED | sdl2.SDL_RENDERER_PRESENTVSYNC)
     sdl2.SDL_SetRenderDrawBlendMode(renderer.sdlrenderer, sdl2.SDL_BLENDMODE_BLEND)
     factory = sdl2.ext.SpriteFactory(sdl2.ext.TEXTURE, renderer=renderer)
 
     update_font_managers(
-        theme_settings.get("font_path", "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"),
-        theme_settings.get("font_size", 14),
+        theme_settings["font_path"],
+        theme_settings["font_size"],
     )
     init_click_sound()
     return True
 
 def suspend_sdl():
-    global window, renderer, factory, background_texture
-    global joystick, num_buttons, button_states
+    global window, renderer, factory, background_texture, frame_texture, overlay_texture, frame_overlay
+    global joystick, num_buttons, button_mask
 
     if background_texture:
         sdl2.SDL_DestroyTexture(background_texture)
         background_texture = None
-
+    if frame_texture:
+        sdl2.SDL_DestroyTexture(frame_texture)
+        frame_texture = None
+    if overlay_texture:
+        sdl2.SDL_DestroyTexture(overlay_texture)
+        overlay_texture = None
+    frame_overlay = None
+
+    clear_text_caches()
     if renderer:
         sdl2.SDL_DestroyRenderer(renderer.sdlrenderer)
         renderer = None
@@ -2151,7 +2711,7 @@ def suspend_sdl():
         sdl2.SDL_JoystickClose(joystick)
         joystick = None
         num_buttons = 0
-        button_states = []
+        button_mask = 0
 
     shutdown_audio()
     sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_VIDEO | sdl2.SDL_INIT_JOYSTICK)
@@ -2161,58 +2721,276 @@ def resume_sdl():
     if not setup_sdl():
         return False
     update_background_texture()
-    if "needs_redraw" in globals():
-        globals()["needs_redraw"] = True
+    if "redraw_flags" in globals():
+        globals()["redraw_flags"] |= REDRAW_FRAME
     return True
 
+GLYPH_CACHE_LIMIT = 4096
+TEXT_CACHE_LIMIT = 512
+glyph_cache = OrderedDict()
+text_sprite_cache = OrderedDict()
+blit_rect = sdl2.SDL_Rect()
+shape_rect = sdl2.SDL_Rect()  # Scratch rect for fills and outlines on the render thread
+
+def clear_text_caches():
+    """Drop cached text textures (font change or renderer teardown)"""
+    glyph_cache.clear()
+    text_sprite_cache.clear()
+    glyph_atlases.clear()
+    output_panel_cache["key"] = None
+    output_panel_cache["batch"] = None
+    keyboard_label_cache["key"] = None
+    keyboard_label_cache["batch"] = None
+    header_cache["key"] = None
+    header_cache["batch"] = None
+    editor_text_cache["key"] = None
+    editor_text_cache["batch"] = None
+
+def get_cached_sprite(cache, limit, key, text, fontmanager):
+    """Return a white sprite for text from an LRU cache (None if it cannot be rendered)"""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    try:
+        sprite = factory.from_text(text, fontmanager=fontmanager, color=sdl2.ext.Color(255, 255, 255))
+    except Exception:
+        sprite = None
+    cache[key] = sprite
+    if len(cache) > limit:
+        cache.popitem(last=False)
+    return sprite
+
+def drop_font_textures(fontmanagers):
+    """Forget textures rendered with fontmanagers once their font bucket is evicted"""
+    for cache in (glyph_cache, text_sprite_cache):
+        for key in [key for key in cache if key[1] in fontmanagers]:
+            del cache[key]
+    for fontmanager in fontmanagers:
+        glyph_atlases.pop(fontmanager, None)
+
+def get_glyph(ch, fontmanager):
+    return get_cached_sprite(glyph_cache, GLYPH_CACHE_LIMIT, (ch, fontmanager), ch, fontmanager)
+
+def get_text_sprite(text, fontmanager):
+    return get_cached_sprite(text_sprite_cache, TEXT_CACHE_LIMIT, (text, fontmanager), text, fontmanager)
+
+def blit_sprite(sprite, x, y, color):
+    """Copy a white sprite tinted with color"""
+    texture = sprite.texture
+    sdl2.SDL_SetTextureColorMod(texture, color.r, color.g, color.b)
+    sdl2.SDL_SetTextureAlphaMod(texture, color.a)
+    blit_rect.x = int(x)
+    blit_rect.y = int(y)
+    blit_rect.w, blit_rect.h = sprite.size
+    sdl2.SDL_RenderCopy(renderer.sdlrenderer, texture, None, blit_rect)
+
+ATLAS_CHARS = "".join(chr(code) for code in range(32, 127)) + "".join(chr(code) for code in range(0x2500, 0x2580))
+ATLAS_COLUMNS = 16
+glyph_atlases = {}
+geometry_supported = True
+glyph_indices = (ctypes.c_int * 0)()
+
+def build_glyph_atlas(fontmanager):
+    """Pack ATLAS_CHARS into one white texture, returning (sprite, {ch: (u0, v0, u1, v1, w, h)})"""
+    white = sdl2.ext.Color(255, 255, 255)
+    surfaces = []
+    cell_w = cell_h = 1
+    try:
+        for ch in ATLAS_CHARS:
+            surface = fontmanager.render(ch, color=white)
+            surfaces.append((ch, surface))
+            cell_w = max(cell_w, surface.w)
+            cell_h = max(cell_h, surface.h)
+        rows = (len(surfaces) + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS
+        atlas_w = cell_w * ATLAS_COLUMNS
+        atlas_h = cell_h * rows
+        atlas = sdl2.SDL_CreateRGBSurfaceWithFormat(0, atlas_w, atlas_h, 32, sdl2.SDL_PIXELFORMAT_ARGB8888)
+        if not atlas:
+            return None
+        metrics = {}
+        for index, (ch, surface) in enumerate(surfaces):
+            cell_x = (index % ATLAS_COLUMNS) * cell_w
+            cell_y = (index // ATLAS_COLUMNS) * cell_h
+            sdl2.SDL_SetSurfaceBlendMode(surface, sdl2.SDL_BLENDMODE_NONE)
+            sdl2.SDL_BlitSurface(surface, None, atlas, sdl2.SDL_Rect(cell_x, cell_y, surface.w, surface.h))
+            metrics[ch] = (
+                cell_x / atlas_w, cell_y / atlas_h,
+                (cell_x + surface.w) / atlas_w, (cell_y + surface.h) / atlas_h,
+                surface.w, surface.h
+            )
+        texture = sdl2.SDL_CreateTextureFromSurface(renderer.sdlrenderer, atlas)
+        sdl2.SDL_FreeSurface(atlas)
+        if not texture:
+            return None
+        sdl2.SDL_SetTextureBlendMode(texture, sdl2.SDL_BLENDMODE_BLEND)
+        return sdl2.ext.TextureSprite(texture), metrics
+    except Exception:
+        return None
+    finally:
+        for _, surface in surfaces:
+            sdl2.SDL_FreeSurface(surface)
+
+def get_glyph_atlas(fontmanager):
+    if not geometry_supported:
+        return None
+    if fontmanager not in glyph_atlases:
+        glyph_atlases[fontmanager] = build_glyph_atlas(fontmanager)
+    return glyph_atlases[fontmanager]
+
+def get_glyph_indices(quad_count):
+    """Shared index buffer describing two triangles per glyph quad"""
+    global glyph_indices
+    if len(glyph_indices) < quad_count * 6:
+        size = max(quad_count, 256)
+        indices = []
+        for quad in range(size):
+            base = quad * 4
+            indices.extend((base, base + 1, base + 2, base, base + 2, base + 3))
+        glyph_indices = (ctypes.c_int * len(indices))(*indices)
+    return glyph_indices
+
+def new_glyph_batch(fontmanager):
+    """Display list of glyph quads (atlas) plus per-glyph blits for everything else"""
+    return {"font": fontmanager, "xy": [], "uv": [], "rgba": [], "blits": [], "arrays": None}
+
+def queue_glyphs(batch, text, x, y, color):
+    """Queue text into batch, returning the end x"""
+    fontmanager = batch["font"]
+    atlas = get_glyph_atlas(fontmanager)
+    if atlas is None:
+        batch["blits"].append((text, x, y, color))
+        return x + sum(get_glyph_advance(ch, fontmanager) for ch in text)
+    metrics = atlas[1]
+    xy = batch["xy"]
+    uv = batch["uv"]
+    quad_color = (color.r, color.g, color.b, color.a) * 4
+    current_x = x
+    for ch in text:
+        glyph = metrics.get(ch)
+        if glyph is None:
+            batch["blits"].append((ch, current_x, y, color))
+            current_x += get_glyph_advance(ch, fontmanager)
+            continue
+        u0, v0, u1, v1, w, h = glyph
+        if ch != " ":
+            x1 = current_x + w
+            y1 = y + h
+            xy.extend((current_x, y, x1, y, x1, y1, current_x, y1))
+            uv.extend((u0, v0, u1, v0, u1, v1, u0, v1))
+            batch["rgba"].extend(quad_color)
+        current_x += w
+    batch["arrays"] = None
+    return current_x
+
+def draw_glyph_batch(batch):
+    """Draw a queued batch; atlas quads go out in a single SDL_RenderGeometryRaw call"""
+    global geometry_supported
+    xy = batch["xy"]
+    atlas = get_glyph_atlas(batch["font"]) if xy else None
+    if atlas is not None:
+        if batch["arrays"] is None:
+            batch["arrays"] = (
+                (ctypes.c_float * len(xy))(*xy),
+                (ctypes.c_float * len(batch["uv"]))(*batch["uv"]),
+                (ctypes.c_uint8 * len(batch["rgba"]))(*batch["rgba"]),
+            )
+        xy_array, uv_array, rgba_array = batch["arrays"]
+        vertex_count = len(xy) // 2
+        quad_count = vertex_count // 4
+        try:
+            result = sdl2.SDL_RenderGeometryRaw(
+                renderer.sdlrenderer, atlas[0].texture,
+                xy_array, 8,
+                ctypes.cast(rgba_array, ctypes.POINTER(sdl2.SDL_Color)), 4,
+                uv_array, 8,
+                vertex_count, get_glyph_indices(quad_count), quad_count * 6, 4
+            )
+        except Exception:
+            result = -1
+        if result != 0:
+            # Renderer or SDL build without geometry support: draw per glyph from now on
+            geometry_supported = False
+            glyph_atlases.clear()
+    for text, x, y, color in batch["blits"]:
+        blit_glyphs(text, x, y, color, batch["font"])
+
+def get_glyph_advance(ch, fontmanager):
+    sprite = get_glyph(ch, fontmanager)
+    if sprite is None:
+        return char_width
+    return sprite.size[0]
+
+def blit_glyphs(text, x, y, color, fontmanager):
+    """Render text one cached glyph at a time, returning the end x"""
+    current_x = x
+    for ch in text:
+        sprite = get_glyph(ch, fontmanager)
+        if sprite is None:
+            current_x += char_width
+            continue
+        if ch != " ":
+            blit_sprite(sprite, current_x, y, color)
+        current_x += sprite.size[0]
+    return current_x
+
+def render_glyphs(text, x, y, color, fontmanager):
+    """Render text through the glyph atlas when possible, returning the end x"""
+    batch = new_glyph_batch(fontmanager)
+    end_x = queue_glyphs(batch, text, x, y, color)
+    draw_glyph_batch(batch)
+    return end_x
+
 def render_text(text, x, y, color=sdl2.ext.Color(255, 255, 255)):
     """Render text at position"""
     if not text or not str(text).strip():
         return
-    try:
-        sprite = factory.from_text(str(text), fontmanager=font_manager, color=color)
-        renderer.copy(sprite, dstrect=(x, y, sprite.size[0], sprite.size[1]))
-    except:
-        pass
+    render_glyphs(str(text), x, y, color, font_manager)
 
 def render_text_large(text, x, y, color=sdl2.ext.Color(255, 255, 255)):
     """Render larger text at position (for keyboard keys)"""
     if not text or not str(text).strip():
         return
-    try:
-        sprite = factory.from_text(str(text), fontmanager=font_manager_large, color=color)
-        renderer.copy(sprite, dstrect=(x, y, sprite.size[0], sprite.size[1]))
-    except:
-        pass
+    sprite = get_text_sprite(str(text), font_manager_large)
+    if sprite is not None:
+        blit_sprite(sprite, x, y, color)
 
 def render_text_ui(text, x, y, color=sdl2.ext.Color(255, 255, 255)):
     """Render UI text at a fixed size."""
     if not text or not str(text).strip():
         return
-    try:
-        sprite = factory.from_text(str(text), fontmanager=ui_font_manager, color=color)
-        renderer.copy(sprite, dstrect=(x, y, sprite.size[0], sprite.size[1]))
-    except:
-        pass
+    sprite = get_text_sprite(str(text), ui_font_manager)
+    if sprite is not None:
+        blit_sprite(sprite, x, y, color)
 
 def get_text_size(text, fontmanager):
     if not text or not str(text).strip():
         return 0, 0
-    try:
-        sprite = factory.from_text(str(text), fontmanager=fontmanager, color=sdl2.ext.Color(255, 255, 255))
-        return sprite.size
-    except:
+    sprite = get_text_sprite(str(text), fontmanager)
+    if sprite is None:
         return 0, 0
+    return sprite.size
 
 def render_text_centered(text, center_x, y, color, fontmanager):
-    width, _ = get_text_size(text, fontmanager)
-    render_text_ui(text, int(center_x - width / 2), y, color)
+    # The cached sprite carries its own size, so measuring and drawing share one lookup
+    if not text or not str(text).strip():
+        return
+    sprite = get_text_sprite(str(text), fontmanager)
+    if sprite is not None:
+        blit_sprite(sprite, int(center_x - sprite.size[0] / 2), y, color)
 
 def fill_rect(renderer, color, rect):
     """Fill rectangle with color"""
     sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, color.r, color.g, color.b, color.a)
-    r = sdl2.SDL_Rect(rect[0], rect[1], rect[2], rect[3])
-    sdl2.SDL_RenderFillRect(renderer.sdlrenderer, r)
+    shape_rect.x, shape_rect.y, shape_rect.w, shape_rect.h = rect
+    sdl2.SDL_RenderFillRect(renderer.sdlrenderer, shape_rect)
+
+def fill_rects(renderer, color, rects):
+    """Fill several rectangles of one color with a single draw call"""
+    if not rects:
+        return
+    sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, color.r, color.g, color.b, color.a)
+    rect_array = (sdl2.SDL_Rect * len(rects))(*rects)  # ctypes fills each struct from its tuple
+    sdl2.SDL_RenderFillRects(renderer.sdlrenderer, rect_array, len(rects))
 
 def load_background_texture(path):
     """Load background image as texture if path exists"""
@@ -2230,23 +3008,22 @@ def load_background_texture(path):
     except Exception:
         return None
 
-def wrap_text(text, max_width, char_width=None):
-    """Wrap text to fit within max_width"""
+def wrap_char_limit(max_width, char_width=None):
+    """Number of characters per wrapped line"""
     if char_width is None:
         char_width = globals().get("char_width", 8)
-    max_chars = max_width // char_width
+    return max(1, max_width // char_width)
+
+def wrap_text(text, max_width, char_width=None):
+    """Wrap text to fit within max_width"""
+    max_chars = wrap_char_limit(max_width, char_width)
     if len(text) <= max_chars:
         return [text]
-    
-    lines = []
-    while text:
-        lines.append(text[:max_chars])
-        text = text[max_chars:]
-    return lines
+    return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
 
 SHELL_HIGHLIGHT_PATTERN = re.compile(
     r"\b(error|failed|failure|fail|fatal|panic|oops|segfault|critical|warn|warning|deprecated|timeout|timed out|info|notice|debug|ok|success|started|done|complete)\b",
-    re.IGNORECASE
+    re.IGNORECASE | re.ASCII  # Keywords are ASCII; skips Unicode case folding
 )
 
 EDITOR_KEYWORDS = {
@@ -2256,122 +3033,158 @@ EDITOR_KEYWORDS = {
     "not", "or", "pass", "raise", "return", "struct", "switch", "try", "var",
     "while", "with", "yield"
 }
-EDITOR_KEYWORD_PATTERN = re.compile(r"\b(" + "|".join(sorted(EDITOR_KEYWORDS)) + r")\b")
-EDITOR_NUMBER_PATTERN = re.compile(r"\b\d+(\.\d+)?\b")
-
-def render_text_segments(segments, x, y):
-    current_x = x
+EDITOR_TOKEN_PATTERN = re.compile(
+    r"\b(?P<keyword>" + "|".join(sorted(EDITOR_KEYWORDS)) + r")\b|(?P<number>\b\d+(?:\.\d+)?\b)"
+)  # Keywords and numbers in one scan; lastgroup names the match
+EDITOR_LINE_TOKEN_PATTERN = re.compile(
+    r"""(?P<string>'(?:[^'\\]|\\.?)*'?|"(?:[^"\\]|\\.?)*"?)|(?P<comment>(?:#|//).*)|(?P<code>(?:[^'"#/]|/(?!/))+)""",
+    re.DOTALL
+)  # Strings honour backslash escapes and run to the closing quote or end of line
+
+def queue_text_segments(batch, segments, x, y):
+    # Adjacent segments that share a colour are queued as one run
+    runs = []
     for text, color in segments:
-        if text:
-            render_text(text, current_x, y, color)
+        if runs and runs[-1][1] == color:
+            runs[-1][0] += text
+        else:
+            runs.append([text, color])
+    current_x = x
+    for text, color in runs:
+        if text and text.strip():
+            queue_glyphs(batch, text, current_x, y, color)
         current_x += len(text) * char_width
     return current_x
 
-def get_shell_line_segments(line, theme):
-    base_color = make_color(theme["output_text"])
+def render_text_segments(segments, x, y):
+    batch = new_glyph_batch(font_manager)
+    current_x = queue_text_segments(batch, segments, x, y)
+    draw_glyph_batch(batch)
+    return current_x
+
+output_panel_cache = {"key": None, "batch": None}
+header_cache = {"key": None, "batch": None}
+editor_text_cache = {"key": None, "batch": None}
+
+def build_output_batch(theme, partial_line, output_start_y, max_lines):
+    """Lay out the visible shell output rows into a reusable glyph batch"""
+    partial_rows = ()
+    if partial_line:
+        partial_rows = tuple(get_shell_line_runs(row) for row in wrap_text(partial_line, SCREEN_WIDTH-20))
+    rows = shell.get_visible_output_rows(max_lines, output_scroll, partial_rows)
+    colors = get_theme_colors(theme)
+    y_offset = output_start_y
+    batch = new_glyph_batch(font_manager)
+    for runs in rows:
+        segments = [(text, colors[color_key]) for text, color_key in runs]
+        queue_text_segments(batch, segments, 10, y_offset)
+        y_offset += 18
+    return batch
+
+def build_editor_text_batch(theme, lines, first_line_idx, scroll_col, max_cols, layout):
+    """Lay out the visible editor rows and their line numbers into one reusable glyph batch"""
+    colors = get_theme_colors(theme)
+    line_number_color = colors["input_counter"]
+    gutter_x = layout["text_left"]
+    text_x = layout["text_left"] + layout["gutter_width"]
+    y_offset = layout["text_top"]
+    batch = new_glyph_batch(font_manager)
+    for line_idx, line in enumerate(lines, first_line_idx):
+        queue_glyphs(batch, f"{line_idx + 1:4d}", gutter_x, y_offset, line_number_color)
+        visible_line = line[scroll_col:scroll_col + max_cols]
+        queue_text_segments(batch, get_editor_line_segments(visible_line, theme), text_x, y_offset)
+        y_offset += layout["line_height"]
+    return batch
+
+SHELL_ERROR_WORDS = {"error", "failed", "failure", "fail", "fatal", "panic", "oops", "segfault", "critical"}
+SHELL_WARNING_WORDS = {"warn", "warning", "deprecated", "timeout", "timed out"}
+SHELL_INFO_WORDS = {"info", "notice", "debug"}
+# Lowercased highlight word -> theme color key; anything else matched is "input_text"
+SHELL_HIGHLIGHT_KEYS = {
+    **dict.fromkeys(SHELL_INFO_WORDS, "output_prompt"),
+    **dict.fromkeys(SHELL_WARNING_WORDS, "output_system"),
+    **dict.fromkeys(SHELL_ERROR_WORDS, "output_error"),
+}
+
+def get_shell_line_runs(line):
+    """Split a display row into (text, theme color key) runs"""
+    base_key = "output_text"
     if line.startswith("[Error]"):
-        return [(line, make_color(theme["output_error"]))]
+        return ((line, "output_error"),)
     if line.startswith("[System]"):
-        base_color = make_color(theme["output_system"])
+        base_key = "output_system"
     elif line.startswith("[") and "] $" in line:
-        base_color = make_color(theme["output_prompt"])
+        base_key = "output_prompt"
     elif line.startswith("$"):
-        base_color = make_color(theme["output_prompt"])
+        base_key = "output_prompt"
 
-    segments = []
+    first = SHELL_HIGHLIGHT_PATTERN.search(line)
+    if first is None:
+        return ((line, base_key),)
+    runs = []
     last_idx = 0
-    for match in SHELL_HIGHLIGHT_PATTERN.finditer(line):
+    for match in itertools.chain((first,), SHELL_HIGHLIGHT_PATTERN.finditer(line, first.end())):
         start, end = match.span()
         if start > last_idx:
-            segments.append((line[last_idx:start], base_color))
+            runs.append((line[last_idx:start], base_key))
         word = match.group(0)
-        lowered = word.lower()
-        if lowered in {"error", "failed", "failure", "fail", "fatal", "panic", "oops", "segfault", "critical"}:
-            color = make_color(theme["output_error"])
-        elif lowered in {"warn", "warning", "deprecated", "timeout", "timed out"}:
-            color = make_color(theme["output_system"])
-        elif lowered in {"info", "notice", "debug"}:
-            color = make_color(theme["output_prompt"])
-        else:
-            color = make_color(theme["input_text"])
-        segments.append((word, color))
+        # Output is mostly lowercase already, so try the word as-is before folding it
+        runs.append((word, SHELL_HIGHLIGHT_KEYS.get(word) or SHELL_HIGHLIGHT_KEYS.get(word.lower(), "input_text")))
         last_idx = end
     if last_idx < len(line):
-        segments.append((line[last_idx:], base_color))
-    return segments if segments else [(line, base_color)]
-
-def highlight_editor_code_span(span, theme):
-    segments = []
+        runs.append((line[last_idx:], base_key))
+    return tuple(runs)
+
+def highlight_editor_code_span(segments, span, colors):
+    # Appends into the caller's list so a line builds a single segment list
+    keyword_color = colors["syntax_keyword"]
+    number_color = colors["syntax_number"]
+    text_color = colors["output_text"]
     idx = 0
-    for match in EDITOR_KEYWORD_PATTERN.finditer(span):
+    for match in EDITOR_TOKEN_PATTERN.finditer(span):
         start, end = match.span()
         if start > idx:
-            segments.append((span[idx:start], "base"))
-        segments.append((match.group(0), "keyword"))
+            segments.append((span[idx:start], text_color))
+        segments.append((match.group(), keyword_color if match.lastgroup == "keyword" else number_color))
         idx = end
     if idx < len(span):
-        segments.append((span[idx:], "base"))
-
-    final_segments = []
-    for text, style in segments:
-        if style == "keyword":
-            final_segments.append((text, make_color(theme["syntax_keyword"])))
-            continue
-        last_pos = 0
-        for num_match in EDITOR_NUMBER_PATTERN.finditer(text):
-            start, end = num_match.span()
-            if start > last_pos:
-                final_segments.append((text[last_pos:start], make_color(theme["output_text"])))
-            final_segments.append((text[start:end], make_color(theme["syntax_number"])))
-            last_pos = end
-        if last_pos < len(text):
-            final_segments.append((text[last_pos:], make_color(theme["output_text"])))
-    return final_segments
+        segments.append((span[idx:], text_color))
 
 def get_editor_line_segments(line, theme):
+    colors = get_theme_colors(theme)
     segments = []
-    i = 0
-    while i < len(line):
-        char = line[i]
-        next_char = line[i + 1] if i + 1 < len(line) else ""
-        if char in ("'", '"'):
-            quote = char
-            end_idx = line.find(quote, i + 1)
-            if end_idx == -1:
-                string_text = line[i:]
-                i = len(line)
-            else:
-                string_text = line[i:end_idx + 1]
-                i = end_idx + 1
-            segments.append((string_text, make_color(theme["syntax_string"])))
-            continue
-        if char == "#" or (char == "/" and next_char == "/"):
-            comment_text = line[i:]
-            segments.append((comment_text, make_color(theme["syntax_comment"])))
-            return segments
-        code_start = i
-        while i < len(line):
-            char = line[i]
-            next_char = line[i + 1] if i + 1 < len(line) else ""
-            if char in ("'", '"', "#") or (char == "/" and next_char == "/"):
-                break
-            i += 1
-        code_span = line[code_start:i]
-        if code_span:
-            segments.extend(highlight_editor_code_span(code_span, theme))
+    for match in EDITOR_LINE_TOKEN_PATTERN.finditer(line):
+        kind = match.lastgroup
+        if kind == "code":
+            highlight_editor_code_span(segments, match.group(), colors)
+        elif kind == "string":
+            segments.append((match.group(), colors["syntax_string"]))
+        else:
+            segments.append((match.group(), colors["syntax_comment"]))
     return segments
 
 def get_editor_layout(help_height=0):
-    header_visible = theme_settings.get("show_header", True)
+    return build_editor_layout(
+        bool(theme_settings["show_header"]),
+        bool(theme_settings["show_keyboard"]),
+        SCREEN_WIDTH,
+        SCREEN_HEIGHT,
+        char_width,
+        char_height,
+        help_height,
+    )
+
+@functools.lru_cache(maxsize=16)
+def build_editor_layout(header_visible, keyboard_visible, screen_width, screen_height, char_width, char_height, help_height):
+    # Keyed on every input, so theme or font changes never need a cache_clear; result is read-only
     header_height = 25 if header_visible else 0
-    keyboard_visible = theme_settings.get("show_keyboard", True)
-    keyboard_y = SCREEN_HEIGHT - 190 if keyboard_visible else SCREEN_HEIGHT - 10
+    keyboard_y = screen_height - 190 if keyboard_visible else screen_height - 10
     status_height = 20
     padding = 5
     text_top = 5 + header_height + padding
     text_bottom = keyboard_y - status_height - padding - help_height
     text_left = 10
-    text_right = SCREEN_WIDTH - 10
+    text_right = screen_width - 10
     gutter_width = 52
     line_height = char_height + 4
     available_height = max(line_height, text_bottom - text_top)
@@ -2395,6 +3208,11 @@ def get_editor_layout(help_height=0):
     }
 
 def get_help_layout(items, max_width, col_width=None, char_width_override=None, line_height=None):
+    return build_help_layout(tuple(items), max_width, col_width, char_width_override, line_height)
+
+@functools.lru_cache(maxsize=64)
+def build_help_layout(items, max_width, col_width, char_width_override, line_height):
+    # Cached per item tuple and geometry; callers must treat the result as read-only
     if not items:
         return {"columns": 0, "rows": 0, "height": 0, "col_width": 0}
     if line_height is None:
@@ -2403,11 +3221,14 @@ def get_help_layout(items, max_width, col_width=None, char_width_override=None,
         col_width = 200
     columns = max(1, max_width // col_width)
     rows = (len(items) + columns - 1) // columns
+    max_chars = wrap_char_limit(col_width - 10, char_width_override)
     item_lines = []
     for combo, desc in items:
         combined = f"{combo} - {desc}"
-        lines = wrap_text(combined, col_width - 10, char_width=char_width_override)
-        item_lines.append(lines[:2])
+        if len(combined) <= max_chars:
+            item_lines.append([combined])
+        else:
+            item_lines.append([combined[:max_chars], combined[max_chars:max_chars * 2]])
     row_heights = []
     for row in range(rows):
         row_start = row * columns
@@ -2426,6 +3247,11 @@ def get_help_layout(items, max_width, col_width=None, char_width_override=None,
     }
 
 def get_command_layout(commands, max_width, col_width=None, char_width_override=None, line_height=None):
+    return build_command_layout(tuple(commands), max_width, col_width, char_width_override, line_height)
+
+@functools.lru_cache(maxsize=64)
+def build_command_layout(commands, max_width, col_width, char_width_override, line_height):
+    # Cached per item tuple and geometry; callers must treat the result as read-only
     if not commands:
         return {"columns": 0, "rows": 0, "height": 0, "col_width": 0}
     if line_height is None:
@@ -2434,10 +3260,13 @@ def get_command_layout(commands, max_width, col_width=None, char_width_override=
         col_width = max(1, max_width // 3)
     columns = max(1, max_width // col_width)
     rows = (len(commands) + columns - 1) // columns
+    max_chars = wrap_char_limit(col_width - 10, char_width_override)
     item_lines = []
     for command in commands:
-        lines = wrap_text(command, col_width - 10, char_width=char_width_override)
-        item_lines.append(lines[:2])
+        if len(command) <= max_chars:
+            item_lines.append([command])
+        else:
+            item_lines.append([command[:max_chars], command[max_chars:max_chars * 2]])
     row_heights = []
     for row in range(rows):
         row_start = row * columns
@@ -2455,11 +3284,14 @@ def get_command_layout(commands, max_width, col_width=None, char_width_override=
         "item_lines": item_lines,
     }
 
+@functools.lru_cache(maxsize=128)
+def get_combo_tokens(combo):
+    return tuple(token.strip() for token in combo.split("+"))
+
 def combo_has_active_button(combo, active_buttons):
     if not active_buttons:
         return False
-    tokens = [token.strip() for token in combo.split("+")]
-    return any(active_buttons.get(token, False) for token in tokens)
+    return any(active_buttons.get(token, False) for token in get_combo_tokens(combo))
 
 def render_help_items(items, top_y, left_x, max_width, text_color, col_width=None, active_text_color=None, active_buttons=None):
     if not items:
@@ -2474,13 +3306,13 @@ def render_help_items(items, top_y, left_x, max_width, text_color, col_width=Non
     columns = layout["columns"]
     col_width = layout["col_width"]
     line_height = layout["line_height"]
-    row_heights = layout.get("row_heights") or []
+    row_offsets = list(itertools.accumulate(layout.get("row_heights") or [], initial=0))
     item_lines = layout.get("item_lines") or []
     for idx, (combo, desc) in enumerate(items):
         col = idx % columns
         row = idx // columns
         x = left_x + col * col_width
-        y = top_y + sum(row_heights[:row])
+        y = top_y + row_offsets[row]
         lines = item_lines[idx] if idx < len(item_lines) else wrap_text(
             f"{combo} - {desc}",
             col_width - 10,
@@ -2491,6 +3323,7 @@ def render_help_items(items, top_y, left_x, max_width, text_color, col_width=Non
             item_color = active_text_color
         for line_idx, line in enumerate(lines):
             render_text_ui(line, x, y + line_idx * line_height, item_color)
+    return layout
 
 def render_command_items(commands, top_y, left_x, max_width, text_color, col_width=None):
     if not commands:
@@ -2505,13 +3338,13 @@ def render_command_items(commands, top_y, left_x, max_width, text_color, col_wid
     columns = layout["columns"]
     col_width = layout["col_width"]
     line_height = layout["line_height"]
-    row_heights = layout.get("row_heights") or []
+    row_offsets = list(itertools.accumulate(layout.get("row_heights") or [], initial=0))
     item_lines = layout.get("item_lines") or []
     for idx, command in enumerate(commands):
         col = idx % columns
         row = idx // columns
         x = left_x + col * col_width
-        y = top_y + sum(row_heights[:row])
+        y = top_y + row_offsets[row]
         lines = item_lines[idx] if idx < len(item_lines) else wrap_text(
             command,
             col_width - 10,
@@ -2519,6 +3352,7 @@ def render_command_items(commands, top_y, left_x, max_width, text_color, col_wid
         )[:2]
         for line_idx, line in enumerate(lines):
             render_text_ui(line, x, y + line_idx * line_height, text_color)
+    return layout
 
 def render_help_sections(sections, top_y, left_x, max_width, text_color, header_color, col_width=None, active_text_color=None, active_buttons=None):
     y = top_y
@@ -2529,7 +3363,7 @@ def render_help_sections(sections, top_y, left_x, max_width, text_color, header_
             continue
         render_text_ui(section.get("title", ""), left_x, y, header_color)
         y += line_height + 6
-        render_help_items(
+        layout = render_help_items(
             items,
             y,
             left_x,
@@ -2539,13 +3373,7 @@ def render_help_sections(sections, top_y, left_x, max_width, text_color, header_
             active_text_color=active_text_color,
             active_buttons=active_buttons,
         )
-        y += get_help_layout(
-            items,
-            max_width,
-            col_width=col_width,
-            char_width_override=ui_char_width,
-            line_height=ui_char_height + 2,
-        )["height"] + 10
+        y += layout["height"] + 10
 
 def render_help_columns(column_sections, top_y, left_x, max_width, text_color, header_color, column_gap=16, active_text_color=None, active_buttons=None):
     if not column_sections:
@@ -2566,163 +3394,188 @@ def render_help_columns(column_sections, top_y, left_x, max_width, text_color, h
             active_buttons=active_buttons,
         )
 
-def get_editor_help_items(nav_mode):
-    nav_target = "Keys" if nav_mode == "keyboard" else "File"
-    return [
+def build_editor_help_items(nav_target):
+    return (
         {
             "title": "Navigation",
-            "items": [
+            "items": (
                 ("Start", "Toggle Nav"),
                 ("D-Pad", f"Move {nav_target}"),
                 ("L2+D-Pad", "Page Up/Down"),
                 ("R2+D-Pad", "Home/End"),
-            ],
+            ),
         },
         {
             "title": "Selection & Clipboard",
-            "items": [
+            "items": (
                 ("Select+D-Pad", "Select Text"),
                 ("L1+X", "Copy"),
                 ("L1+Y", "Cut"),
                 ("R1+X", "Paste"),
                 ("R1+B", "Delete"),
                 ("R1+Y", "Select All"),
-            ],
+            ),
         },
         {
             "title": "Editing",
-            "items": [
+            "items": (
                 ("FN", "Indent"),
                 ("A", "Insert Key"),
                 ("B", "Backspace"),
                 ("L2+A", "Save"),
                 ("L2+B", "Exit"),
-            ],
+            ),
         },
-    ]
+    )
+
+EDITOR_HELP_ITEMS = {
+    "keyboard": build_editor_help_items("Keys"),
+    "file": build_editor_help_items("File"),
+}
+
+def get_editor_help_items(nav_mode):
+    return EDITOR_HELP_ITEMS["keyboard" if nav_mode == "keyboard" else "file"]
+
+SHELL_HELP_ITEMS = (
+    {
+        "title": "Navigation",
+        "items": (
+            ("D-Pad", "Select Key"),
+            ("Select + ↕", "History"),
+            ("Select + ↔", "Cursor"),
+            ("L2", "Scroll Up"),
+            ("R2", "Scroll Down"),
+            ("L2+R2", "Clear Screen"),
+        ),
+    },
+    {
+        "title": "Typing",
+        "items": (
+            ("A", "Press Key"),
+            ("B", "Backspace"),
+            ("X", "Space"),
+            ("Y", "Enter"),
+        ),
+    },
+    {
+        "title": "Modes",
+        "items": (
+            ("Start", "Menu Config"),
+            ("FN", "AutoComplete"),
+            ("L1", "⇧ Lock"),
+            ("R1", "Symbols"),
+        ),
+    },
+    {
+        "title": "System",
+        "items": (
+            ("Start+Select", "Exit"),
+        ),
+    },
+)
+
+SHELL_PTY_HELP_ITEMS = (
+    {
+        "title": "Navigation",
+        "items": (
+            ("D-Pad", "Navigate Keys"),
+            ("L2", "Arrow Up"),
+            ("R2", "Arrow Down"),
+        ),
+    },
+    {
+        "title": "Typing",
+        "items": (
+            ("A", "Press Key"),
+            ("B", "Backspace"),
+            ("X", "Space"),
+            ("Y", "Enter"),
+        ),
+    },
+    {
+        "title": "Shortcuts",
+        "items": (
+            ("L2+R2", "Ctrl+C"),
+            ("L2+L1", "Ctrl+X"),
+            ("L2+R1", "Ctrl+D"),
+            ("R2+L1", "Ctrl+Z"),
+            ("R2+R1", "Tab"),
+        ),
+    },
+    {
+        "title": "Modes",
+        "items": (
+            ("Start", "Theme"),
+            ("FN", "Tab"),
+            ("L1", "⇧ Lock"),
+            ("R1", "Symbols"),
+        ),
+    },
+    {
+        "title": "System",
+        "items": (
+            ("Start+Select", "Exit"),
+        ),
+    },
+)
 
 def get_shell_help_items(is_pty):
-    normal_items = [
-        {
-            "title": "Navigation",
-            "items": [
-                ("D-Pad", "Select Key"),
-                ("Select + ↕", "History"),
-                ("Select + ↔", "Cursor"),
-                ("L2", "Scroll Up"),
-                ("R2", "Scroll Down"),
-                ("L2+R2", "Clear Screen"),
-            ],
-        },
-        {
-            "title": "Typing",
-            "items": [
-                ("A", "Press Key"),
-                ("B", "Backspace"),
-                ("X", "Space"),
-                ("Y", "Enter"),
-            ],
-        },
-        {
-            "title": "Modes",
-            "items": [
-                ("Start", "Menu Config"),
-                ("FN", "AutoComplete"),
-                ("L1", "⇧ Lock"),
-                ("R1", "Symbols"),
-            ],
-        },
-        {
-            "title": "System",
-            "items": [
-                ("Start+Select", "Exit"),
-            ],
-        },
-    ]
-    if is_pty:
-        return [
-            {
-                "title": "Navigation",
-                "items": [
-                    ("D-Pad", "Navigate Keys"),
-                    ("L2", "Arrow Up"),
-                    ("R2", "Arrow Down"),
-                ],
-            },
-            {
-                "title": "Typing",
-                "items": [
-                    ("A", "Press Key"),
-                    ("B", "Backspace"),
-                    ("X", "Space"),
-                    ("Y", "Enter"),
-                ],
-            },
-            {
-                "title": "Shortcuts",
-                "items": [
-                    ("L2+R2", "Ctrl+C"),
-                    ("L2+L1", "Ctrl+X"),
-                    ("L2+R1", "Ctrl+D"),
-                    ("R2+L1", "Ctrl+Z"),
-                    ("R2+R1", "Tab"),
-                ],
-            },
-            {
-                "title": "Modes",
-                "items": [
-                    ("Start", "Theme"),
-                    ("FN", "Tab"),
-                    ("L1", "⇧ Lock"),
-                    ("R1", "Symbols"),
-                ],
-            },
-            {
-                "title": "System",
-                "items": [
-                    ("Start+Select", "Exit"),
-                ],
-            },
-        ]
-    return normal_items
+    return SHELL_PTY_HELP_ITEMS if is_pty else SHELL_HELP_ITEMS
+
+SHELL_COMMAND_HELP_ITEMS = (
+    "help - more info",
+    "clear",
+    "cd <dir>",
+    "launch <cmd>",
+    "pwd",
+    "quit",
+    "jobs",
+    "edit <file>",
+    "history",
+    "user [name|reset]",
+)
+SHELL_COMMAND_HELP_MAX_LEN = max(len(command) for command in SHELL_COMMAND_HELP_ITEMS)
 
 def get_shell_command_help_items(is_pty):
-    if is_pty:
-        return []
-    return [
-        "help - more info",
-        "clear",
-        "cd <dir>",
-        "launch <cmd>",
-        "pwd",
-        "quit",
-        "jobs",
-        "edit <file>",
-        "history",
-        "user [name|reset]",
-    ]
+    return () if is_pty else SHELL_COMMAND_HELP_ITEMS
 
 def get_current_editor_layout():
     return get_editor_layout(0)
 
+HELP_LEFT_TITLES = frozenset(("Navigation", "Typing"))
+help_split_cache = {}  # id(sections) -> (sections, left, middle)
+
+def split_help_sections(combo_items):
+    cached = help_split_cache.get(id(combo_items))
+    if cached is None or cached[0] is not combo_items:
+        left_sections = [section for section in combo_items if section.get("title") in HELP_LEFT_TITLES]
+        middle_sections = [section for section in combo_items if section.get("title") not in HELP_LEFT_TITLES]
+        cached = (combo_items, left_sections, middle_sections)
+        help_split_cache[id(combo_items)] = cached
+    return cached[1], cached[2]
+
 def render_help_screen(title, combo_items, theme, command_items=None, active_buttons=None):
     panel_margin = 30
     panel_x = panel_margin
     panel_y = panel_margin
     panel_w = SCREEN_WIDTH - panel_margin * 2
     panel_h = SCREEN_HEIGHT - panel_margin * 2
-    panel_alpha = min(theme_settings.get("panel_alpha", 210) + 30, 255)
+    panel_alpha = min(theme_settings["panel_alpha"] + 30, 255)
     fill_rect(renderer, make_color(theme["input_bg"], panel_alpha), (panel_x, panel_y, panel_w, panel_h))
-    sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, theme["keyboard_border"][0], theme["keyboard_border"][1], theme["keyboard_border"][2], 255)
-    border = sdl2.SDL_Rect(panel_x, panel_y, panel_w, panel_h)
-    sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, border)
+    border_r, border_g, border_b = theme["keyboard_border"][:3]
+    sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, border_r, border_g, border_b, 255)
+    shape_rect.x, shape_rect.y, shape_rect.w, shape_rect.h = panel_x, panel_y, panel_w, panel_h
+    sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, shape_rect)
     render_text_centered(title, panel_x + panel_w / 2, panel_y + 10, make_color(theme["header"]), ui_font_manager)
     content_top = panel_y + 40
     content_left = panel_x + 15
     content_width = panel_w - 30
     command_width = 0
     if command_items:
-        max_command_len = max(len(command) for command in command_items)
+        if command_items is SHELL_COMMAND_HELP_ITEMS:
+            max_command_len = SHELL_COMMAND_HELP_MAX_LEN
+        else:
+            max_command_len = max(len(command) for command in command_items)
         desired_width = max_command_len * ui_char_width + 24
         min_command_width = 170
         max_command_width = 260
@@ -2732,9 +3585,7 @@ def render_help_screen(title, combo_items, theme, command_items=None, active_but
             max(0, content_width - min_combo_width - 20),
         )
     combo_width = content_width - (command_width + 20 if command_items else 0)
-    left_titles = {"Navigation", "Typing"}
-    left_sections = [section for section in combo_items if section.get("title") in left_titles]
-    middle_sections = [section for section in combo_items if section.get("title") not in left_titles]
+    left_sections, middle_sections = split_help_sections(combo_items)
     if command_items:
         combo_columns = [left_sections, middle_sections]
     else:
@@ -2796,7 +3647,7 @@ BUTTON_MAP_LABELS = {
 }
 
 def is_button_active(button_id):
-    return button_id is not None and button_id < len(button_states) and button_states[button_id]
+    return button_id is not None and button_mask >> button_id & 1
 
 def render_button_map_screen(theme):
     panel_margin = 30
@@ -2804,11 +3655,12 @@ def render_button_map_screen(theme):
     panel_y = panel_margin
     panel_w = SCREEN_WIDTH - panel_margin * 2
     panel_h = SCREEN_HEIGHT - panel_margin * 2
-    panel_alpha = min(theme_settings.get("panel_alpha", 210) + 30, 255)
+    panel_alpha = min(theme_settings["panel_alpha"] + 30, 255)
     fill_rect(renderer, make_color(theme["input_bg"], panel_alpha), (panel_x, panel_y, panel_w, panel_h))
-    sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, theme["keyboard_border"][0], theme["keyboard_border"][1], theme["keyboard_border"][2], 255)
-    border = sdl2.SDL_Rect(panel_x, panel_y, panel_w, panel_h)
-    sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, border)
+    border_r, border_g, border_b = theme["keyboard_border"][:3]
+    sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, border_r, border_g, border_b, 255)
+    shape_rect.x, shape_rect.y, shape_rect.w, shape_rect.h = panel_x, panel_y, panel_w, panel_h
+    sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, shape_rect)
     render_text_centered("R36S Button Map", panel_x + panel_w / 2, panel_y + 10, make_color(theme["header"]), ui_font_manager)
     render_text_ui("Start+Select: Close", panel_x + 15, panel_y + panel_h - 25, make_color(theme["help_text"]))
 
@@ -2819,22 +3671,36 @@ def render_button_map_screen(theme):
     start_x = panel_x + 15
     start_y = panel_y + 45
     square_size = 12
-
+    square_color = make_color(theme["input_bg"])
+    active_color = make_color(theme["help_active"])
+    label_color = make_color(theme["output_text"])
+
+    # Squares share three colours, so each layer goes to SDL as one batched call
+    square_rects = (sdl2.SDL_Rect * max(1, len(entries)))()
+    active_rects = (sdl2.SDL_Rect * max(1, len(entries)))()
+    active_count = 0
     for idx, key in enumerate(entries):
         col = idx % columns
         row = idx // columns
         x = start_x + col * col_width
         y = start_y + row * row_height
+        square = square_rects[idx]
+        square.x, square.y, square.w, square.h = x, y + 2, square_size, square_size
+        if is_button_active(button_map.get(key)):
+            indicator = active_rects[active_count]
+            indicator.x, indicator.y, indicator.w, indicator.h = x + 2, y + 4, square_size - 4, square_size - 4
+            active_count += 1
         label = BUTTON_MAP_LABELS.get(key, key.replace("_", " ").title())
-        button_id = button_map.get(key)
-        active = is_button_active(button_id)
-        fill_rect(renderer, make_color(theme["input_bg"]), (x, y + 2, square_size, square_size))
-        if active:
-            fill_rect(renderer, make_color(theme["help_active"]), (x + 2, y + 4, square_size - 4, square_size - 4))
-        sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, theme["keyboard_border"][0], theme["keyboard_border"][1], theme["keyboard_border"][2], 255)
-        square_rect = sdl2.SDL_Rect(x, y + 2, square_size, square_size)
-        sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, square_rect)
-        render_text_ui(label, x + square_size + 10, y, make_color(theme["output_text"]))
+        render_text_ui(label, x + square_size + 10, y, label_color)
+    if entries:
+        sdl_renderer = renderer.sdlrenderer
+        sdl2.SDL_SetRenderDrawColor(sdl_renderer, square_color.r, square_color.g, square_color.b, square_color.a)
+        sdl2.SDL_RenderFillRects(sdl_renderer, square_rects, len(entries))
+        if active_count:
+            sdl2.SDL_SetRenderDrawColor(sdl_renderer, active_color.r, active_color.g, active_color.b, active_color.a)
+            sdl2.SDL_RenderFillRects(sdl_renderer, active_rects, active_count)
+        sdl2.SDL_SetRenderDrawColor(sdl_renderer, border_r, border_g, border_b, 255)
+        sdl2.SDL_RenderDrawRects(sdl_renderer, square_rects, len(entries))
 
 def exit_editor_session(shell):
     if not shell.editor:
@@ -2872,6 +3738,113 @@ LAYOUT_SYMBOLS = [
     ['Alt', '␣', 'ABC']
 ]
 
+def build_keyboard_cells(layout):
+    """Flatten a layout into (row, col, key, x, row offset, width, text x) per key"""
+    # Rows 1-4: 12 keys × 50px = 600px total width, centered horizontally
+    keyboard_start_x = (SCREEN_WIDTH - 600) // 2
+    cells = []
+    for row_idx, row in enumerate(layout):
+        for col_idx, key in enumerate(row):
+            if row_idx == 4:  # Bottom row: Alt, Space, #+=
+                if col_idx == 0:  # Alt
+                    key_x = keyboard_start_x
+                    width = 48
+                elif col_idx == 1:  # Space
+                    key_x = keyboard_start_x + 138
+                    width = 320  # Large space bar
+                else:  # #+=/ABC toggle (far right)
+                    key_x = SCREEN_WIDTH - 70
+                    width = 48
+            else:
+                # Rows 1-4: Perfect 12-column grid
+                key_x = keyboard_start_x + col_idx * 50
+                width = 48
+            # Font size 18 means approximately 9px per character
+            text_x = int(key_x + width // 2 - len(key) * 4.5)
+            cells.append((row_idx, col_idx, key, key_x, row_idx * 40, width, text_x))
+    return tuple(cells)
+
+KEYBOARD_CELLS = {
+    "lower": build_keyboard_cells(LAYOUT_LOWER),
+    "upper": build_keyboard_cells(LAYOUT_UPPER),
+    "symbols": build_keyboard_cells(LAYOUT_SYMBOLS),
+}
+KEYBOARD_KEY_HEIGHT = 36
+# Per layout: (row, col) -> cell index, and key label -> cell index (for the modifier keys)
+KEYBOARD_CELL_INDEX = {
+    mode: {(cell[0], cell[1]): index for index, cell in enumerate(cells)}
+    for mode, cells in KEYBOARD_CELLS.items()
+}
+KEYBOARD_KEY_INDEX = {
+    mode: {cell[2]: index for index, cell in enumerate(cells)}
+    for mode, cells in KEYBOARD_CELLS.items()
+}
+
+@functools.lru_cache(maxsize=16)
+def get_keyboard_rects(mode, keyboard_y):
+    """(SDL_Rect array, count) of every key outline in a layout, for one SDL_RenderDrawRects call"""
+    cells = KEYBOARD_CELLS[mode]
+    rects = (sdl2.SDL_Rect * len(cells))(*(
+        sdl2.SDL_Rect(key_x, keyboard_y + row_offset, width, KEYBOARD_KEY_HEIGHT)
+        for _, _, _, key_x, row_offset, width, _ in cells
+    ))
+    return rects, len(cells)
+
+@functools.lru_cache(maxsize=16)
+def get_keyboard_fill_xy(mode, keyboard_y):
+    """(float xy array, key count) with the four corners of every key, in glyph-quad vertex order"""
+    xy = []
+    for _, _, _, key_x, row_offset, width, _ in KEYBOARD_CELLS[mode]:
+        top = keyboard_y + row_offset
+        right = key_x + width
+        bottom = top + KEYBOARD_KEY_HEIGHT
+        xy.extend((key_x, top, right, top, right, bottom, key_x, bottom))
+    return (ctypes.c_float * len(xy))(*xy), len(KEYBOARD_CELLS[mode])
+
+keyboard_fill_cache = {"key": None, "rgba": None}
+
+def build_keyboard_fill_rgba(key_count, key_color, highlights):
+    """Per-vertex colors for the key fills: key_color everywhere, then each (index, color) highlight"""
+    rgba = bytearray((key_color.r, key_color.g, key_color.b, key_color.a) * (4 * key_count))
+    for index, color in highlights:
+        rgba[index * 16:index * 16 + 16] = bytes((color.r, color.g, color.b, color.a) * 4)
+    return (ctypes.c_uint8 * len(rgba)).from_buffer(rgba)
+
+def draw_keyboard_fills(mode, keyboard_y, key_color, highlights):
+    """Fill every key, highlights included, with one SDL_RenderGeometryRaw call; False if unsupported"""
+    global geometry_supported
+    if not geometry_supported:
+        return False
+    xy_array, key_count = get_keyboard_fill_xy(mode, keyboard_y)
+    fill_key = (mode, keyboard_y, key_color, highlights)
+    if fill_key != keyboard_fill_cache["key"]:
+        keyboard_fill_cache["rgba"] = build_keyboard_fill_rgba(key_count, key_color, highlights)
+        keyboard_fill_cache["key"] = fill_key
+    try:
+        result = sdl2.SDL_RenderGeometryRaw(
+            renderer.sdlrenderer, None,
+            xy_array, 8,
+            ctypes.cast(keyboard_fill_cache["rgba"], ctypes.POINTER(sdl2.SDL_Color)), 4,
+            None, 0,
+            key_count * 4, get_glyph_indices(key_count), key_count * 6, 4
+        )
+    except Exception:
+        result = -1
+    if result != 0:
+        geometry_supported = False
+        glyph_atlases.clear()
+        return False
+    return True
+
+keyboard_label_cache = {"key": None, "batch": None}
+
+def build_keyboard_label_batch(mode, keyboard_y, text_color):
+    """Queue every key label of a layout into one reusable glyph batch"""
+    batch = new_glyph_batch(font_manager_large)
+    for _, _, key, _, row_offset, _, text_x in KEYBOARD_CELLS[mode]:
+        queue_glyphs(batch, key, text_x, keyboard_y + row_offset + 8, text_color)
+    return batch
+
 # State variables
 input_text = ""
 input_cursor_pos = 0  # Cursor position in input_text
@@ -2879,6 +3852,7 @@ cursor_x = 0
 cursor_y = 0
 layout_mode = "lower"
 current_layout = LAYOUT_LOWER
+current_row_last = tuple(len(row) - 1 for row in current_layout)  # Last column index per row, refreshed by switch_layout
 editor_nav_mode = "file"
 
 # Theme menu state
@@ -2887,14 +3861,17 @@ theme_menu_index = 0
 background_texture = None
 background_texture_path = ""
 background_texture_alpha = None
-show_shell_help_overlay = theme_settings.get("show_shell_help_screen", True)
+background_dirty = False  # Background settings changed; reload once before the next frame
+show_shell_help_overlay = theme_settings["show_shell_help_screen"]
 show_editor_help_overlay = False
 show_button_map_overlay = False
 
-# Modifier key states (for JuiceSSH-style locking)
-modifier_ctrl = False
-modifier_alt = False
-modifier_shift_locked = False
+# Modifier key states (for JuiceSSH-style locking), one bit per modifier
+MOD_CTRL = 1
+MOD_ALT = 2
+MOD_SHIFT_LOCKED = 4
+MOD_CTRL_ALT = MOD_CTRL | MOD_ALT
+modifier_bits = 0
 
 # Cursor blink
 last_blink_time = 0
@@ -2902,9 +3879,18 @@ cursor_blink = True
 BLINK_RATE = 500
 
 # Rendering optimization
-needs_redraw = True  # Flag to track if screen needs redraw
+REDRAW_FRAME = 1  # Re-render the whole scene
+REDRAW_CURSOR = 2  # Only the cursor blinked; reuse frame_texture
+redraw_flags = REDRAW_FRAME  # Bitmask of what the next render must refresh
+frame_texture = None  # Last full scene, composited under the cursor on blink-only frames
+overlay_texture = None  # Open overlay panels, composited over the cursor so blinks can reuse them too
+overlay_texture_supported = True  # Cleared when the renderer rejects the premultiplied blend mode
+frame_overlay = None  # overlay_texture if the last full frame used it, else None
+window_hidden = False  # Minimized or hidden; rendering waits until the window is shown again
+cursor_overlay = None  # Cursor recorded by the last full frame, drawn on top of it
 last_render_time = 0
 MIN_FRAME_TIME = 33  # ~30 FPS max (instead of 60)
+OUTPUT_COALESCE_SECONDS = 0.016  # Let output bursts settle before redrawing
 
 # Button repeat timing
 REPEAT_DELAY = 400
@@ -2912,17 +3898,15 @@ REPEAT_RATE_START = 180
 REPEAT_RATE_MIN = 50
 REPEAT_ACCEL_DURATION = 1200
 button_repeat_state = {}
+next_repeat_time = 0  # Earliest "next_time" in button_repeat_state; the repeat pass is skipped until then
 
 audio_device = None
 click_sound_buffer = None
 click_sound_length = 0
 
-# Exit button combo
-exit_mask = 0
-
 def switch_layout(mode):
     """Switch keyboard layout"""
-    global layout_mode, current_layout, cursor_x, cursor_y
+    global layout_mode, current_layout, current_row_last, cursor_x, cursor_y
     layout_mode = mode
     
     if mode == "lower":
@@ -2931,6 +3915,7 @@ def switch_layout(mode):
         current_layout = LAYOUT_UPPER
     elif mode == "symbols":
         current_layout = LAYOUT_SYMBOLS
+    current_row_last = tuple(len(row) - 1 for row in current_layout)
     
     clamp_layout_cursor()
 
@@ -2985,7 +3970,7 @@ def maybe_play_keyboard_click(prev_x, prev_y):
 
 def init_click_sound():
     global audio_device, click_sound_buffer, click_sound_length
-    if not theme_settings.get("keyboard_click_sound", True):
+    if not theme_settings["keyboard_click_sound"]:
         return
     if audio_device is not None:
         return
@@ -3005,11 +3990,13 @@ def init_click_sound():
     samples = max(1, int(sample_rate * duration_ms / 1000))
     volume = 0.25
     frequency = 1800
-    click_sound_buffer = (ctypes.c_int16 * samples)()
-    for i in range(samples):
-        envelope = 1.0 - (i / samples)
-        value = math.sin(2 * math.pi * frequency * (i / sample_rate))
-        click_sound_buffer[i] = int(32767 * volume * envelope * value)
+    amplitude = 32767 * volume
+    phase_step = 2 * math.pi * frequency / sample_rate
+    sin = math.sin
+    click_sound_buffer = (ctypes.c_int16 * samples)(*[
+        int(amplitude * (1.0 - i / samples) * sin(phase_step * i))
+        for i in range(samples)
+    ])
     click_sound_length = ctypes.sizeof(click_sound_buffer)
 
 def shutdown_audio():
@@ -3022,40 +4009,111 @@ def shutdown_audio():
     sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_AUDIO)
 
 def play_click_sound():
-    if not theme_settings.get("keyboard_click_sound", True):
+    if not theme_settings["keyboard_click_sound"]:
         return
     if audio_device is None or click_sound_buffer is None:
         return
     sdl2.SDL_ClearQueuedAudio(audio_device)
     sdl2.SDL_QueueAudio(audio_device, click_sound_buffer, click_sound_length)
 
+def get_dir_mtime(path):
+    """Directory mtime for cache keys (None when it is missing)"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+background_files_cache = {"key": None, "files": []}
+
 def list_background_files():
     backgrounds_dir = os.path.join(APP_ROOT, "Backgrounds")
-    if not os.path.isdir(backgrounds_dir):
-        return []
-    supported_exts = (".png", ".jpg", ".jpeg", ".bmp")
+    # Adding or removing a file bumps the directory mtime, so one stat covers the listing
+    cache_key = (backgrounds_dir, get_dir_mtime(backgrounds_dir))
+    if cache_key == background_files_cache["key"]:
+        return background_files_cache["files"]
     files = []
-    for name in sorted(os.listdir(backgrounds_dir)):
-        if name.lower().endswith(supported_exts):
-            files.append(os.path.join(backgrounds_dir, name))
+    if os.path.isdir(backgrounds_dir):
+        supported_exts = (".png", ".jpg", ".jpeg", ".bmp")
+        for name in sorted(os.listdir(backgrounds_dir)):
+            if name.lower().endswith(supported_exts):
+                files.append(os.path.join(backgrounds_dir, name))
+    background_files_cache["key"] = cache_key
+    background_files_cache["files"] = files
     return files
 
 def get_background_options():
-    paths = theme_settings.get("background_image_paths", [])
+    paths = theme_settings["background_image_paths"]
     options = ["None"]
     options.extend([path for path in list_background_files() if path])
     options.extend([path for path in paths if path and path not in options])
-    return options
+    return tuple(options)
+
+CURSOR_MARK = "\x00"  # Stands in for the cursor glyph while an input line is truncated
+
+def get_frame_texture():
+    """Render-target texture holding the last full frame (None if targets are unsupported)"""
+    global frame_texture
+    if frame_texture is None and sdl2.SDL_RenderTargetSupported(renderer.sdlrenderer):
+        texture = sdl2.SDL_CreateTexture(
+            renderer.sdlrenderer,
+            sdl2.SDL_PIXELFORMAT_ARGB8888,
+            sdl2.SDL_TEXTUREACCESS_TARGET,
+            SCREEN_WIDTH,
+            SCREEN_HEIGHT,
+        )
+        if texture:
+            sdl2.SDL_SetTextureBlendMode(texture, sdl2.SDL_BLENDMODE_NONE)
+            frame_texture = texture
+    return frame_texture
+
+def get_overlay_texture():
+    """Transparent render target for overlay panels (None if it cannot be composited correctly)"""
+    global overlay_texture, overlay_texture_supported
+    if overlay_texture is None and overlay_texture_supported:
+        texture = sdl2.SDL_CreateTexture(
+            renderer.sdlrenderer,
+            sdl2.SDL_PIXELFORMAT_ARGB8888,
+            sdl2.SDL_TEXTUREACCESS_TARGET,
+            SCREEN_WIDTH,
+            SCREEN_HEIGHT,
+        )
+        # Panels blended onto a transparent target end up premultiplied, so composite them as such
+        premultiplied = sdl2.SDL_ComposeCustomBlendMode(
+            sdl2.SDL_BLENDFACTOR_ONE, sdl2.SDL_BLENDFACTOR_ONE_MINUS_SRC_ALPHA, sdl2.SDL_BLENDOPERATION_ADD,
+            sdl2.SDL_BLENDFACTOR_ONE, sdl2.SDL_BLENDFACTOR_ONE_MINUS_SRC_ALPHA, sdl2.SDL_BLENDOPERATION_ADD,
+        )
+        if texture and sdl2.SDL_SetTextureBlendMode(texture, premultiplied) == 0:
+            overlay_texture = texture
+        else:
+            if texture:
+                sdl2.SDL_DestroyTexture(texture)
+            overlay_texture_supported = False
+    return overlay_texture
+
+def draw_cursor_overlay(overlay):
+    """Draw the blinking cursor recorded by a full frame"""
+    if overlay[0] == "bar":
+        _, x, y, color = overlay
+        if cursor_blink:
+            fill_rect(renderer, color, (x, y, 2, char_height))
+        return
+    _, x, y, color, before, after = overlay
+    render_text(before + ("_" if cursor_blink else "|") + after, x, y, color)
 
 def update_background_texture():
     global background_texture, background_texture_path, background_texture_alpha
-    enabled = theme_settings.get("background_enabled", True)
-    path = theme_settings.get("background_image", "") if enabled else ""
-    alpha = theme_settings.get("background_alpha", 255) if enabled else 255
+    enabled = theme_settings["background_enabled"]
+    path = theme_settings["background_image"] if enabled else ""
+    alpha = theme_settings["background_alpha"] if enabled else 255
     alpha = max(0, min(255, alpha))
     if path == "None":
         path = ""
-    if path == background_texture_path and alpha == background_texture_alpha:
+    if path == background_texture_path:
+        if alpha != background_texture_alpha:
+            # Same image, new opacity: no need to decode and upload it again
+            background_texture_alpha = alpha
+            if background_texture:
+                sdl2.SDL_SetTextureAlphaMod(background_texture, alpha)
         return
     if background_texture:
         sdl2.SDL_DestroyTexture(background_texture)
@@ -3066,28 +4124,47 @@ def update_background_texture():
     if background_texture:
         sdl2.SDL_SetTextureAlphaMod(background_texture, alpha)
 
+FONT_CANDIDATES = (
+    ("DejaVu Mono", "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"),
+    ("DejaVu Sans", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"),
+    ("DejaVu Serif", "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"),
+    ("Liberation Mono", "/usr/share/fonts/truetype/liberation/LiberationMono-Regular.ttf"),
+    ("Liberation Sans", "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"),
+    ("Liberation Serif", "/usr/share/fonts/truetype/liberation/LiberationSerif-Regular.ttf")
+)
+FONT_CANDIDATE_DIRS = tuple(sorted({os.path.dirname(path) for _, path in FONT_CANDIDATES}))
+font_options_cache = {"key": None, "options": [], "labels": {}}
+
 def get_font_options():
-    candidates = [
-        ("DejaVu Mono", "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"),
-        ("DejaVu Sans", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"),
-        ("DejaVu Serif", "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"),
-        ("Liberation Mono", "/usr/share/fonts/truetype/liberation/LiberationMono-Regular.ttf"),
-        ("Liberation Sans", "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"),
-        ("Liberation Serif", "/usr/share/fonts/truetype/liberation/LiberationSerif-Regular.ttf")
-    ]
-    available = [(label, path) for label, path in candidates if os.path.exists(path)]
+    # The theme menu asks for this every frame; re-probe only when a font directory changes
+    cache_key = tuple(get_dir_mtime(path) for path in FONT_CANDIDATE_DIRS)
+    if cache_key == font_options_cache["key"]:
+        return font_options_cache["options"]
+    available = [(label, path) for label, path in FONT_CANDIDATES if os.path.exists(path)]
     if not available:
         available = [("Default", "")]
+    font_options_cache["key"] = cache_key
+    font_options_cache["options"] = available
+    font_options_cache["labels"] = {path: label for label, path in available}
     return available
 
+def get_font_label(path):
+    get_font_options()  # Refreshes the path -> label map along with the options
+    return font_options_cache["labels"].get(path, "Default")
+
+@functools.lru_cache(maxsize=16)
+def get_option_positions(options):
+    """Map each value in an options tuple to its first index"""
+    positions = {}
+    for idx, value in enumerate(options):
+        positions.setdefault(value, idx)
+    return positions
+
 def cycle_option(current, options, direction):
     if not options:
         return current
-    if current not in options:
-        current = options[0]
-    idx = options.index(current)
-    idx = (idx + direction) % len(options)
-    return options[idx]
+    idx = get_option_positions(options).get(current, 0)
+    return options[(idx + direction) % len(options)]
 
 THEME_MENU_ITEMS = [
     {"id": "theme", "label": "Theme", "type": "select"},
@@ -3106,85 +4183,536 @@ THEME_MENU_ITEMS = [
     {"id": "background_image", "label": "Background Image", "type": "path"}
 ]
 
-def update_theme_setting(menu_id, direction=0, activate=False):
+# Parallel per-field tuples so key handling and the menu render index instead of probing dicts
+THEME_MENU_IDS = tuple(item["id"] for item in THEME_MENU_ITEMS)
+THEME_MENU_LABELS = tuple(item["label"] for item in THEME_MENU_ITEMS)
+THEME_MENU_TYPES = tuple(item["type"] for item in THEME_MENU_ITEMS)
+THEME_MENU_COUNT = len(THEME_MENU_ITEMS)
+THEME_MENU_LABEL_TEXTS = tuple(f"{label}:" for label in THEME_MENU_LABELS)
+
+def menu_value_theme(item_id):
+    return theme_settings["selected_theme"]
+
+def menu_value_font(item_id):
+    return get_font_label(theme_settings["font_path"])
+
+def menu_value_font_size(item_id):
+    return f"{theme_settings['font_size']}"
+
+def menu_value_toggle(item_id):
+    return "On" if theme_settings[item_id] else "Off"
+
+def menu_value_gauge(item_id):
+    return ""  # Drawn as a bar instead
+
+def menu_value_action(item_id):
+    return "Open"
+
+def menu_value_path(item_id):
+    current_path = theme_settings["background_image"]
+    return os.path.basename(current_path) if current_path else "None"
+
+THEME_MENU_VALUE_BY_ID = {
+    "theme": menu_value_theme,
+    "font": menu_value_font,
+    "font_size": menu_value_font_size,
+}
+THEME_MENU_VALUE_BY_TYPE = {
+    "toggle": menu_value_toggle,
+    "gauge": menu_value_gauge,
+    "action": menu_value_action,
+    "path": menu_value_path,
+}
+# Value text getter per menu row, resolved once instead of re-dispatching on id and type every frame
+THEME_MENU_VALUE_GETTERS = tuple(
+    THEME_MENU_VALUE_BY_ID.get(item_id) or THEME_MENU_VALUE_BY_TYPE[item_type]
+    for item_id, item_type in zip(THEME_MENU_IDS, THEME_MENU_TYPES)
+)
+FONT_SIZE_OPTIONS = tuple(range(10, 22, 2))
+THEME_ALPHA_STEP = 15
+
+def toggle_theme_setting(key):
+    new_value = not theme_settings.get(key, True)
+    apply_theme_setting(key, new_value)
+    return new_value
+
+def step_theme_alpha(key, default, minimum, direction):
+    current = theme_settings.get(key, default)
+    new_value = max(minimum, min(255, current + (THEME_ALPHA_STEP * (direction or 1))))
+    apply_theme_setting(key, new_value)
+
+def theme_menu_theme(direction, activate):
+    new_value = cycle_option(theme_settings["selected_theme"], THEME_PRESET_NAMES, direction or 1)
+    apply_theme_setting("selected_theme", new_value)
+
+def theme_menu_font(direction, activate):
+    paths = tuple(path for _, path in get_font_options())
+    current = theme_settings["font_path"]
+    if current not in paths:
+        current = paths[0] if paths else ""
+    new_value = cycle_option(current, paths, direction or 1)
+    apply_theme_setting("font_path", new_value)
+    update_font_managers(new_value, theme_settings["font_size"])
+
+def theme_menu_font_size(direction, activate):
+    current = theme_settings["font_size"]
+    if current not in FONT_SIZE_OPTIONS:
+        current = FONT_SIZE_OPTIONS[0]
+    new_value = cycle_option(current, FONT_SIZE_OPTIONS, direction or 1)
+    apply_theme_setting("font_size", new_value)
+    update_font_managers(theme_settings["font_path"], new_value)
+
+def theme_menu_header(direction, activate):
+    toggle_theme_setting("show_header")
+
+def theme_menu_shell_help(direction, activate):
+    global show_shell_help_overlay
+    if not toggle_theme_setting("show_shell_help_screen"):
+        show_shell_help_overlay = False
+
+def theme_menu_editor_help(direction, activate):
+    global show_editor_help_overlay
+    if not toggle_theme_setting("show_editor_help_screen"):
+        show_editor_help_overlay = False
+
+def theme_menu_show_help(direction, activate):
     global show_shell_help_overlay, show_editor_help_overlay, show_button_map_overlay, theme_menu_open
-    if menu_id == "theme":
-        options = list(THEME_PRESETS.keys())
-        new_value = cycle_option(theme_settings.get("selected_theme", "Classic"), options, direction or 1)
-        apply_theme_setting("selected_theme", new_value)
-    elif menu_id == "font":
-        options = get_font_options()
-        paths = [path for _, path in options]
-        current = theme_settings.get("font_path", "")
-        if current not in paths:
-            current = paths[0] if paths else ""
-        new_value = cycle_option(current, paths, direction or 1)
-        apply_theme_setting("font_path", new_value)
-        update_font_managers(new_value, theme_settings.get("font_size", 14))
-    elif menu_id == "font_size":
-        options = list(range(10, 22, 2))
-        current = theme_settings.get("font_size", 14)
-        if current not in options:
-            current = options[0]
-        new_value = cycle_option(current, options, direction or 1)
-        apply_theme_setting("font_size", new_value)
-        update_font_managers(theme_settings.get("font_path", ""), new_value)
-    elif menu_id == "show_header":
-        apply_theme_setting("show_header", not theme_settings.get("show_header", True))
-    elif menu_id == "show_shell_help_screen":
-        new_value = not theme_settings.get("show_shell_help_screen", True)
-        apply_theme_setting("show_shell_help_screen", new_value)
-        if not new_value:
-            show_shell_help_overlay = False
-    elif menu_id == "show_editor_help_screen":
-        new_value = not theme_settings.get("show_editor_help_screen", True)
-        apply_theme_setting("show_editor_help_screen", new_value)
-        if not new_value:
-            show_editor_help_overlay = False
-    elif menu_id == "show_help_screen":
-        if activate:
-            if shell.in_editor_mode:
-                show_editor_help_overlay = True
-            else:
-                show_shell_help_overlay = True
-            show_button_map_overlay = False
-            theme_menu_open = False
-    elif menu_id == "button_map_screen":
-        if activate:
-            show_button_map_overlay = True
-            show_shell_help_overlay = False
-            show_editor_help_overlay = False
-            theme_menu_open = False
-    elif menu_id == "show_keyboard":
-        apply_theme_setting("show_keyboard", not theme_settings.get("show_keyboard", True))
-    elif menu_id == "keyboard_click_sound":
-        enabled = not theme_settings.get("keyboard_click_sound", True)
-        apply_theme_setting("keyboard_click_sound", enabled)
-        if enabled:
-            init_click_sound()
-        else:
-            shutdown_audio()
-    elif menu_id == "panel_alpha":
-        current = theme_settings.get("panel_alpha", 210)
-        step = 15
-        new_value = max(60, min(255, current + (step * (direction or 1))))
-        apply_theme_setting("panel_alpha", new_value)
-    elif menu_id == "background_enabled":
-        apply_theme_setting("background_enabled", not theme_settings.get("background_enabled", True))
-        update_background_texture()
-    elif menu_id == "background_alpha":
-        current = theme_settings.get("background_alpha", 255)
-        step = 15
-        new_value = max(0, min(255, current + (step * (direction or 1))))
-        apply_theme_setting("background_alpha", new_value)
-        update_background_texture()
-    elif menu_id == "background_image":
-        options = get_background_options()
-        current = theme_settings.get("background_image", "")
-        current = current or "None"
-        new_value = cycle_option(current, options, direction or 1)
-        apply_theme_setting("background_image", "" if new_value == "None" else new_value)
-        update_background_texture()
+    if not activate:
+        return
+    if shell.in_editor_mode:
+        show_editor_help_overlay = True
+    else:
+        show_shell_help_overlay = True
+    show_button_map_overlay = False
+    theme_menu_open = False
+
+def theme_menu_button_map(direction, activate):
+    global show_shell_help_overlay, show_editor_help_overlay, show_button_map_overlay, theme_menu_open
+    if not activate:
+        return
+    show_button_map_overlay = True
+    show_shell_help_overlay = False
+    show_editor_help_overlay = False
+    theme_menu_open = False
+
+def theme_menu_keyboard(direction, activate):
+    toggle_theme_setting("show_keyboard")
+
+def theme_menu_click_sound(direction, activate):
+    if toggle_theme_setting("keyboard_click_sound"):
+        init_click_sound()
+    else:
+        shutdown_audio()
+
+def theme_menu_panel_alpha(direction, activate):
+    step_theme_alpha("panel_alpha", 210, 60, direction)
+
+def theme_menu_background(direction, activate):
+    global background_dirty
+    toggle_theme_setting("background_enabled")
+    background_dirty = True
+
+def theme_menu_background_alpha(direction, activate):
+    global background_dirty
+    step_theme_alpha("background_alpha", 255, 0, direction)
+    background_dirty = True
+
+def theme_menu_background_image(direction, activate):
+    global background_dirty
+    current = theme_settings["background_image"] or "None"
+    new_value = cycle_option(current, get_background_options(), direction or 1)
+    apply_theme_setting("background_image", "" if new_value == "None" else new_value)
+    background_dirty = True
+
+THEME_MENU_HANDLERS = {
+    "theme": theme_menu_theme,
+    "font": theme_menu_font,
+    "font_size": theme_menu_font_size,
+    "show_header": theme_menu_header,
+    "show_shell_help_screen": theme_menu_shell_help,
+    "show_editor_help_screen": theme_menu_editor_help,
+    "show_help_screen": theme_menu_show_help,
+    "button_map_screen": theme_menu_button_map,
+    "show_keyboard": theme_menu_keyboard,
+    "keyboard_click_sound": theme_menu_click_sound,
+    "panel_alpha": theme_menu_panel_alpha,
+    "background_enabled": theme_menu_background,
+    "background_alpha": theme_menu_background_alpha,
+    "background_image": theme_menu_background_image,
+}
+
+def update_theme_setting(menu_id, direction=0, activate=False):
+    handler = THEME_MENU_HANDLERS.get(menu_id)
+    if handler:
+        handler(direction, activate)
+
+def editor_ctrl_save(editor):
+    editor.save_file()
+    shell.add_output(f"[System] Saved: {editor.file_path}")
+
+def editor_ctrl_exit(editor):
+    exit_editor_session(shell)
+
+def editor_ctrl_select_all(editor):
+    editor.select_all()
+
+def editor_ctrl_copy(editor):
+    if editor.copy_selection():
+        shell.add_output("[System] Copied selection")
+
+def editor_ctrl_cut(editor):
+    if editor.cut_selection():
+        shell.add_output("[System] Cut selection")
+
+def editor_ctrl_paste(editor):
+    if editor.paste_clipboard():
+        shell.add_output("[System] Pasted clipboard")
+
+EDITOR_CTRL_KEY_HANDLERS = {
+    sdl2.SDLK_s: editor_ctrl_save,
+    sdl2.SDLK_q: editor_ctrl_exit,
+    sdl2.SDLK_ESCAPE: editor_ctrl_exit,
+    sdl2.SDLK_a: editor_ctrl_select_all,
+    sdl2.SDLK_c: editor_ctrl_copy,
+    sdl2.SDLK_x: editor_ctrl_cut,
+    sdl2.SDLK_v: editor_ctrl_paste,
+}
+
+def editor_key_exit(editor, selecting):
+    exit_editor_session(shell)
+
+def editor_key_newline(editor, selecting):
+    editor.insert_newline()
+
+def editor_key_backspace(editor, selecting):
+    editor.backspace()
+
+def editor_key_delete(editor, selecting):
+    editor.delete_forward()
+
+def editor_key_up(editor, selecting):
+    editor.move_cursor(delta_line=-1, selecting=selecting)
+
+def editor_key_down(editor, selecting):
+    editor.move_cursor(delta_line=1, selecting=selecting)
+
+def editor_key_left(editor, selecting):
+    editor.move_cursor(delta_col=-1, selecting=selecting)
+
+def editor_key_right(editor, selecting):
+    editor.move_cursor(delta_col=1, selecting=selecting)
+
+def editor_key_home(editor, selecting):
+    editor.move_home(selecting=selecting)
+
+def editor_key_end(editor, selecting):
+    editor.move_end(selecting=selecting)
+
+def editor_key_page_up(editor, selecting):
+    editor.move_page(-1, get_current_editor_layout()["max_lines"], selecting=selecting)
+
+def editor_key_page_down(editor, selecting):
+    editor.move_page(1, get_current_editor_layout()["max_lines"], selecting=selecting)
+
+def editor_key_tab(editor, selecting):
+    editor.insert_text("    ")
+
+EDITOR_KEY_HANDLERS = {
+    sdl2.SDLK_ESCAPE: editor_key_exit,
+    sdl2.SDLK_RETURN: editor_key_newline,
+    sdl2.SDLK_KP_ENTER: editor_key_newline,
+    sdl2.SDLK_BACKSPACE: editor_key_backspace,
+    sdl2.SDLK_DELETE: editor_key_delete,
+    sdl2.SDLK_UP: editor_key_up,
+    sdl2.SDLK_DOWN: editor_key_down,
+    sdl2.SDLK_LEFT: editor_key_left,
+    sdl2.SDLK_RIGHT: editor_key_right,
+    sdl2.SDLK_HOME: editor_key_home,
+    sdl2.SDLK_END: editor_key_end,
+    sdl2.SDLK_PAGEUP: editor_key_page_up,
+    sdl2.SDLK_PAGEDOWN: editor_key_page_down,
+    sdl2.SDLK_TAB: editor_key_tab,
+}
+
+# Keyboard keys forwarded to the PTY as send_key_to_pty codes
+PTY_SPECIAL_KEYS = {
+    sdl2.SDLK_ESCAPE: "ESC",
+    sdl2.SDLK_RETURN: "ENTER",
+    sdl2.SDLK_KP_ENTER: "ENTER",
+    sdl2.SDLK_BACKSPACE: "BACKSPACE",
+    sdl2.SDLK_UP: "UP",
+    sdl2.SDLK_DOWN: "DOWN",
+    sdl2.SDLK_LEFT: "LEFT",
+    sdl2.SDLK_RIGHT: "RIGHT",
+    sdl2.SDLK_TAB: "TAB",
+}
+PTY_CTRL_KEYS = {
+    sdl2.SDLK_c: "CTRL_C",
+    sdl2.SDLK_x: "CTRL_X",
+    sdl2.SDLK_d: "CTRL_D",
+}
+
+def insert_input_text(text):
+    """Insert text at the input cursor, keeping only what still fits in MAX_INPUT_LENGTH"""
+    global input_text, input_cursor_pos
+    room = MAX_INPUT_LENGTH - len(input_text)
+    if room <= 0:
+        return
+    if len(text) > room:
+        text = text[:room]
+    if input_cursor_pos >= len(input_text):
+        input_text += text  # Typing at the end of the line needs no slicing
+    else:
+        input_text = input_text[:input_cursor_pos] + text + input_text[input_cursor_pos:]
+    input_cursor_pos += len(text)
+
+def delete_input_char():
+    """Delete the character before the input cursor"""
+    global input_text, input_cursor_pos
+    if input_cursor_pos <= 0:
+        return
+    if input_cursor_pos >= len(input_text):
+        input_text = input_text[:-1]
+    else:
+        input_text = input_text[:input_cursor_pos-1] + input_text[input_cursor_pos:]
+    input_cursor_pos -= 1
+
+def shell_ctrl_interrupt():
+    global input_text, input_cursor_pos
+    shell.interrupt_foreground()
+    input_text = ""
+    input_cursor_pos = 0
+
+def shell_ctrl_clear():
+    shell.clear_output()
+
+SHELL_CTRL_KEY_HANDLERS = {
+    sdl2.SDLK_c: shell_ctrl_interrupt,
+    sdl2.SDLK_l: shell_ctrl_clear,
+}
+
+def shell_key_quit():
+    global running
+    running = False
+
+def shell_key_submit():
+    global input_text, input_cursor_pos
+    if input_text.strip():
+        shell.execute_command(input_text)
+        input_text = ""
+        input_cursor_pos = 0
+
+def shell_key_backspace():
+    delete_input_char()
+
+def shell_key_history_prev():
+    global input_text, input_cursor_pos
+    input_text = shell.get_history_prev()
+    input_cursor_pos = len(input_text)
+
+def shell_key_history_next():
+    global input_text, input_cursor_pos
+    input_text = shell.get_history_next()
+    input_cursor_pos = len(input_text)
+
+def shell_key_left():
+    global input_cursor_pos
+    input_cursor_pos = max(0, input_cursor_pos - 1)
+
+def shell_key_right():
+    global input_cursor_pos
+    input_cursor_pos = min(len(input_text), input_cursor_pos + 1)
+
+def shell_key_home():
+    global input_cursor_pos
+    input_cursor_pos = 0
+
+def shell_key_end():
+    global input_cursor_pos
+    input_cursor_pos = len(input_text)
+
+def shell_key_page_up():
+    global output_scroll
+    output_scroll = min(output_scroll + 5, 100)
+
+def shell_key_page_down():
+    global output_scroll
+    output_scroll = max(output_scroll - 5, 0)
+
+def shell_key_autocomplete():
+    global input_text, input_cursor_pos
+    input_text, input_cursor_pos = shell.autocomplete(input_text, input_cursor_pos)
+
+SHELL_KEY_HANDLERS = {
+    sdl2.SDLK_ESCAPE: shell_key_quit,
+    sdl2.SDLK_RETURN: shell_key_submit,
+    sdl2.SDLK_KP_ENTER: shell_key_submit,
+    sdl2.SDLK_BACKSPACE: shell_key_backspace,
+    sdl2.SDLK_UP: shell_key_history_prev,
+    sdl2.SDLK_DOWN: shell_key_history_next,
+    sdl2.SDLK_LEFT: shell_key_left,
+    sdl2.SDLK_RIGHT: shell_key_right,
+    sdl2.SDLK_HOME: shell_key_home,
+    sdl2.SDLK_END: shell_key_end,
+    sdl2.SDLK_PAGEUP: shell_key_page_up,
+    sdl2.SDLK_PAGEDOWN: shell_key_page_down,
+    sdl2.SDLK_TAB: shell_key_autocomplete,
+}
+
+def vkey_toggle_ctrl():
+    global modifier_bits
+    modifier_bits ^= MOD_CTRL
+
+def vkey_toggle_alt():
+    global modifier_bits
+    modifier_bits ^= MOD_ALT
+
+def vkey_toggle_shift():
+    # First press switches to uppercase and locks it, the second returns to lowercase
+    global modifier_bits
+    if not modifier_bits & MOD_SHIFT_LOCKED:
+        if layout_mode == "lower":
+            switch_layout("upper")
+    else:
+        switch_layout("lower")
+    modifier_bits ^= MOD_SHIFT_LOCKED
+
+def vkey_symbols():
+    switch_layout("symbols")
+
+def vkey_letters():
+    global modifier_bits
+    switch_layout("lower")
+    modifier_bits &= ~MOD_SHIFT_LOCKED  # Unlock shift when returning to ABC
+
+# On-screen keys that change modifiers or the layout, the same in every mode
+VIRTUAL_MODIFIER_KEYS = {
+    'Ctrl': vkey_toggle_ctrl,
+    'Alt': vkey_toggle_alt,
+    '⇧': vkey_toggle_shift,
+    '#+=': vkey_symbols,
+    'ABC': vkey_letters,
+}
+
+# On-screen key drawn as locked while its modifier bit is set
+MODIFIER_KEY_BITS = (('Ctrl', MOD_CTRL), ('Alt', MOD_ALT), ('⇧', MOD_SHIFT_LOCKED))
+
+def editor_key_space(editor, selecting):
+    editor.insert_text(" ")
+
+# On-screen special keys in the editor (never extend the selection)
+EDITOR_VIRTUAL_KEY_HANDLERS = {
+    '↵': editor_key_newline,
+    '⌫': editor_key_backspace,
+    '␣': editor_key_space,
+    'Tab': editor_key_tab,
+    'Esc': editor_key_exit,
+    '↑': editor_key_up,
+    '↓': editor_key_down,
+    '←': editor_key_left,
+    '→': editor_key_right,
+}
+
+# On-screen special keys forwarded to the PTY as send_key_to_pty codes
+PTY_VIRTUAL_KEYS = {
+    '↵': "ENTER",
+    '⌫': "BACKSPACE",
+    'Tab': "TAB",
+    'Esc': "ESC",
+    '↑': "UP",
+    '↓': "DOWN",
+    '←': "LEFT",
+    '→': "RIGHT",
+}
+
+# xterm escape sequences for the F1-F12 keys of the symbols layout
+FUNCTION_KEY_SEQUENCES = {
+    'F1': '\x1bOP',
+    'F2': '\x1bOQ',
+    'F3': '\x1bOR',
+    'F4': '\x1bOS',
+    'F5': '\x1b[15~',
+    'F6': '\x1b[17~',
+    'F7': '\x1b[18~',
+    'F8': '\x1b[19~',
+    'F9': '\x1b[20~',
+    'F10': '\x1b[21~',
+    'F11': '\x1b[23~',
+    'F12': '\x1b[24~',
+}
+
+def shell_key_space():
+    insert_input_text(" ")
+
+def shell_key_ignore():
+    pass
+
+# On-screen special keys in normal shell input; Esc and the arrows have no meaning there
+SHELL_VIRTUAL_KEY_HANDLERS = {
+    '↵': shell_key_submit,
+    '⌫': shell_key_backspace,
+    '␣': shell_key_space,
+    'Tab': shell_key_autocomplete,
+    'Esc': shell_key_ignore,
+    '↑': shell_key_ignore,
+    '↓': shell_key_ignore,
+    '←': shell_key_ignore,
+    '→': shell_key_ignore,
+}
+
+# (shell.in_pty_mode, on-screen key) -> handler for every key that is not typed as a character
+SHELL_SPECIAL_KEY_HANDLERS = {
+    **{(False, key): handler for key, handler in SHELL_VIRTUAL_KEY_HANDLERS.items()},
+    **{(False, key): shell_key_ignore for key in FUNCTION_KEY_SEQUENCES},  # Meaningless in shell input
+    **{(True, key): functools.partial(shell.send_key_to_pty, code) for key, code in PTY_VIRTUAL_KEYS.items()},
+    **{(True, key): functools.partial(shell.send_to_pty, sequence) for key, sequence in FUNCTION_KEY_SEQUENCES.items()},
+    (True, '␣'): functools.partial(shell.send_to_pty, " "),
+}
+
+# Printable keysyms 32-126 are their own ASCII codes; index these instead of chr()/upper() per key
+ASCII_CHARS = tuple(chr(code) for code in range(128))
+ASCII_SHIFTED = tuple(char.upper() for char in ASCII_CHARS)
+
+# Event types the loop acts on, plus the window/renderer events that invalidate the frame
+REDRAW_EVENT_TYPES = frozenset((
+    sdl2.SDL_QUIT,
+    sdl2.SDL_KEYDOWN,
+    sdl2.SDL_TEXTINPUT,
+    sdl2.SDL_JOYBUTTONDOWN,
+    sdl2.SDL_JOYBUTTONUP,
+    sdl2.SDL_WINDOWEVENT,
+    sdl2.SDL_RENDER_TARGETS_RESET,
+    sdl2.SDL_RENDER_DEVICE_RESET,
+))
+
+EVENT_BATCH_SIZE = 64  # Events fetched per SDL_PeepEvents call
+event_buffer = (sdl2.SDL_Event * EVENT_BATCH_SIZE)()
+
+WINDOW_HIDE_EVENTS = frozenset((sdl2.SDL_WINDOWEVENT_MINIMIZED, sdl2.SDL_WINDOWEVENT_HIDDEN))
+WINDOW_SHOW_EVENTS = frozenset((sdl2.SDL_WINDOWEVENT_RESTORED, sdl2.SDL_WINDOWEVENT_SHOWN, sdl2.SDL_WINDOWEVENT_EXPOSED))
+
+def get_idle_timeout(now):
+    """Milliseconds until the next blink, key repeat or output flush is due"""
+    deadline = last_blink_time + BLINK_RATE + 1
+    if button_repeat_state and next_repeat_time < deadline:
+        deadline = next_repeat_time
+    if shell.output_dirty_since:
+        flush_in = OUTPUT_COALESCE_SECONDS - (time.monotonic() - shell.output_dirty_since)
+        deadline = min(deadline, now + int(flush_in * 1000) + 1)
+    return max(1, deadline - now)
+
+def drain_events():
+    """Yield (event, next event type) for everything queued, fetched in batches"""
+    sdl2.SDL_PumpEvents()
+    while True:
+        count = sdl2.SDL_PeepEvents(event_buffer, EVENT_BATCH_SIZE, sdl2.SDL_GETEVENT, sdl2.SDL_FIRSTEVENT, sdl2.SDL_LASTEVENT)
+        if count <= 0:
+            return
+        for index in range(count):
+            next_type = event_buffer[index + 1].type if index + 1 < count else 0
+            yield event_buffer[index], next_type
+        if count < EVENT_BATCH_SIZE:
+            return
 
 # -----------------------------
 # Main Loop
@@ -3205,24 +4733,28 @@ while running:
     if current_time - last_blink_time > BLINK_RATE:
         cursor_blink = not cursor_blink
         last_blink_time = current_time
-        needs_redraw = True  # Cursor blink requires redraw
+        redraw_flags |= REDRAW_CURSOR  # Cursor blink only needs the cursor redrawn
     
-    # Check for new output from shell
-    if shell.output_updated:
-        needs_redraw = True
-        shell.output_updated = False
+    # Check for new output from shell, coalescing bursts into one redraw
+    if shell.output_dirty_since and time.monotonic() - shell.output_dirty_since >= OUTPUT_COALESCE_SECONDS:
+        redraw_flags |= REDRAW_FRAME
+        shell.output_dirty_since = 0.0
     
-    event = sdl2.SDL_Event()
-    has_events = False
-    while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
-        has_events = True
-        needs_redraw = True  # Any event triggers redraw
+    pending_text = []
+    for event, next_event_type in drain_events():
+        event_type = event.type  # Read the ctypes union field once per event
+        if event_type not in REDRAW_EVENT_TYPES:
+            continue  # Analog stick drift, mouse motion, key-up and the like change nothing on screen
+        if event_type != sdl2.SDL_JOYBUTTONUP or show_button_map_overlay:
+            redraw_flags |= REDRAW_FRAME  # A released button only shows on the button map
         
-        if event.type == sdl2.SDL_QUIT:
+        if event_type == sdl2.SDL_QUIT:
             running = False
         
-        elif event.type == sdl2.SDL_KEYDOWN:
-            key = event.key.keysym.sym
+        elif event_type == sdl2.SDL_KEYDOWN:
+            keysym = event.key.keysym
+            key = keysym.sym
+            mods = keysym.mod  # Modifier state as of this key press, no extra SDL call
             if show_button_map_overlay:
                 if key == sdl2.SDLK_ESCAPE:
                     show_button_map_overlay = False
@@ -3238,17 +4770,17 @@ while running:
                 if key == sdl2.SDLK_ESCAPE:
                     theme_menu_open = False
                 elif key == sdl2.SDLK_UP:
-                    theme_menu_index = (theme_menu_index - 1) % len(THEME_MENU_ITEMS)
+                    theme_menu_index = (theme_menu_index - 1) % THEME_MENU_COUNT
                 elif key == sdl2.SDLK_DOWN:
-                    theme_menu_index = (theme_menu_index + 1) % len(THEME_MENU_ITEMS)
+                    theme_menu_index = (theme_menu_index + 1) % THEME_MENU_COUNT
                 elif key == sdl2.SDLK_LEFT:
-                    menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                    menu_id = THEME_MENU_IDS[theme_menu_index]
                     update_theme_setting(menu_id, direction=-1)
                 elif key == sdl2.SDLK_RIGHT:
-                    menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                    menu_id = THEME_MENU_IDS[theme_menu_index]
                     update_theme_setting(menu_id, direction=1)
                 elif key == sdl2.SDLK_RETURN or key == sdl2.SDLK_KP_ENTER:
-                    menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                    menu_id = THEME_MENU_IDS[theme_menu_index]
                     update_theme_setting(menu_id, activate=True)
                 continue
 
@@ -3257,144 +4789,41 @@ while running:
                 if not editor:
                     shell.exit_editor("[System] Editor closed unexpectedly.")
                     continue
-                mods = sdl2.SDL_GetModState()
                 selecting = bool(mods & sdl2.KMOD_SHIFT)
                 if mods & sdl2.KMOD_CTRL:
-                    if key == sdl2.SDLK_s:
-                        editor.save_file()
-                        shell.add_output(f"[System] Saved: {editor.file_path}")
-                    elif key == sdl2.SDLK_q or key == sdl2.SDLK_ESCAPE:
-                        exit_editor_session(shell)
-                    elif key == sdl2.SDLK_a:
-                        editor.select_all()
-                    elif key == sdl2.SDLK_c:
-                        if editor.copy_selection():
-                            shell.add_output("[System] Copied selection")
-                    elif key == sdl2.SDLK_x:
-                        if editor.cut_selection():
-                            shell.add_output("[System] Cut selection")
-                    elif key == sdl2.SDLK_v:
-                        if editor.paste_clipboard():
-                            shell.add_output("[System] Pasted clipboard")
+                    ctrl_handler = EDITOR_CTRL_KEY_HANDLERS.get(key)
+                    if ctrl_handler:
+                        ctrl_handler(editor)
                     continue
-                if key == sdl2.SDLK_ESCAPE:
-                    exit_editor_session(shell)
-                elif key == sdl2.SDLK_RETURN or key == sdl2.SDLK_KP_ENTER:
-                    editor.insert_newline()
-                elif key == sdl2.SDLK_BACKSPACE:
-                    editor.backspace()
-                elif key == sdl2.SDLK_DELETE:
-                    editor.delete_forward()
-                elif key == sdl2.SDLK_UP:
-                    editor.move_cursor(delta_line=-1, selecting=selecting)
-                elif key == sdl2.SDLK_DOWN:
-                    editor.move_cursor(delta_line=1, selecting=selecting)
-                elif key == sdl2.SDLK_LEFT:
-                    editor.move_cursor(delta_col=-1, selecting=selecting)
-                elif key == sdl2.SDLK_RIGHT:
-                    editor.move_cursor(delta_col=1, selecting=selecting)
-                elif key == sdl2.SDLK_HOME:
-                    editor.move_home(selecting=selecting)
-                elif key == sdl2.SDLK_END:
-                    editor.move_end(selecting=selecting)
-                elif key == sdl2.SDLK_PAGEUP:
-                    layout = get_current_editor_layout()
-                    editor.move_page(-1, layout["max_lines"], selecting=selecting)
-                elif key == sdl2.SDLK_PAGEDOWN:
-                    layout = get_current_editor_layout()
-                    editor.move_page(1, layout["max_lines"], selecting=selecting)
-                elif key == sdl2.SDLK_TAB:
-                    editor.insert_text("    ")
+                key_handler = EDITOR_KEY_HANDLERS.get(key)
+                if key_handler:
+                    key_handler(editor, selecting)
                 elif 32 <= key <= 126:
-                    char = chr(key)
-                    if len(char) == 1:
-                        editor.insert_text(char.upper() if mods & sdl2.KMOD_SHIFT else char)
+                    editor.insert_text(ASCII_SHIFTED[key] if mods & sdl2.KMOD_SHIFT else ASCII_CHARS[key])
                 continue
 
             # In PTY mode, handle keys differently
             if shell.in_pty_mode:
-                if key == sdl2.SDLK_ESCAPE:
-                    shell.send_key_to_pty('ESC')
-                elif key == sdl2.SDLK_RETURN or key == sdl2.SDLK_KP_ENTER:
-                    shell.send_key_to_pty('ENTER')
-                elif key == sdl2.SDLK_BACKSPACE:
-                    shell.send_key_to_pty('BACKSPACE')
-                elif key == sdl2.SDLK_UP:
-                    shell.send_key_to_pty('UP')
-                elif key == sdl2.SDLK_DOWN:
-                    shell.send_key_to_pty('DOWN')
-                elif key == sdl2.SDLK_LEFT:
-                    shell.send_key_to_pty('LEFT')
-                elif key == sdl2.SDLK_RIGHT:
-                    shell.send_key_to_pty('RIGHT')
-                elif key == sdl2.SDLK_TAB:
-                    shell.send_key_to_pty('TAB')
-                elif key == sdl2.SDLK_c and (sdl2.SDL_GetModState() & sdl2.KMOD_CTRL):
-                    shell.send_key_to_pty('CTRL_C')
-                elif key == sdl2.SDLK_x and (sdl2.SDL_GetModState() & sdl2.KMOD_CTRL):
-                    shell.send_key_to_pty('CTRL_X')
-                elif key == sdl2.SDLK_d and (sdl2.SDL_GetModState() & sdl2.KMOD_CTRL):
-                    shell.send_key_to_pty('CTRL_D')
+                pty_key = PTY_SPECIAL_KEYS.get(key)
+                if pty_key is None and mods & sdl2.KMOD_CTRL:
+                    pty_key = PTY_CTRL_KEYS.get(key)
+                if pty_key:
+                    shell.send_key_to_pty(pty_key)
                 elif 32 <= key <= 126:
-                    char = chr(key)
-                    mods = sdl2.SDL_GetModState()
-                    if mods & (sdl2.KMOD_SHIFT):
-                        shell.send_to_pty(char.upper())
-                    else:
-                        shell.send_to_pty(char)
+                    shell.send_to_pty(ASCII_SHIFTED[key] if mods & sdl2.KMOD_SHIFT else ASCII_CHARS[key])
             else:
-                # Normal shell mode
-                mods = sdl2.SDL_GetModState()
-                if key == sdl2.SDLK_c and (mods & sdl2.KMOD_CTRL):
-                    shell.interrupt_foreground()
-                    input_text = ""
-                    input_cursor_pos = 0
-                elif key == sdl2.SDLK_l and (mods & sdl2.KMOD_CTRL):
-                    shell.clear_output()
-                elif key == sdl2.SDLK_ESCAPE:
-                    running = False
-                elif key == sdl2.SDLK_RETURN or key == sdl2.SDLK_KP_ENTER:
-                    if input_text.strip():
-                        shell.execute_command(input_text)
-                        input_text = ""
-                        input_cursor_pos = 0
-                elif key == sdl2.SDLK_BACKSPACE:
-                    if input_cursor_pos > 0:
-                        input_text = input_text[:input_cursor_pos-1] + input_text[input_cursor_pos:]
-                        input_cursor_pos -= 1
-                elif key == sdl2.SDLK_UP:
-                    input_text = shell.get_history_prev()
-                    input_cursor_pos = len(input_text)
-                elif key == sdl2.SDLK_DOWN:
-                    input_text = shell.get_history_next()
-                    input_cursor_pos = len(input_text)
-                elif key == sdl2.SDLK_LEFT:
-                    input_cursor_pos = max(0, input_cursor_pos - 1)
-                elif key == sdl2.SDLK_RIGHT:
-                    input_cursor_pos = min(len(input_text), input_cursor_pos + 1)
-                elif key == sdl2.SDLK_HOME:
-                    input_cursor_pos = 0
-                elif key == sdl2.SDLK_END:
-                    input_cursor_pos = len(input_text)
-                elif key == sdl2.SDLK_PAGEUP:
-                    output_scroll = min(output_scroll + 5, 100)
-                elif key == sdl2.SDLK_PAGEDOWN:
-                    output_scroll = max(output_scroll - 5, 0)
-                elif key == sdl2.SDLK_TAB:
-                    # Tab triggers autocomplete
-                    input_text, input_cursor_pos = shell.autocomplete(input_text, input_cursor_pos)
+                # Normal shell mode; Ctrl combos take precedence over plain keys
+                key_handler = SHELL_CTRL_KEY_HANDLERS.get(key) if mods & sdl2.KMOD_CTRL else None
+                if key_handler is None:
+                    key_handler = SHELL_KEY_HANDLERS.get(key)
+                if key_handler:
+                    key_handler()
                 else:
                     # Handle text input
-                    if 32 <= key <= 126 and len(input_text) < MAX_INPUT_LENGTH:
-                        char = chr(key)
-                        if mods & (sdl2.KMOD_SHIFT):
-                            input_text = input_text[:input_cursor_pos] + char.upper() + input_text[input_cursor_pos:]
-                            input_cursor_pos += 1
-                        else:
-                            input_text = input_text[:input_cursor_pos] + char + input_text[input_cursor_pos:]
-                            input_cursor_pos += 1
+                    if 32 <= key <= 126:
+                        insert_input_text(ASCII_SHIFTED[key] if mods & sdl2.KMOD_SHIFT else ASCII_CHARS[key])
         
-        elif event.type == sdl2.SDL_TEXTINPUT:
+        elif event_type == sdl2.SDL_TEXTINPUT:
             # Handle text input for non-ASCII characters
             if show_button_map_overlay:
                 continue
@@ -3406,7 +4835,13 @@ while running:
                 continue
             if theme_menu_open:
                 continue
-            text = event.text.text.decode('utf-8')
+            pending_text.append(event.text.text)
+            if next_event_type == sdl2.SDL_TEXTINPUT:
+                continue  # Insert a pasted or IME run as one string
+            # One decode per run; ASCII (the common case) takes the plain copy path
+            raw_text = b"".join(pending_text)
+            pending_text.clear()
+            text = raw_text.decode('ascii') if raw_text.isascii() else raw_text.decode('utf-8', 'replace')
             if shell.in_editor_mode and shell.editor:
                 shell.editor.insert_text(text)
             else:
@@ -3414,13 +4849,12 @@ while running:
                     input_text += text
         
         # Joystick events
-        elif event.type == sdl2.SDL_JOYBUTTONDOWN and joystick:
+        elif event_type == sdl2.SDL_JOYBUTTONDOWN and joystick:
             btn = event.jbutton.button
             if show_button_map_overlay:
-                button_states[btn] = True
-                if btn in (BTN_START, BTN_SELECT):
-                    if button_states[BTN_START] and button_states[BTN_SELECT]:
-                        show_button_map_overlay = False
+                button_mask |= 1 << btn
+                if (button_mask & EXIT_COMBO_BITS) == EXIT_COMBO_BITS:
+                    show_button_map_overlay = False
                 continue
             if shell.in_editor_mode and show_editor_help_overlay:
                 show_editor_help_overlay = False
@@ -3428,45 +4862,39 @@ while running:
             if not shell.in_editor_mode and show_shell_help_overlay:
                 show_shell_help_overlay = False
                 continue
-            button_states[btn] = True
-            if btn in (BTN_DPAD_UP, BTN_DPAD_DOWN, BTN_DPAD_LEFT, BTN_DPAD_RIGHT):
+            button_mask |= 1 << btn
+            if btn in DPAD_BUTTONS:
                 button_repeat_state[btn] = {
                     "press_time": current_time,
                     "next_time": current_time + REPEAT_DELAY,
                 }
+                next_repeat_time = min(state["next_time"] for state in button_repeat_state.values())
             
             # Exit combination: Start + Select
-            if btn == BTN_START:
-                exit_mask |= 0x01
-                if button_states[BTN_SELECT]:
-                    exit_mask = 0x03
-                else:
-                    if shell.in_editor_mode:
-                        set_editor_nav_mode("keyboard" if editor_nav_mode == "file" else "file")
-                    else:
-                        theme_menu_open = not theme_menu_open
-            elif btn == BTN_SELECT:
-                exit_mask |= 0x02
-            
-            if exit_mask == 0x03:
+            if (button_mask & EXIT_COMBO_BITS) == EXIT_COMBO_BITS:
                 running = False
                 continue
+            if btn == BTN_START:
+                if shell.in_editor_mode:
+                    set_editor_nav_mode("keyboard" if editor_nav_mode == "file" else "file")
+                else:
+                    theme_menu_open = not theme_menu_open
 
             if theme_menu_open:
                 if btn == BTN_B:
                     theme_menu_open = False
                 elif btn == BTN_A:
-                    menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                    menu_id = THEME_MENU_IDS[theme_menu_index]
                     update_theme_setting(menu_id, activate=True)
                 elif btn == BTN_DPAD_UP:
-                    theme_menu_index = (theme_menu_index - 1) % len(THEME_MENU_ITEMS)
+                    theme_menu_index = (theme_menu_index - 1) % THEME_MENU_COUNT
                 elif btn == BTN_DPAD_DOWN:
-                    theme_menu_index = (theme_menu_index + 1) % len(THEME_MENU_ITEMS)
+                    theme_menu_index = (theme_menu_index + 1) % THEME_MENU_COUNT
                 elif btn == BTN_DPAD_LEFT:
-                    menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                    menu_id = THEME_MENU_IDS[theme_menu_index]
                     update_theme_setting(menu_id, direction=-1)
                 elif btn == BTN_DPAD_RIGHT:
-                    menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                    menu_id = THEME_MENU_IDS[theme_menu_index]
                     update_theme_setting(menu_id, direction=1)
                 continue
 
@@ -3478,7 +4906,7 @@ while running:
                 layout = get_current_editor_layout()
                 clamp_layout_cursor()
                 rows = len(current_layout)
-                selecting = button_states[BTN_SELECT] and editor_nav_mode == "file"
+                selecting = button_mask & BIT_SELECT and editor_nav_mode == "file"
                 if btn == BTN_GUIDE:
                     editor.insert_text("    ")
                     continue
@@ -3489,10 +4917,10 @@ while running:
                             cursor_y = rows - 1
                         else:
                             cursor_y -= 1
-                        cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                        cursor_x = min(cursor_x, current_row_last[cursor_y])
                         maybe_play_keyboard_click(prev_x, prev_y)
                         continue
-                    if button_states[BTN_L2]:
+                    if button_mask & BIT_L2:
                         editor.move_page(-1, layout["max_lines"], selecting=selecting)
                     else:
                         editor.move_cursor(delta_line=-1, selecting=selecting)
@@ -3504,10 +4932,10 @@ while running:
                             cursor_y = 0
                         else:
                             cursor_y += 1
-                        cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                        cursor_x = min(cursor_x, current_row_last[cursor_y])
                         maybe_play_keyboard_click(prev_x, prev_y)
                         continue
-                    if button_states[BTN_L2]:
+                    if button_mask & BIT_L2:
                         editor.move_page(1, layout["max_lines"], selecting=selecting)
                     else:
                         editor.move_cursor(delta_line=1, selecting=selecting)
@@ -3516,12 +4944,12 @@ while running:
                     if editor_nav_mode == "keyboard":
                         prev_x, prev_y = cursor_x, cursor_y
                         if cursor_x == 0:
-                            cursor_x = len(current_layout[cursor_y]) - 1
+                            cursor_x = current_row_last[cursor_y]
                         else:
                             cursor_x -= 1
                         maybe_play_keyboard_click(prev_x, prev_y)
                         continue
-                    if button_states[BTN_R2]:
+                    if button_mask & BIT_R2:
                         editor.move_home(selecting=selecting)
                     else:
                         editor.move_cursor(delta_col=-1, selecting=selecting)
@@ -3529,91 +4957,58 @@ while running:
                 if btn == BTN_DPAD_RIGHT:
                     if editor_nav_mode == "keyboard":
                         prev_x, prev_y = cursor_x, cursor_y
-                        if cursor_x >= len(current_layout[cursor_y]) - 1:
+                        if cursor_x >= current_row_last[cursor_y]:
                             cursor_x = 0
                         else:
                             cursor_x += 1
                         maybe_play_keyboard_click(prev_x, prev_y)
                         continue
-                    if button_states[BTN_R2]:
+                    if button_mask & BIT_R2:
                         editor.move_end(selecting=selecting)
                     else:
                         editor.move_cursor(delta_col=1, selecting=selecting)
                     continue
                 if btn == BTN_A:
-                    if button_states[BTN_L2]:
+                    if button_mask & BIT_L2:
                         editor.save_file()
                         shell.add_output(f"[System] Saved: {editor.file_path}")
                         continue
                     selected_key = current_layout[cursor_y][cursor_x]
-                    if selected_key == 'Ctrl':
-                        modifier_ctrl = not modifier_ctrl
-                    elif selected_key == 'Alt':
-                        modifier_alt = not modifier_alt
-                    elif selected_key == '⇧':
-                        if not modifier_shift_locked:
-                            if layout_mode == "lower":
-                                switch_layout("upper")
-                            modifier_shift_locked = True
-                        else:
-                            switch_layout("lower")
-                            modifier_shift_locked = False
-                    elif selected_key == '#+=':
-                        switch_layout("symbols")
-                    elif selected_key == 'ABC':
-                        switch_layout("lower")
-                        modifier_shift_locked = False
-                    elif selected_key == '↵':
-                        editor.insert_newline()
-                    elif selected_key == '⌫':
-                        editor.backspace()
-                    elif selected_key == '␣':
-                        editor.insert_text(" ")
-                    elif selected_key == 'Tab':
-                        editor.insert_text("    ")
-                    elif selected_key == 'Esc':
-                        exit_editor_session(shell)
-                    elif selected_key == '↑':
-                        editor.move_cursor(delta_line=-1)
-                    elif selected_key == '↓':
-                        editor.move_cursor(delta_line=1)
-                    elif selected_key == '←':
-                        editor.move_cursor(delta_col=-1)
-                    elif selected_key == '→':
-                        editor.move_cursor(delta_col=1)
+                    modifier_handler = VIRTUAL_MODIFIER_KEYS.get(selected_key)
+                    key_handler = EDITOR_VIRTUAL_KEY_HANDLERS.get(selected_key)
+                    if modifier_handler:
+                        modifier_handler()
+                    elif key_handler:
+                        key_handler(editor, False)
                     else:
-                        if modifier_ctrl or modifier_alt:
-                            editor.insert_text(selected_key)
-                            modifier_ctrl = False
-                            modifier_alt = False
-                        else:
-                            editor.insert_text(selected_key)
-                        if not modifier_shift_locked and layout_mode == "upper":
+                        editor.insert_text(selected_key)
+                        modifier_bits &= ~MOD_CTRL_ALT  # Modifiers are consumed by the key
+                        if not modifier_bits & MOD_SHIFT_LOCKED and layout_mode == "upper":
                             switch_layout("lower")
                     continue
                 if btn == BTN_B:
-                    if button_states[BTN_L2]:
+                    if button_mask & BIT_L2:
                         exit_editor_session(shell)
-                    elif button_states[BTN_R1]:
+                    elif button_mask & BIT_R1:
                         editor.delete_forward()
                     else:
                         editor.backspace()
                     continue
                 if btn == BTN_X:
-                    if button_states[BTN_L1]:
+                    if button_mask & BIT_L1:
                         if editor.copy_selection():
                             shell.add_output("[System] Copied selection")
-                    elif button_states[BTN_R1]:
+                    elif button_mask & BIT_R1:
                         if editor.paste_clipboard():
                             shell.add_output("[System] Pasted clipboard")
                     else:
                         editor.insert_text(" ")
                     continue
                 if btn == BTN_Y:
-                    if button_states[BTN_L1]:
+                    if button_mask & BIT_L1:
                         if editor.cut_selection():
                             shell.add_output("[System] Cut selection")
-                    elif button_states[BTN_R1]:
+                    elif button_mask & BIT_R1:
                         editor.select_all()
                     else:
                         editor.insert_newline()
@@ -3630,7 +5025,7 @@ while running:
                     input_text, input_cursor_pos = shell.autocomplete(input_text, input_cursor_pos)
             # Select + D-Pad combos for cursor movement and history
             elif btn == BTN_DPAD_UP:  # D-Pad Up
-                if button_states[BTN_SELECT]:  # Select is pressed - navigate history
+                if button_mask & BIT_SELECT:  # Select is pressed - navigate history
                     if shell.in_pty_mode:
                         history_entry = shell.get_pty_history_prev()
                         if history_entry is None:
@@ -3650,10 +5045,10 @@ while running:
                     else:
                         cursor_y -= 1
                     # Adjust cursor_x if new row has fewer keys
-                    cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                    cursor_x = min(cursor_x, current_row_last[cursor_y])
                     maybe_play_keyboard_click(prev_x, prev_y)
             elif btn == BTN_DPAD_DOWN:  # D-Pad Down
-                if button_states[BTN_SELECT]:  # Select is pressed - navigate history
+                if button_mask & BIT_SELECT:  # Select is pressed - navigate history
                     if shell.in_pty_mode:
                         history_entry = shell.get_pty_history_next()
                         if history_entry is None:
@@ -3673,10 +5068,10 @@ while running:
                     else:
                         cursor_y += 1
                     # Adjust cursor_x if new row has fewer keys
-                    cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                    cursor_x = min(cursor_x, current_row_last[cursor_y])
                     maybe_play_keyboard_click(prev_x, prev_y)
             elif btn == BTN_DPAD_LEFT:  # D-Pad Left
-                if button_states[BTN_SELECT]:  # Select is pressed - move cursor left
+                if button_mask & BIT_SELECT:  # Select is pressed - move cursor left
                     if shell.in_pty_mode:
                         shell.send_key_to_pty('LEFT')
                     else:
@@ -3685,12 +5080,12 @@ while running:
                     prev_x, prev_y = cursor_x, cursor_y
                     # Wrap around: if at leftmost, go to rightmost
                     if cursor_x == 0:
-                        cursor_x = len(current_layout[cursor_y]) - 1
+                        cursor_x = current_row_last[cursor_y]
                     else:
                         cursor_x -= 1
                     maybe_play_keyboard_click(prev_x, prev_y)
             elif btn == BTN_DPAD_RIGHT:  # D-Pad Right
-                if button_states[BTN_SELECT]:  # Select is pressed - move cursor right
+                if button_mask & BIT_SELECT:  # Select is pressed - move cursor right
                     if shell.in_pty_mode:
                         shell.send_key_to_pty('RIGHT')
                     else:
@@ -3698,7 +5093,7 @@ while running:
                 else:
                     prev_x, prev_y = cursor_x, cursor_y
                     # Wrap around: if at rightmost, go to leftmost
-                    if cursor_x >= len(current_layout[cursor_y]) - 1:
+                    if cursor_x >= current_row_last[cursor_y]:
                         cursor_x = 0
                     else:
                         cursor_x += 1
@@ -3706,202 +5101,84 @@ while running:
             elif btn == BTN_A:  # A/Cross = Select key
                 selected_key = current_layout[cursor_y][cursor_x]
                 
-                if shell.in_pty_mode:
-                    # In PTY mode, send keys directly to the interactive app
-                    if selected_key == 'Ctrl':
-                        # Toggle Ctrl modifier
-                        modifier_ctrl = not modifier_ctrl
-                    elif selected_key == 'Alt':
-                        # Toggle Alt modifier
-                        modifier_alt = not modifier_alt
-                    elif selected_key == '⇧':
-                        # Toggle shift - works like Ctrl/Alt now
-                        if not modifier_shift_locked:
-                            # First press: just switch to uppercase
-                            if layout_mode == "lower":
-                                switch_layout("upper")
-                            modifier_shift_locked = True  # Lock it
-                        else:
-                            # Second press: unlock and return to lowercase
-                            switch_layout("lower")
-                            modifier_shift_locked = False
-                    elif selected_key == '#+=':
-                        switch_layout("symbols")
-                    elif selected_key == 'ABC':
-                        switch_layout("lower")
-                        modifier_shift_locked = False  # Unlock shift when returning to ABC
-                    elif selected_key == '↵':
-                        shell.send_key_to_pty('ENTER')
-                    elif selected_key == '⌫':
-                        shell.send_key_to_pty('BACKSPACE')
-                    elif selected_key == '␣':
-                        shell.send_to_pty(" ")
-                    elif selected_key == 'Tab':
-                        shell.send_key_to_pty('TAB')
-                    elif selected_key == 'Esc':
-                        shell.send_key_to_pty('ESC')
-                    elif selected_key == '↑':
-                        shell.send_key_to_pty('UP')
-                    elif selected_key == '↓':
-                        shell.send_key_to_pty('DOWN')
-                    elif selected_key == '←':
-                        shell.send_key_to_pty('LEFT')
-                    elif selected_key == '→':
-                        shell.send_key_to_pty('RIGHT')
-                    elif selected_key.startswith('F') and len(selected_key) <= 3:
-                        # F1-F10 function keys
-                        fnum = selected_key[1:]
-                        if fnum.isdigit():
-                            fn = int(fnum)
-                            if fn <= 5:
-                                shell.send_to_pty(f'\x1bO{chr(ord("P") + fn - 1)}')
-                            else:
-                                shell.send_to_pty(f'\x1b[{fn + 10}~')
-                    else:
+                modifier_handler = VIRTUAL_MODIFIER_KEYS.get(selected_key)
+                special_handler = SHELL_SPECIAL_KEY_HANDLERS.get((shell.in_pty_mode, selected_key))
+                if modifier_handler:
+                    modifier_handler()
+                elif special_handler:
+                    special_handler()
+                else:
+                    if shell.in_pty_mode:
                         # Regular character - send with modifiers if active
-                        if modifier_ctrl or modifier_alt:
-                            shell.send_char_with_modifiers(selected_key, modifier_ctrl, modifier_alt)
+                        if modifier_bits & MOD_CTRL_ALT:
+                            shell.send_char_with_modifiers(selected_key, bool(modifier_bits & MOD_CTRL), bool(modifier_bits & MOD_ALT))
                             # Auto-unlock modifiers after use
-                            modifier_ctrl = False
-                            modifier_alt = False
+                            modifier_bits &= ~MOD_CTRL_ALT
                         else:
                             shell.send_to_pty(selected_key)
-                        
-                        # Auto-unlock shift if not locked
-                        if not modifier_shift_locked and layout_mode == "upper":
-                            switch_layout("lower")
-                else:
-                    # Normal shell mode
-                    if modifier_ctrl and selected_key.lower() == 'c':
-                        shell.interrupt_foreground()
-                        input_text = ""
-                        input_cursor_pos = 0
-                        modifier_ctrl = False
-                        continue
-                    if modifier_ctrl and selected_key.lower() == 'l':
-                        shell.clear_output()
-                        modifier_ctrl = False
-                        continue
-                    if selected_key == 'Ctrl':
-                        # Toggle Ctrl modifier
-                        modifier_ctrl = not modifier_ctrl
-                    elif selected_key == 'Alt':
-                        # Toggle Alt modifier  
-                        modifier_alt = not modifier_alt
-                    elif selected_key == '⇧':
-                        # Toggle shift - works like Ctrl/Alt
-                        if not modifier_shift_locked:
-                            # First press: switch to uppercase and lock
-                            if layout_mode == "lower":
-                                switch_layout("upper")
-                            modifier_shift_locked = True
+                    elif modifier_bits & MOD_CTRL and selected_key.lower() in ('c', 'l'):
+                        if selected_key.lower() == 'c':
+                            shell_ctrl_interrupt()
                         else:
-                            # Second press: unlock and return to lowercase
-                            switch_layout("lower")
-                            modifier_shift_locked = False
-                    elif selected_key == '#+=':
-                        switch_layout("symbols")
-                    elif selected_key == 'ABC':
-                        switch_layout("lower")
-                        modifier_shift_locked = False  # Unlock shift when returning to ABC
-                    elif selected_key == '↵':
-                        if input_text.strip():
-                            shell.execute_command(input_text)
-                            input_text = ""
-                            input_cursor_pos = 0
-                    elif selected_key == '⌫':
-                        if input_cursor_pos > 0:
-                            input_text = input_text[:input_cursor_pos-1] + input_text[input_cursor_pos:]
-                            input_cursor_pos -= 1
-                    elif selected_key == '␣':
-                        if len(input_text) < MAX_INPUT_LENGTH:
-                            input_text = input_text[:input_cursor_pos] + " " + input_text[input_cursor_pos:]
-                            input_cursor_pos += 1
-                    elif selected_key == 'Tab':
-                        # Tab triggers autocomplete in normal mode
-                        input_text, input_cursor_pos = shell.autocomplete(input_text, input_cursor_pos)
-                    elif selected_key in ['Esc', '↑', '↓', '←', '→'] or selected_key.startswith('F'):
-                        # These keys don't make sense in normal shell input
-                        pass
+                            shell_ctrl_clear()
+                        modifier_bits &= ~MOD_CTRL
+                        continue
                     else:
                         # Regular character - modifiers don't apply in normal mode
-                        if len(input_text) < MAX_INPUT_LENGTH:
-                            input_text = input_text[:input_cursor_pos] + selected_key + input_text[input_cursor_pos:]
-                            input_cursor_pos += 1
-                        
-                        # Auto-unlock shift if not locked
-                        if not modifier_shift_locked and layout_mode == "upper":
-                            switch_layout("lower")
+                        insert_input_text(selected_key)
+                    
+                    # Auto-unlock shift if not locked
+                    if not modifier_bits & MOD_SHIFT_LOCKED and layout_mode == "upper":
+                        switch_layout("lower")
+            # B, X and Y are shortcuts for the on-screen ⌫, ␣ and ↵ keys
             elif btn == BTN_B:  # B/Circle = Backspace
-                if shell.in_pty_mode:
-                    shell.send_key_to_pty('BACKSPACE')
-                else:
-                    if input_cursor_pos > 0:
-                        input_text = input_text[:input_cursor_pos-1] + input_text[input_cursor_pos:]
-                        input_cursor_pos -= 1
+                SHELL_SPECIAL_KEY_HANDLERS[(shell.in_pty_mode, '⌫')]()
             elif btn == BTN_X:  # X/Square = Space
-                if shell.in_pty_mode:
-                    shell.send_to_pty(" ")
-                else:
-                    if len(input_text) < MAX_INPUT_LENGTH:
-                        input_text = input_text[:input_cursor_pos] + " " + input_text[input_cursor_pos:]
-                        input_cursor_pos += 1
+                SHELL_SPECIAL_KEY_HANDLERS[(shell.in_pty_mode, '␣')]()
             elif btn == BTN_Y:  # Y/Triangle = Execute/Enter
-                if shell.in_pty_mode:
-                    shell.send_key_to_pty('ENTER')
-                else:
-                    if input_text.strip():
-                        shell.execute_command(input_text)
-                        input_text = ""
-                        input_cursor_pos = 0
+                SHELL_SPECIAL_KEY_HANDLERS[(shell.in_pty_mode, '↵')]()
             elif btn == BTN_L2:  # L2
                 if shell.in_pty_mode:
                     # In PTY mode, check for combos
-                    if button_states[BTN_R2]:  # L2+R2 = Ctrl+C
+                    if button_mask & BIT_R2:  # L2+R2 = Ctrl+C
                         shell.send_key_to_pty('CTRL_C')
                         shell.add_output("[System] Sent Ctrl+C")
-                    elif button_states[BTN_L1]:  # L2+L1 = Ctrl+X
+                    elif button_mask & BIT_L1:  # L2+L1 = Ctrl+X
                         shell.send_key_to_pty('CTRL_X')
                         shell.add_output("[System] Sent Ctrl+X")
-                    elif button_states[BTN_R1]:  # L2+R1 = Ctrl+D (EOF)
+                    elif button_mask & BIT_R1:  # L2+R1 = Ctrl+D (EOF)
                         shell.send_key_to_pty('CTRL_D')
                         shell.add_output("[System] Sent Ctrl+D")
                     else:
                         # L2 alone = scroll output up
                         output_scroll = min(output_scroll + 5, 100)
                 else:
-                    if button_states[BTN_R2]:  # L2+R2 in normal mode = clear screen
+                    if button_mask & BIT_R2:  # L2+R2 in normal mode = clear screen
                         shell.execute_command("clear")
                     else:
                         output_scroll = min(output_scroll + 5, 100)
             elif btn == BTN_R2:  # R2
                 if shell.in_pty_mode:
                     # In PTY mode, check for combos
-                    if button_states[BTN_L2]:  # R2+L2 = Ctrl+C
+                    if button_mask & BIT_L2:  # R2+L2 = Ctrl+C
                         shell.send_key_to_pty('CTRL_C')
                         shell.add_output("[System] Sent Ctrl+C")
-                    elif button_states[BTN_L1]:  # R2+L1 = Ctrl+Z (suspend)
+                    elif button_mask & BIT_L1:  # R2+L1 = Ctrl+Z (suspend)
                         shell.send_key_to_pty('CTRL_Z')
                         shell.add_output("[System] Sent Ctrl+Z")
-                    elif button_states[BTN_R1]:  # R2+R1 = Tab
+                    elif button_mask & BIT_R1:  # R2+R1 = Tab
                         shell.send_key_to_pty('TAB')
                     else:
                         # R2 alone = scroll output down
                         output_scroll = max(output_scroll - 5, 0)
                 else:
-                    if button_states[BTN_L2]:  # R2+L2 in normal mode = clear screen
+                    if button_mask & BIT_L2:  # R2+L2 in normal mode = clear screen
                         shell.execute_command("clear")
                     else:
                         output_scroll = max(output_scroll - 5, 0)
             elif btn == BTN_L1:  # L1 - Toggle Shift
-                # L1 toggles shift (upper/lower case) with locking
-                if not modifier_shift_locked:
-                    if layout_mode == "lower":
-                        switch_layout("upper")
-                    modifier_shift_locked = True
-                else:
-                    switch_layout("lower")
-                    modifier_shift_locked = False
+                # L1 toggles shift (upper/lower case) with locking, like the on-screen ⇧ key
+                vkey_toggle_shift()
             elif btn == BTN_R1:  # R1 - Toggle to Symbols
                 # R1 toggles symbols
                 if layout_mode == "symbols":
@@ -3909,38 +5186,39 @@ while running:
                 else:
                     switch_layout("symbols")
         
-        elif event.type == sdl2.SDL_JOYBUTTONUP and joystick:
+        elif event_type == sdl2.SDL_WINDOWEVENT:
+            window_event = event.window.event
+            if window_event in WINDOW_HIDE_EVENTS:
+                window_hidden = True
+            elif window_event in WINDOW_SHOW_EVENTS:
+                window_hidden = False
+        
+        elif event_type == sdl2.SDL_JOYBUTTONUP and joystick:
             btn = event.jbutton.button
-            button_states[btn] = False
+            button_mask &= ~(1 << btn)
             if btn in button_repeat_state:
                 del button_repeat_state[btn]
-            if show_button_map_overlay:
-                continue
-            if btn == BTN_START:  # Start button
-                exit_mask &= 0xFE
-            elif btn == BTN_SELECT:  # Select button
-                exit_mask &= 0xFD
     
-    # Handle button repeat
-    if joystick:
+    # Handle button repeat, but only once the earliest held D-pad button is due
+    if joystick and button_repeat_state and current_time >= next_repeat_time:
         if not show_button_map_overlay:
             rows = len(current_layout)  # Need this for boundary checking
-            for btn, repeat_state in list(button_repeat_state.items()):
-                if not button_states[btn]:
+            for btn, repeat_state in button_repeat_state.items():
+                if not button_mask >> btn & 1:
                     continue
                 if current_time < repeat_state["next_time"]:
                     continue
-                needs_redraw = True  # Button repeat triggers redraw
+                redraw_flags |= REDRAW_FRAME  # Button repeat triggers redraw
                 if theme_menu_open:
                     if btn == BTN_DPAD_UP:
-                        theme_menu_index = (theme_menu_index - 1) % len(THEME_MENU_ITEMS)
+                        theme_menu_index = (theme_menu_index - 1) % THEME_MENU_COUNT
                     elif btn == BTN_DPAD_DOWN:
-                        theme_menu_index = (theme_menu_index + 1) % len(THEME_MENU_ITEMS)
+                        theme_menu_index = (theme_menu_index + 1) % THEME_MENU_COUNT
                     elif btn == BTN_DPAD_LEFT:
-                        menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                        menu_id = THEME_MENU_IDS[theme_menu_index]
                         update_theme_setting(menu_id, direction=-1)
                     elif btn == BTN_DPAD_RIGHT:
-                        menu_id = THEME_MENU_ITEMS[theme_menu_index]["id"]
+                        menu_id = THEME_MENU_IDS[theme_menu_index]
                         update_theme_setting(menu_id, direction=1)
                     repeat_state["next_time"] = current_time + get_repeat_interval(current_time - repeat_state["press_time"])
                     continue
@@ -3948,7 +5226,7 @@ while running:
                     editor = shell.editor
                     layout = get_current_editor_layout()
                     rows = len(current_layout)
-                    selecting = button_states[BTN_SELECT] and editor_nav_mode == "file"
+                    selecting = button_mask & BIT_SELECT and editor_nav_mode == "file"
                     if btn == BTN_DPAD_UP:
                         if editor_nav_mode == "keyboard":
                             prev_x, prev_y = cursor_x, cursor_y
@@ -3956,9 +5234,9 @@ while running:
                                 cursor_y = rows - 1
                             else:
                                 cursor_y -= 1
-                            cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                            cursor_x = min(cursor_x, current_row_last[cursor_y])
                             maybe_play_keyboard_click(prev_x, prev_y)
-                        elif button_states[BTN_L2]:
+                        elif button_mask & BIT_L2:
                             editor.move_page(-1, layout["max_lines"], selecting=selecting)
                         else:
                             editor.move_cursor(delta_line=-1, selecting=selecting)
@@ -3969,9 +5247,9 @@ while running:
                                 cursor_y = 0
                             else:
                                 cursor_y += 1
-                            cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                            cursor_x = min(cursor_x, current_row_last[cursor_y])
                             maybe_play_keyboard_click(prev_x, prev_y)
-                        elif button_states[BTN_L2]:
+                        elif button_mask & BIT_L2:
                             editor.move_page(1, layout["max_lines"], selecting=selecting)
                         else:
                             editor.move_cursor(delta_line=1, selecting=selecting)
@@ -3979,23 +5257,23 @@ while running:
                         if editor_nav_mode == "keyboard":
                             prev_x, prev_y = cursor_x, cursor_y
                             if cursor_x == 0:
-                                cursor_x = len(current_layout[cursor_y]) - 1
+                                cursor_x = current_row_last[cursor_y]
                             else:
                                 cursor_x -= 1
                             maybe_play_keyboard_click(prev_x, prev_y)
-                        elif button_states[BTN_R2]:
+                        elif button_mask & BIT_R2:
                             editor.move_home(selecting=selecting)
                         else:
                             editor.move_cursor(delta_col=-1, selecting=selecting)
                     elif btn == BTN_DPAD_RIGHT:
                         if editor_nav_mode == "keyboard":
                             prev_x, prev_y = cursor_x, cursor_y
-                            if cursor_x >= len(current_layout[cursor_y]) - 1:
+                            if cursor_x >= current_row_last[cursor_y]:
                                 cursor_x = 0
                             else:
                                 cursor_x += 1
                             maybe_play_keyboard_click(prev_x, prev_y)
-                        elif button_states[BTN_R2]:
+                        elif button_mask & BIT_R2:
                             editor.move_end(selecting=selecting)
                         else:
                             editor.move_cursor(delta_col=1, selecting=selecting)
@@ -4007,7 +5285,7 @@ while running:
                             cursor_y = rows - 1
                         else:
                             cursor_y -= 1
-                        cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                        cursor_x = min(cursor_x, current_row_last[cursor_y])
                         maybe_play_keyboard_click(prev_x, prev_y)
                     elif btn == BTN_DPAD_DOWN:
                         prev_x, prev_y = cursor_x, cursor_y
@@ -4016,78 +5294,111 @@ while running:
                             cursor_y = 0
                         else:
                             cursor_y += 1
-                        cursor_x = min(cursor_x, len(current_layout[cursor_y]) - 1)
+                        cursor_x = min(cursor_x, current_row_last[cursor_y])
                         maybe_play_keyboard_click(prev_x, prev_y)
                     elif btn == BTN_DPAD_LEFT:
                         prev_x, prev_y = cursor_x, cursor_y
                         # Wrap around: if at leftmost, go to rightmost
                         if cursor_x == 0:
-                            cursor_x = len(current_layout[cursor_y]) - 1
+                            cursor_x = current_row_last[cursor_y]
                         else:
                             cursor_x -= 1
                         maybe_play_keyboard_click(prev_x, prev_y)
                     elif btn == BTN_DPAD_RIGHT:
                         prev_x, prev_y = cursor_x, cursor_y
                         # Wrap around: if at rightmost, go to leftmost
-                        if cursor_x >= len(current_layout[cursor_y]) - 1:
+                        if cursor_x >= current_row_last[cursor_y]:
                             cursor_x = 0
                         else:
                             cursor_x += 1
                         maybe_play_keyboard_click(prev_x, prev_y)
                 repeat_state["next_time"] = current_time + get_repeat_interval(current_time - repeat_state["press_time"])
                 continue
+        next_repeat_time = min((state["next_time"] for state in button_repeat_state.values()), default=0)
     
     # -----------------------------
     # Rendering (only when needed)
     # -----------------------------
     # Skip rendering if nothing changed and not enough time passed
-    if not needs_redraw:
-        # Nothing to draw - sleep longer to save CPU
-        sdl2.SDL_Delay(50)  # 50ms = 20 FPS when idle
+    if not redraw_flags or window_hidden:
+        # Nothing to draw (or nowhere to show it) - block until input arrives or the next timed update is due
+        sdl2.SDL_WaitEventTimeout(None, get_idle_timeout(current_time))
         continue
     
     if current_time - last_render_time < MIN_FRAME_TIME:
-        # Too soon since last render
-        sdl2.SDL_Delay(10)
+        # Too soon since last render - wait out the frame cap, but keep taking input meanwhile
+        sdl2.SDL_WaitEventTimeout(None, MIN_FRAME_TIME - (current_time - last_render_time))
         continue
     
-    # Mark rendered and reset flag
+    # Mark rendered and reset flags
     last_render_time = current_time
-    needs_redraw = False
+    cursor_only = redraw_flags == REDRAW_CURSOR and cursor_overlay is not None and frame_texture is not None
+    redraw_flags = 0
+    if cursor_only:
+        sdl2.SDL_RenderCopy(renderer.sdlrenderer, frame_texture, None, None)
+        draw_cursor_overlay(cursor_overlay)
+        if frame_overlay is not None:
+            sdl2.SDL_RenderCopy(renderer.sdlrenderer, frame_overlay, None, None)
+        renderer.present()
+        continue
+    
+    # Apply background changes once per frame, however many menu ticks queued up
+    if background_dirty:
+        update_background_texture()
+        background_dirty = False
+    
+    # Draw the scene into frame_texture so a later blink can reuse it
+    if get_frame_texture() is not None:
+        sdl2.SDL_SetRenderTarget(renderer.sdlrenderer, frame_texture)
+    # Overlay panels cover the input line: they go into overlay_texture so the cursor can be
+    # composited between the scene and the panels, or, without one, the cursor is drawn in place
+    overlay_open = (
+        theme_menu_open
+        or show_button_map_overlay
+        or (show_editor_help_overlay and shell.in_editor_mode and shell.editor)
+        or (show_shell_help_overlay and not shell.in_editor_mode)
+    )
+    frame_overlay = get_overlay_texture() if overlay_open and frame_texture is not None else None
+    defer_cursor = not overlay_open or frame_overlay is not None
+    cursor_overlay = None
     
     theme = get_active_theme()
-    panel_alpha = theme_settings.get("panel_alpha", 210)
-    background_color = make_color(theme["background"])
+    colors = get_theme_colors(theme)  # Opaque theme colors for this frame
+    panel_alpha = theme_settings["panel_alpha"]
+    background_color = colors["background"]
     renderer.clear(background_color)
-    if background_texture and theme_settings.get("background_enabled", True):
-        dstrect = sdl2.SDL_Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
-        sdl2.SDL_RenderCopy(renderer.sdlrenderer, background_texture, None, dstrect)
-    keyboard_visible = theme_settings.get("show_keyboard", True)
+    if background_texture and theme_settings["background_enabled"]:
+        sdl2.SDL_RenderCopy(renderer.sdlrenderer, background_texture, None, None)  # Stretched over the whole target
+    keyboard_visible = theme_settings["show_keyboard"]
     keyboard_y = SCREEN_HEIGHT - 190 if keyboard_visible else SCREEN_HEIGHT - 10
     
     # Header
-    header_visible = theme_settings.get("show_header", True)
+    header_visible = theme_settings["show_header"]
     header_height = 0
     if header_visible:
         header_height = 25
         if shell.in_editor_mode and shell.editor:
             modified_flag = "*" if shell.editor.dirty else ""
             header_text = f"Editor @ {shell.editor.file_path}{modified_flag}"
-            header_color = make_color(theme["header"])
         elif shell.in_pty_mode:
             header_text = f"Shell @ {shell.cwd} [INTERACTIVE MODE] | {shell.get_header_state()}"
-            header_color = make_color(theme["header"])
         else:
             header_text = f"Shell @ {shell.cwd} | {shell.get_header_state()}"
-            header_color = make_color(theme["header"])
-        render_text(header_text, 10, 5, header_color)
+        header_color = colors["header"]
+        # The header text rarely changes, so keep its glyph batch between frames
+        header_key = (header_text, header_color, font_manager, geometry_supported)
+        if header_key != header_cache["key"]:
+            header_cache["batch"] = new_glyph_batch(font_manager)
+            queue_glyphs(header_cache["batch"], header_text, 10, 5, header_color)
+            header_cache["key"] = header_key
+        draw_glyph_batch(header_cache["batch"])
     
     # Input area (only show in normal mode)
     if not shell.in_pty_mode and not shell.in_editor_mode:
         # Insert cursor at the correct position
         display_before = input_text[:input_cursor_pos]
         display_after = input_text[input_cursor_pos:]
-        input_display = display_before + ("_" if cursor_blink else "|") + display_after
+        input_display = display_before + CURSOR_MARK + display_after
 
         prompt_text = shell.get_prompt_text()
         max_input_display = max(20, 90 - len(prompt_text))
@@ -4104,8 +5415,11 @@ while running:
         
         input_box_y = 5 + header_height
         fill_rect(renderer, make_color(theme["input_bg"], panel_alpha), (5, input_box_y, SCREEN_WIDTH-10, 30))
-        render_text(prompt_text + input_display, 10, input_box_y + 5, make_color(theme["input_text"]))
-        render_text(f"{len(input_text)}/{MAX_INPUT_LENGTH}", SCREEN_WIDTH - 80, input_box_y + 5, make_color(theme["input_counter"]))
+        display_before, _, display_after = input_display.partition(CURSOR_MARK)
+        cursor_overlay = ("text", 10, input_box_y + 5, colors["input_text"], prompt_text + display_before, display_after)
+        if not defer_cursor:
+            draw_cursor_overlay(cursor_overlay)
+        render_text(f"{len(input_text)}/{MAX_INPUT_LENGTH}", SCREEN_WIDTH - 80, input_box_y + 5, colors["input_counter"])
 
     if shell.in_editor_mode and shell.editor:
         editor = shell.editor
@@ -4119,16 +5433,10 @@ while running:
         ))
         selection = editor.get_selection_range()
         y_offset = layout["text_top"]
-        gutter_x = layout["text_left"]
         text_x = layout["text_left"] + layout["gutter_width"]
-        for i in range(layout["max_lines"]):
-            line_idx = editor.scroll_line + i
-            if line_idx >= len(editor.lines):
-                break
-            line = editor.lines[line_idx]
-            visible_line = line[editor.scroll_col:editor.scroll_col + layout["max_cols"]]
-            line_number = f"{line_idx + 1:4d}"
-            render_text(line_number, gutter_x, y_offset, make_color(theme["input_counter"]))
+        selection_color = make_color(theme["keyboard_selected"], 140)
+        visible_lines = tuple(editor.lines[editor.scroll_line:editor.scroll_line + layout["max_lines"]])
+        for line_idx, line in enumerate(visible_lines, editor.scroll_line):
             if selection:
                 (start_line, start_col), (end_line, end_col) = selection
                 if start_line <= line_idx <= end_line:
@@ -4139,23 +5447,34 @@ while running:
                     if highlight_end > highlight_start:
                         highlight_x = text_x + (highlight_start - editor.scroll_col) * char_width
                         highlight_w = (highlight_end - highlight_start) * char_width
-                        fill_rect(renderer, make_color(theme["keyboard_selected"], 140), (
+                        fill_rect(renderer, selection_color, (
                             highlight_x,
                             y_offset - 2,
                             highlight_w,
                             char_height + 4
                         ))
-            editor_segments = get_editor_line_segments(visible_line, theme)
-            render_text_segments(editor_segments, text_x, y_offset)
             y_offset += layout["line_height"]
+        # Highlights never reach into another row, so every row's text can follow them in one batch;
+        # lines are compared by identity first, so an unchanged screen is a cheap tuple compare
+        editor_text_key = (
+            visible_lines, editor.scroll_line, editor.scroll_col, layout,
+            id(theme), font_manager, char_width, geometry_supported
+        )
+        if editor_text_key != editor_text_cache["key"]:
+            editor_text_cache["batch"] = build_editor_text_batch(
+                theme, visible_lines, editor.scroll_line, editor.scroll_col, layout["max_cols"], layout
+            )
+            editor_text_cache["key"] = editor_text_key
+        draw_glyph_batch(editor_text_cache["batch"])
 
         cursor_line_offset = editor.cursor_line - editor.scroll_line
         cursor_col_offset = editor.cursor_col - editor.scroll_col
         if 0 <= cursor_line_offset < layout["max_lines"] and 0 <= cursor_col_offset < layout["max_cols"]:
             editor_cursor_x = text_x + cursor_col_offset * char_width
             editor_cursor_y = layout["text_top"] + cursor_line_offset * layout["line_height"]
-            if cursor_blink:
-                fill_rect(renderer, make_color(theme["output_prompt"]), (editor_cursor_x, editor_cursor_y, 2, char_height))
+            cursor_overlay = ("bar", editor_cursor_x, editor_cursor_y, colors["output_prompt"])
+            if not defer_cursor:
+                draw_cursor_overlay(cursor_overlay)
 
         status_text = f"{os.path.basename(editor.file_path)}"
         if editor.dirty:
@@ -4169,19 +5488,17 @@ while running:
             layout["text_right"] - layout["text_left"] + 10,
             20
         ))
-        render_text(status_text, layout["text_left"], layout["status_y"] + 2, make_color(theme["input_text"]))
+        render_text(status_text, layout["text_left"], layout["status_y"] + 2, colors["input_text"])
     else:
         # Output area
-        output_lines = shell.get_output(100)
         pty_prompt_line = ""
-        if shell.in_pty_mode and shell.pty_partial_line:
-            if shell.pty_partial_line.strip() in (">>>", "..."):
-                pty_prompt_line = shell.pty_partial_line
+        partial_line = ""
+        current_partial = shell.get_partial_line() if shell.in_pty_mode else ""
+        if current_partial:
+            if current_partial.strip() in (">>>", "..."):
+                pty_prompt_line = current_partial
             else:
-                output_lines = output_lines + [shell.pty_partial_line]
-        wrapped = []
-        for line in output_lines:
-            wrapped.extend(wrap_text(line, SCREEN_WIDTH-20))
+                partial_line = current_partial
         
         # Calculate output area based on mode
         
@@ -4196,13 +5513,15 @@ while running:
         OUTPUT_AREA_HEIGHT = output_end_y - output_start_y
         
         max_lines = OUTPUT_AREA_HEIGHT // 18
-        start_idx = max(0, len(wrapped) - max_lines - output_scroll)
-        y_offset = output_start_y
-        
-        for line in wrapped[start_idx:start_idx + max_lines]:
-            segments = get_shell_line_segments(line, theme)
-            render_text_segments(segments, 10, y_offset)
-            y_offset += 18
+        # Re-wrap and re-highlight only when something that affects the layout changed
+        output_panel_key = (
+            shell.output_version, partial_line, output_scroll, output_start_y, max_lines,
+            id(theme), font_manager, char_width, geometry_supported
+        )
+        if output_panel_key != output_panel_cache["key"]:
+            output_panel_cache["batch"] = build_output_batch(theme, partial_line, output_start_y, max_lines)
+            output_panel_cache["key"] = output_panel_key
+        draw_glyph_batch(output_panel_cache["batch"])
     
     # PTY input display (show what user is typing in interactive mode)
     # Place it between output and keyboard with clear spacing
@@ -4213,9 +5532,10 @@ while running:
 
         prompt_prefix = pty_prompt_line if pty_prompt_line else "> "
         # Show input with cursor
-        display_before = shell.pty_input_buffer[:shell.pty_input_cursor]
-        display_after = shell.pty_input_buffer[shell.pty_input_cursor:]
-        display_input = display_before + ("_" if cursor_blink else "|") + display_after
+        pty_input_text = shell.get_pty_input_text()
+        display_before = pty_input_text[:shell.pty_input_cursor]
+        display_after = pty_input_text[shell.pty_input_cursor:]
+        display_input = display_before + CURSOR_MARK + display_after
         max_input_display = 75
         if len(display_input) > max_input_display:
             left_window = max_input_display // 2
@@ -4227,81 +5547,72 @@ while running:
                 end = min(len(display_input), shell.pty_input_cursor + right_window)
                 display_input = "..." + display_input[start:end]
 
-        render_text(prompt_prefix + display_input, 10, input_y + 5, make_color(theme["pty_input_text"]))
+        display_before, _, display_after = display_input.partition(CURSOR_MARK)
+        cursor_overlay = ("text", 10, input_y + 5, colors["pty_input_text"], prompt_prefix + display_before, display_after)
+        if not defer_cursor:
+            draw_cursor_overlay(cursor_overlay)
     
     # Draw keyboard
     if keyboard_visible:
-        # Calculate centered starting position for keyboard
-        # Rows 1-4: 12 keys × 50px = 600px total width
-        keyboard_width = 600
-        keyboard_start_x = (SCREEN_WIDTH - keyboard_width) // 2  # Center horizontally
+        key_selected_color = colors["keyboard_selected"]
+        key_locked_color = colors["keyboard_locked"]
+        key_color = colors["keyboard_key"]
+        text_color = colors["keyboard_text"]
+        border_color = theme["keyboard_border"]
+        key_rects, key_count = get_keyboard_rects(layout_mode, keyboard_y)
+        sdl_renderer = renderer.sdlrenderer
         
-        for row_idx, row in enumerate(current_layout):
-            row_y = keyboard_y + row_idx * 40
-            
-            for col_idx, key in enumerate(row):
-                # Calculate position and size
-                if row_idx == 4:  # Bottom row: Alt, Space, #+=
-                    if col_idx == 0:  # Alt
-                        key_x = keyboard_start_x
-                        width = 48
-                    elif col_idx == 1:  # Space
-                        key_x = keyboard_start_x + 138
-                        width = 320  # Large space bar
-                    elif col_idx == 2:  # #+=/ABC toggle (far right)
-                        key_x = SCREEN_WIDTH - 70
-                        width = 48
-                else:
-                    # Rows 1-4: Perfect 12-column grid
-                    key_width = 50
-                    key_x = keyboard_start_x + col_idx * key_width
-                    width = 48
-                
-                height = 36
-                
-                # Highlight locked modifiers with blue color
-                is_locked_modifier = (
-                    (key == 'Ctrl' and modifier_ctrl) or
-                    (key == 'Alt' and modifier_alt) or
-                    (key == '⇧' and modifier_shift_locked)
-                )
-                
-                if col_idx == cursor_x and row_idx == cursor_y:
-                    fill_rect(renderer, make_color(theme["keyboard_selected"]), (key_x, row_y, width, height))
-                    text_color = make_color(theme["keyboard_text"])
-                elif is_locked_modifier:
-                    # Locked modifiers show in bright blue
-                    fill_rect(renderer, make_color(theme["keyboard_locked"]), (key_x, row_y, width, height))
-                    text_color = make_color(theme["keyboard_text"])
-                else:
-                    fill_rect(renderer, make_color(theme["keyboard_key"]), (key_x, row_y, width, height))
-                    text_color = make_color(theme["keyboard_text"])
-                
-                border_color = theme["keyboard_border"]
-                sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, border_color[0], border_color[1], border_color[2], 255)
-                border = sdl2.SDL_Rect(key_x, row_y, width, height)
-                sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, border)
-                
-                # Render key text centered (using larger font)
-                # Font size 18 means approximately 9px per character
-                text_x = key_x + width // 2 - len(key) * 4.5
-                text_y = row_y + 8
-                render_text_large(key, int(text_x), text_y, text_color)
+        # Locked modifiers show in bright blue; the selected key comes last so it wins over a lock
+        key_index = KEYBOARD_KEY_INDEX[layout_mode]
+        highlights = [
+            (key_index[key], key_locked_color)
+            for key, bit in MODIFIER_KEY_BITS
+            if modifier_bits & bit and key in key_index
+        ]
+        selected_index = KEYBOARD_CELL_INDEX[layout_mode].get((cursor_y, cursor_x))
+        if selected_index is not None:
+            highlights.append((selected_index, key_selected_color))
+        highlights = tuple(highlights)
+        
+        # Every key fill, highlights included, as one colored-vertex submission when geometry works
+        if not draw_keyboard_fills(layout_mode, keyboard_y, key_color, highlights):
+            # Key colors are opaque, so the few highlighted keys are simply painted over the plain fill
+            sdl2.SDL_SetRenderDrawColor(sdl_renderer, key_color.r, key_color.g, key_color.b, key_color.a)
+            sdl2.SDL_RenderFillRects(sdl_renderer, key_rects, key_count)
+            for index, color in highlights:
+                sdl2.SDL_SetRenderDrawColor(sdl_renderer, color.r, color.g, color.b, color.a)
+                sdl2.SDL_RenderFillRect(sdl_renderer, key_rects[index])
+        
+        # Keys never overlap, so all outlines can go out in one call after the fills
+        sdl2.SDL_SetRenderDrawColor(sdl_renderer, border_color[0], border_color[1], border_color[2], 255)
+        sdl2.SDL_RenderDrawRects(sdl_renderer, key_rects, key_count)
+        
+        # Key labels (larger font) only change with the layout, position, color or font
+        label_key = (layout_mode, keyboard_y, text_color, font_manager_large, geometry_supported)
+        if label_key != keyboard_label_cache["key"]:
+            keyboard_label_cache["batch"] = build_keyboard_label_batch(layout_mode, keyboard_y, text_color)
+            keyboard_label_cache["key"] = label_key
+        draw_glyph_batch(keyboard_label_cache["batch"])
     
     # Mode display state (currently hidden)
     mode_text = {"lower": "abc", "upper": "ABC", "symbols": "#+="}
     mode_display = mode_text.get(layout_mode, 'abc')
     
     # Show locked modifiers in mode display
-    if modifier_ctrl:
+    if modifier_bits & MOD_CTRL:
         mode_display += " [Ctrl]"
-    if modifier_alt:
+    if modifier_bits & MOD_ALT:
         mode_display += " [Alt]"
-    if modifier_shift_locked:
+    if modifier_bits & MOD_SHIFT_LOCKED:
         mode_display += " [⇧Lock]"
     
     # render_text(f"Mode: [{mode_display}]", 10, mode_y, sdl2.ext.Color(100, 150, 200))
     
+    if frame_overlay is not None:
+        sdl2.SDL_SetRenderTarget(renderer.sdlrenderer, frame_overlay)
+        sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, 0, 0, 0, 0)
+        sdl2.SDL_RenderClear(renderer.sdlrenderer)
+    
     if not theme_menu_open:
         if show_button_map_overlay:
             render_button_map_screen(theme)
@@ -4325,67 +5636,67 @@ while running:
         menu_x = (SCREEN_WIDTH - menu_width) // 2
         menu_y = (SCREEN_HEIGHT - menu_height) // 2
         fill_rect(renderer, make_color(theme["input_bg"], min(panel_alpha + 30, 255)), (menu_x, menu_y, menu_width, menu_height))
-        sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, theme["keyboard_border"][0], theme["keyboard_border"][1], theme["keyboard_border"][2], 255)
-        border = sdl2.SDL_Rect(menu_x, menu_y, menu_width, menu_height)
-        sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, border)
+        menu_border_r, menu_border_g, menu_border_b = theme["keyboard_border"][:3]
+        sdl2.SDL_SetRenderDrawColor(renderer.sdlrenderer, menu_border_r, menu_border_g, menu_border_b, 255)
+        shape_rect.x, shape_rect.y, shape_rect.w, shape_rect.h = menu_x, menu_y, menu_width, menu_height
+        sdl2.SDL_RenderDrawRect(renderer.sdlrenderer, shape_rect)
         
-        render_text_centered("Theme Control Center", menu_x + menu_width / 2, menu_y + 8, make_color(theme["header"]), ui_font_manager)
+        render_text_centered("Theme Control Center", menu_x + menu_width / 2, menu_y + 8, colors["header"], ui_font_manager)
         item_y = menu_y + 35
-        for index, item in enumerate(THEME_MENU_ITEMS):
-            item_color = make_color(theme["output_text"])
-            if index == theme_menu_index:
-                item_color = make_color(theme["output_prompt"])
-            label = item["label"]
-            value = ""
-            if item["id"] == "theme":
-                value = theme_settings.get("selected_theme", "Classic")
-            elif item["id"] == "font":
-                options = {path: label for label, path in get_font_options()}
-                value = options.get(theme_settings.get("font_path", ""), "Default")
-            elif item["id"] == "font_size":
-                value = f"{theme_settings.get('font_size', 14)}"
-            elif item["type"] == "toggle":
-                value = "On" if theme_settings.get(item["id"], True) else "Off"
-            elif item["type"] == "gauge":
-                value = ""
-            elif item["type"] == "action":
-                value = "Open"
-            elif item["type"] == "path":
-                current_path = theme_settings.get("background_image", "")
-                value = os.path.basename(current_path) if current_path else "None"
-            render_text_ui(f"{label}:", menu_x + 12, item_y, item_color)
-            value_x = menu_x + 210
-            if item["type"] == "gauge":
-                value_x = menu_x + 170
-            render_text_ui(value, value_x, item_y, item_color)
+        menu_item_color = colors["output_text"]
+        menu_selected_color = colors["output_prompt"]
+        # Gauge bars are gathered per color and filled after the labels they never overlap
+        gauge_tracks = []
+        gauge_fills = []
+        for index, (item_id, label_text, item_type, get_value) in enumerate(
+            zip(THEME_MENU_IDS, THEME_MENU_LABEL_TEXTS, THEME_MENU_TYPES, THEME_MENU_VALUE_GETTERS)
+        ):
+            item_color = menu_selected_color if index == theme_menu_index else menu_item_color
+            render_text_ui(label_text, menu_x + 12, item_y, item_color)
+            render_text_ui(get_value(item_id), menu_x + 210, item_y, item_color)
             
-            if item["type"] == "gauge":
+            if item_type == "gauge":
                 gauge_width = 110
                 gauge_height = 8
                 gauge_x = menu_x + 210
                 gauge_y = item_y + 5
-                fill_rect(renderer, make_color(theme["keyboard_border"], 200), (gauge_x, gauge_y, gauge_width, gauge_height))
-                if item["id"] == "background_alpha":
-                    current_alpha = theme_settings.get("background_alpha", 255)
-                    filled = int(current_alpha / 255 * gauge_width)
+                gauge_tracks.append((gauge_x, gauge_y, gauge_width, gauge_height))
+                if item_id == "background_alpha":
+                    current_alpha = theme_settings["background_alpha"]
+                    filled = current_alpha * gauge_width // 255
                 else:
-                    current_alpha = theme_settings.get("panel_alpha", 210)
-                    filled = int((current_alpha - 60) / (255 - 60) * gauge_width)
-                fill_rect(renderer, make_color(theme["output_prompt"]), (gauge_x, gauge_y, max(4, filled), gauge_height))
+                    current_alpha = theme_settings["panel_alpha"]
+                    filled = (current_alpha - 60) * gauge_width // (255 - 60)
+                gauge_fills.append((gauge_x, gauge_y, max(4, filled), gauge_height))
             item_y += 28
+        fill_rects(renderer, make_color(theme["keyboard_border"], 200), gauge_tracks)
+        fill_rects(renderer, colors["output_prompt"], gauge_fills)
     
+    if frame_texture is not None:
+        sdl2.SDL_SetRenderTarget(renderer.sdlrenderer, None)
+        sdl2.SDL_RenderCopy(renderer.sdlrenderer, frame_texture, None, None)
+    if not defer_cursor:
+        cursor_overlay = None
+    elif cursor_overlay is not None:
+        draw_cursor_overlay(cursor_overlay)
+    if frame_overlay is not None:
+        sdl2.SDL_RenderCopy(renderer.sdlrenderer, frame_overlay, None, None)
     renderer.present()
-    sdl2.SDL_Delay(MIN_FRAME_TIME)
 
 # -----------------------------
 # Cleanup
 # -----------------------------
 
 print("Shutting down...")
+shell.flush_history()
 if joystick:
     sdl2.SDL_JoystickClose(joystick)
 if background_texture:
     sdl2.SDL_DestroyTexture(background_texture)
+if frame_texture:
+    sdl2.SDL_DestroyTexture(frame_texture)
+if overlay_texture:
+    sdl2.SDL_DestroyTexture(overlay_texture)
 shutdown_audio()
 renderer.destroy()
 window.close()